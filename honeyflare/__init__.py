@@ -1,10 +1,21 @@
-import gzip
+import base64
+import itertools
 import os
 import time
-
-import orjson
-from google.api_core.exceptions import PreconditionFailed
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import google_crc32c
+import requests
+from google.api_core.exceptions import (
+    GatewayTimeout,
+    InternalServerError,
+    PreconditionFailed,
+    ServiceUnavailable,
+    TooManyRequests,
+)
 from opentelemetry import trace
+from opentelemetry.exporter.otlp.proto.http import Compression
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
@@ -13,14 +24,69 @@ from opentelemetry.sdk.trace.id_generator import IdGenerator, RandomIdGenerator
 from opentelemetry.trace import NonRecordingSpan, SpanContext, TraceFlags
 from urllib3.exceptions import HTTPError
 
-from . import enrichment
-from .exceptions import RetriableError
+from . import decompress, enrichment, otlp
+from .checkpoints import (
+    Checkpoint,
+    clear_checkpoint,
+    read_checkpoint,
+    write_checkpoint,
+)
+from .coercion import AttributeCoercer
+from .coercion import coerce_attribute_value as _coerce_attribute_value
+from .compress import NONE as NO_COMPRESSION
+from .compress import CompressingSession, Compressor
+from .exceptions import DeadlineReachedError, RetriableError
+from .ipranges import get_ip_ranges
 from .locks import GCSLock
+from .projection import get_field_projection
+from .rawfields import get_raw_field_decoder
 from .sampler import Sampler
-from .urlshape import compile_pattern
+from .spanprocessor import (
+    SPAN_PROCESSORS,
+    BlockingBatchSpanProcessor,
+    export_worker_attributes,
+)
+from .urlshape import compile_pattern, get_url_shaper
 from .version import __version__
 
 
+DOWNLOAD_MODES = ("stream", "file", "ranged")
+
+# "sdk" creates spans with the OTel SDK, "direct" encodes them into OTLP requests
+# straight from the log entries, see `otlp.DirectSpanExporter`
+EXPORT_ENGINES = ("sdk", "direct")
+
+# Bytes fetched per ranged request when streaming an object. Bounds the memory
+# held for the compressed data to roughly this size, independent of the size of
+# the object.
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Size of each byte range and the number of ranges fetched concurrently by the
+# ranged download mode.
+RANGED_CHUNK_SIZE = 16 * 1024 * 1024
+RANGED_MAX_WORKERS = 8
+
+# How often, in seconds, progress is flushed and checkpointed while processing an
+# object
+CHECKPOINT_INTERVAL_SECONDS = 60
+
+# The deadline is only checked every this many lines to keep it off the hot path
+DEADLINE_CHECK_LINES = 1024
+
+# Errors of a download that a retry can get past. PreconditionFailed is raised
+# when the object is replaced (its generation changes) while being downloaded.
+_RETRIABLE_DOWNLOAD_ERRORS = (
+    HTTPError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    GatewayTimeout,
+    InternalServerError,
+    PreconditionFailed,
+    ServiceUnavailable,
+    TooManyRequests,
+)
+
+
 def process_bucket_object(
     bucket,
     object_name,
@@ -29,6 +95,27 @@ def process_bucket_object(
     query_param_filter=None,
     sampling_rate_by_status=None,
     lock_bucket=None,
+    download_mode="stream",
+    stream_chunk_size=None,
+    ranged_chunk_size=None,
+    ranged_max_workers=None,
+    decompression_backend=None,
+    threaded_decompression=True,
+    deadline=None,
+    checkpoint_interval=None,
+    sampler=None,
+    max_inferred_shapes=None,
+    client_ip_ranges=None,
+    field_allowlist=None,
+    field_denylist=None,
+    raw_fields=None,
+    export_engine="sdk",
+    span_processor="batch",
+    span_queue_size=None,
+    span_batch_size=None,
+    export_workers=1,
+    compression=NO_COMPRESSION,
+    compression_level=None,
 ):
     """
     :param bucket: A `google.cloud.storage.bucket.Bucket` logs should be
@@ -37,7 +124,8 @@ def process_bucket_object(
     :param honeycomb_api: The base URL OTLP traces are sent to. Typically a
         Refinery configured with `SendKeyMode: missingonly` so the ingest
         key is injected on egress; Honeycomb E&S routes by `service.name`.
-    :param patterns: A list of path patterns to match against.
+    :param patterns: A list of path patterns to match against, or a dict mapping
+        hosts to such lists, see `.urlshape.UrlShaper`.
     :param query_param_filter: A set of query parameters to allow. If None, all
         will be allowed. If empty, none.
     :param sampling_rate_by_status: A dictionary mapping a status code to a
@@ -46,23 +134,142 @@ def process_bucket_object(
     :param lock_bucket: If you want to use a dedicated bucket for holding locks
         and completion status, pass it here. Otherwise the bucket that holds the
         logs will be used (requires write access to that bucket).
+    :param download_mode: "stream" to read the object through a chunked GCS
+        reader straight into the gzip decoder, keeping memory flat regardless
+        of object size, "file" to download it to `/tmp` (a tmpfs) first, or
+        "ranged" to download it to `/tmp` as byte ranges fetched concurrently.
+    :param stream_chunk_size: The number of bytes fetched per request when
+        streaming. Defaults to `STREAM_CHUNK_SIZE`.
+    :param ranged_chunk_size: The size of each byte range in the ranged download
+        mode. Defaults to `RANGED_CHUNK_SIZE`.
+    :param ranged_max_workers: The number of byte ranges fetched concurrently in
+        the ranged download mode. Defaults to `RANGED_MAX_WORKERS`.
+    :param decompression_backend: The name of the gzip implementation to use, see
+        `decompress.BACKENDS`. Defaults to the fastest one installed.
+    :param threaded_decompression: Decompress in a background thread so inflate
+        overlaps with processing the lines.
+    :param deadline: A `time.monotonic()` value after which processing stops
+        cleanly and `DeadlineReachedError` is raised. When the export reports
+        lost spans (see `checkpoint_interval`) the progress made is checkpointed,
+        so the retry picks up where this invocation left off, otherwise the retry
+        starts over.
+    :param checkpoint_interval: Seconds between progress checkpoints, which are
+        stored next to the lock in the lock bucket. A retry after a failure
+        skips the lines that were already exported. Needs the "direct" export
+        engine or the "blocking" span processor, as the SDK's processor doesn't
+        tell when spans are lost. None to disable, `CHECKPOINT_INTERVAL_SECONDS`
+        is a sensible interval.
+    :param sampler: The `Sampler` applying `sampling_rate_by_status`. Samplers
+        hold state for a single file, so pass a new one for every call. Defaults
+        to random head sampling.
+    :param max_inferred_shapes: Infer the PathShape of paths matching no pattern
+        by replacing segments that look like IDs with placeholders, with at most
+        this many distinct shapes. None to use the path as is.
+    :param client_ip_ranges: A dict mapping CIDR ranges to labels, which are set
+        as ClientIPRange for client IPs in them (the most specific range wins).
+    :param field_allowlist: A list of the log fields to send, either names or
+        globs like `Edge*`. None to send all of them. The fields spans are built
+        from are always kept, see `projection.REQUIRED_FIELDS`.
+    :param field_denylist: A list of log fields (or globs) not to send, even if
+        they're in `field_allowlist`.
+    :param raw_fields: A list of fields with JSON object values (ie
+        RequestHeaders) to send as the JSON text in the log line, rather than
+        parsing them only to serialize them again. Sets the `loads` of the
+        sampler, see `rawfields.RawFieldDecoder`.
+    :param export_engine: One of `EXPORT_ENGINES`. Spans have the same IDs
+        either way.
+    :param span_processor: One of `spanprocessor.SPAN_PROCESSORS`, for the "sdk"
+        export engine. "blocking" slows processing down to the pace of exports
+        rather than dropping spans when they can't keep up. The direct export
+        engine always blocks.
+    :param span_queue_size: The max number of spans waiting to be exported.
+    :param span_batch_size: The max number of spans sent per export request.
+    :param export_workers: The number of batches exported at once with the
+        "blocking" span processor or the direct export engine, over a shared
+        pool of connections.
+    :param compression: "none" or one of `compress.ALGORITHMS` to compress
+        export requests with.
+    :param compression_level: The level to compress at, defaults to
+        `compress.DEFAULT_LEVELS`.
     """
+    if download_mode not in DOWNLOAD_MODES:
+        raise ValueError("Unknown download mode %r" % download_mode)
+
+    if export_engine not in EXPORT_ENGINES:
+        raise ValueError("Unknown export engine %r" % export_engine)
+
     if sampling_rate_by_status is None:
         sampling_rate_by_status = {}
 
     if lock_bucket is None:
         lock_bucket = bucket
 
-    compiled_patterns = [compile_pattern(p) for p in patterns or []]
+    if sampler is None:
+        sampler = Sampler()
+
+    raw_field_decoder = get_raw_field_decoder(raw_fields)
+    if raw_field_decoder is not None:
+        sampler.loads = raw_field_decoder.loads
+
+    url_shaper = get_url_shaper(patterns, query_param_filter, max_inferred_shapes)
+    url_shaper_cache_info = url_shaper.cache_info()
+    # The inferrer is shared between invocations, like the cache, so its counts are
+    # reported as the difference from here
+    inferrer = url_shaper.path_shape_inferrer
+    if inferrer is not None:
+        inferred_shapes, inferred_overflowed = len(inferrer.shapes), inferrer.overflowed
+    ip_ranges = get_ip_ranges(client_ip_ranges)
+    projection = get_field_projection(field_allowlist, field_denylist)
+    coercer = AttributeCoercer()
+    projected_bytes = 0
     id_generator = _RayIdGenerator()
-    tracer, provider = create_otel_tracer(
-        service_name="cloudflare",
-        honeycomb_api=honeycomb_api,
-        id_generator=id_generator,
-    )
+    direct_exporter = None
+    # Counts spans when the export engine can, and the bytes sent when compressing
+    export_stats = Counter()
+    counts_spans = export_engine == "direct" or span_processor == "blocking"
+    if checkpoint_interval is not None and not counts_spans:
+        raise ValueError(
+            "Checkpoints need the direct export engine or blocking span processor"
+        )
+    if export_engine == "direct":
+        batch_size = span_batch_size or otlp.BATCH_SIZE
+        max_pending_batches = otlp.MAX_PENDING_BATCHES
+        if span_queue_size is not None:
+            max_pending_batches = max(span_queue_size // batch_size, 1)
+        session = None
+        if compression != NO_COMPRESSION or export_workers > 1:
+            compressor = None
+            if compression != NO_COMPRESSION:
+                compressor = Compressor(compression, compression_level)
+            session = _create_export_session(export_workers, compressor, export_stats)
+        # Has the force_flush and shutdown of a provider
+        direct_exporter = provider = otlp.DirectSpanExporter(
+            _traces_endpoint(honeycomb_api),
+            _create_resource("cloudflare"),
+            batch_size=batch_size,
+            max_pending_batches=max_pending_batches,
+            session=session,
+            stats=export_stats,
+            export_workers=export_workers,
+        )
+        tracer = None
+    else:
+        tracer, provider = create_otel_tracer(
+            service_name="cloudflare",
+            honeycomb_api=honeycomb_api,
+            id_generator=id_generator,
+            span_processor=span_processor,
+            max_queue_size=span_queue_size,
+            max_export_batch_size=span_batch_size,
+            export_workers=export_workers,
+            compression=compression,
+            compression_level=compression_level,
+            stats=export_stats,
+        )
 
     lock = GCSLock(lock_bucket, "locks/%s" % object_name)
     total_events = 0
+    local_path = None
     try:
         with lock:
             if is_already_processed(lock_bucket, object_name):
@@ -70,48 +277,171 @@ def process_bucket_object(
                 # function succeeded in the meantime
                 return
 
-            local_path = download_file(bucket, object_name)
-
-            sampler = Sampler()
-            source = get_raw_file_entries(local_path)
-            for sample_rate, entry in sampler.sample_lines(source, sampling_rate_by_status):
-                enrichment.enrich_entry(entry, compiled_patterns, query_param_filter)
+            checkpoint = read_checkpoint(lock_bucket, object_name)
+            if checkpoint is None:
+                checkpoint = Checkpoint(line_offset=0, spans_flushed=0)
+            else:
+                trace.get_current_span().set_attribute(
+                    "checkpoint.resumed_line_offset", checkpoint.line_offset
+                )
 
-                start_time_ns = int(entry["EdgeEndTimestamp"])
-                context, trace_id, span_id = _build_trace_context(
-                    entry.get("RayID"), entry.get("ParentRayID")
+            if download_mode == "file":
+                local_path = download_file(bucket, object_name)
+                source = get_raw_file_entries(
+                    local_path,
+                    backend=decompression_backend,
+                    threaded=threaded_decompression,
+                )
+            elif download_mode == "ranged":
+                local_path = download_file_ranged(
+                    bucket,
+                    object_name,
+                    chunk_size=ranged_chunk_size,
+                    max_workers=ranged_max_workers,
+                )
+                source = get_raw_file_entries(
+                    local_path,
+                    backend=decompression_backend,
+                    threaded=threaded_decompression,
                 )
-                id_generator.set_next(trace_id=trace_id, span_id=span_id)
+            else:
+                source = stream_file_entries(
+                    bucket,
+                    object_name,
+                    chunk_size=stream_chunk_size,
+                    backend=decompression_backend,
+                    threaded=threaded_decompression,
+                )
+
+            source = itertools.islice(source, checkpoint.line_offset, None)
+            lines = _LineCounter(source, checkpoint.line_offset, deadline)
+
+            def save_checkpoint():
+                # Only lines whose spans have actually been exported are safe
+                # to skip on a retry. A span lost at any point means the lines
+                # before it weren't all exported, so no checkpoint is safe after.
+                if not counts_spans:
+                    return
+                if provider.force_flush() and not export_stats["dropped"]:
+                    write_checkpoint(
+                        lock_bucket,
+                        object_name,
+                        Checkpoint(
+                            line_offset=lines.count - sampler.buffered_lines,
+                            spans_flushed=checkpoint.spans_flushed + total_events,
+                        ),
+                    )
 
-                span = tracer.start_span(
-                    "HTTP %s" % entry.get("ClientRequestMethod", "N/A"),
-                    context=context,
-                    start_time=start_time_ns,
+            next_checkpoint = None
+            if checkpoint_interval is not None:
+                next_checkpoint = time.monotonic() + checkpoint_interval
+
+            for sample_rate, entry in sampler.sample_lines(lines, sampling_rate_by_status):
+                if projection is not None:
+                    projected_bytes += projection.project(entry)
+
+                enrichment.enrich_entry(
+                    entry,
+                    url_shaper.patterns,
+                    query_param_filter,
+                    url_shaper=url_shaper,
+                    ip_ranges=ip_ranges,
                 )
-                try:
-                    span.set_attribute("SampleRate", sample_rate)
-                    span.set_attribute(
-                        "MetaProcessor", "honeyflare/%s" % __version__
+
+                start_time_ns = int(entry["EdgeEndTimestamp"])
+                span_name = "HTTP %s" % entry.get("ClientRequestMethod", "N/A")
+                if direct_exporter is not None:
+                    attributes = {
+                        "SampleRate": sample_rate,
+                        "MetaProcessor": "honeyflare/%s" % __version__,
+                    }
+                    attributes.update(coercer.coerce(entry))
+                    direct_exporter.add_span(
+                        span_name,
+                        start_time_ns,
+                        *_span_ids(entry.get("RayID"), entry.get("ParentRayID")),
+                        attributes,
+                    )
+                    total_events += 1
+                else:
+                    context, trace_id, span_id = _build_trace_context(
+                        entry.get("RayID"), entry.get("ParentRayID")
                     )
-                    span.set_attributes(
-                        {
-                            k: _coerce_attribute_value(v)
-                            for k, v in entry.items()
-                            if v is not None
-                        }
+                    id_generator.set_next(trace_id=trace_id, span_id=span_id)
+
+                    span = tracer.start_span(
+                        span_name, context=context, start_time=start_time_ns
                     )
-                finally:
-                    span.end(end_time=start_time_ns)
-                total_events += 1
+                    try:
+                        span.set_attribute("SampleRate", sample_rate)
+                        span.set_attribute(
+                            "MetaProcessor", "honeyflare/%s" % __version__
+                        )
+                        span.set_attributes(coercer.coerce(entry))
+                    finally:
+                        span.end(end_time=start_time_ns)
+                    total_events += 1
+
+                if next_checkpoint is not None and time.monotonic() >= next_checkpoint:
+                    save_checkpoint()
+                    next_checkpoint = time.monotonic() + checkpoint_interval
+
+            if lines.deadline_reached:
+                save_checkpoint()
+                raise DeadlineReachedError(
+                    "Stopped at line %d of %s" % (lines.count, object_name)
+                )
 
-            os.remove(local_path)
             mark_as_processed(lock_bucket, object_name)
+            clear_checkpoint(lock_bucket, object_name)
     finally:
         provider.shutdown()
+        if local_path is not None:
+            _remove_if_exists(local_path)
+        meta_span = trace.get_current_span()
+        cache_info = url_shaper.cache_info()
+        meta_span.set_attribute(
+            "urlshape_cache.hits", cache_info.hits - url_shaper_cache_info.hits
+        )
+        meta_span.set_attribute(
+            "urlshape_cache.misses", cache_info.misses - url_shaper_cache_info.misses
+        )
+        meta_span.set_attribute("urlshape_cache.size", cache_info.currsize)
+        if sampler.missing_status_lines:
+            meta_span.set_attribute(
+                "sampler.missing_status_lines", sampler.missing_status_lines
+            )
+        if counts_spans:
+            for key in ("exported", "retried", "dropped"):
+                meta_span.set_attribute("export.spans_%s" % key, export_stats[key])
+        meta_span.set_attributes(export_worker_attributes(export_stats))
+        if compression != NO_COMPRESSION:
+            for key in ("uncompressed_bytes", "compressed_bytes"):
+                meta_span.set_attribute("export.%s" % key, export_stats[key])
+        if projection is not None:
+            meta_span.set_attribute("projection.bytes_dropped", projected_bytes)
+        if inferrer is not None:
+            meta_span.set_attribute(
+                "urlshape_inferred.shapes", len(inferrer.shapes) - inferred_shapes
+            )
+            meta_span.set_attribute(
+                "urlshape_inferred.overflowed", inferrer.overflowed - inferred_overflowed
+            )
     return total_events
 
 
-def create_otel_tracer(service_name, honeycomb_api, id_generator=None):
+def create_otel_tracer(
+    service_name,
+    honeycomb_api,
+    id_generator=None,
+    span_processor="batch",
+    max_queue_size=None,
+    max_export_batch_size=None,
+    export_workers=1,
+    compression=NO_COMPRESSION,
+    compression_level=None,
+    stats=None,
+):
     """
     Build an OTel tracer + provider pointed at a Honeycomb (or proxy)
     endpoint over OTLP HTTP. service.name is set as a resource attribute
@@ -130,21 +460,103 @@ def create_otel_tracer(service_name, honeycomb_api, id_generator=None):
     (e.g. `_RayIdGenerator`) when span/trace IDs need to be derived from
     upstream identifiers so Refinery reassembles multi-span traces.
 
+    span_processor is one of `spanprocessor.SPAN_PROCESSORS`. The SDK's "batch"
+    processor drops spans when its queue of max_queue_size spans is full,
+    "blocking" makes ending spans wait instead, and counts the spans exported,
+    retried and dropped in the `collections.Counter` passed as stats. Both
+    default to the SDK's queue and batch sizes.
+
+    export_workers > 1 (which needs the "blocking" processor) exports that many
+    batches at once, rather than waiting for each response before sending the
+    next batch. The workers share a session with a keep-alive connection each.
+
+    compression is "none" (the default) or one of `compress.ALGORITHMS`, to
+    compress requests at compression_level. The bytes sent before and after
+    compression are counted in stats too.
+
     Returns (tracer, provider). Callers should call provider.shutdown() at
     the end of the scope to flush buffered spans.
     """
-    resource = Resource.create(
+    if span_processor not in SPAN_PROCESSORS:
+        raise ValueError("Unknown span processor %r" % span_processor)
+    if export_workers > 1 and span_processor != "blocking":
+        raise ValueError("Multiple export workers need the blocking span processor")
+
+    provider = TracerProvider(
+        resource=_create_resource(service_name), id_generator=id_generator
+    )
+    compressor = None
+    if compression != NO_COMPRESSION:
+        compressor = Compressor(compression, compression_level)
+
+    exporter_options = {}
+    if compressor is not None or export_workers > 1:
+        exporter_options["session"] = _create_export_session(
+            export_workers, compressor, stats
+        )
+    if compressor is not None:
+        # Compressed by the session instead
+        exporter_options["compression"] = Compression.NoCompression
+    exporter = OTLPSpanExporter(
+        endpoint=_traces_endpoint(honeycomb_api),
+        **exporter_options,
+    )
+    sizes = {}
+    if max_queue_size is not None:
+        sizes["max_queue_size"] = max_queue_size
+    if max_export_batch_size is not None:
+        sizes["max_export_batch_size"] = max_export_batch_size
+    if span_processor == "blocking":
+        processor = BlockingBatchSpanProcessor(
+            exporter, export_workers=export_workers, stats=stats, **sizes
+        )
+    else:
+        processor = BatchSpanProcessor(exporter, **sizes)
+    provider.add_span_processor(processor)
+    return provider.get_tracer("honeyflare"), provider
+
+
+def _create_export_session(pool_size, compressor=None, stats=None):
+    if compressor is not None:
+        session = CompressingSession(compressor, stats)
+    else:
+        session = requests.Session()
+    if pool_size > 1:
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    return session
+
+
+def _create_resource(service_name):
+    return Resource.create(
         {
             "service.name": service_name,
             "service.version": __version__,
         }
     )
-    provider = TracerProvider(resource=resource, id_generator=id_generator)
-    exporter = OTLPSpanExporter(
-        endpoint="%s/v1/traces" % honeycomb_api.rstrip("/"),
-    )
-    provider.add_span_processor(BatchSpanProcessor(exporter))
-    return provider.get_tracer("honeyflare"), provider
+
+
+def _traces_endpoint(honeycomb_api):
+    return "%s/v1/traces" % honeycomb_api.rstrip("/")
+
+
+def _span_ids(ray_id, parent_ray_id):
+    """
+    The OTel IDs of the span for a cloudflare log line, see `_build_trace_context`
+    for how they're derived.
+
+    :returns: A tuple of (trace_id, span_id, parent_span_id) as ints, where
+        parent_span_id is None for worker requests. All None when ray_id is
+        absent.
+    """
+    if not ray_id:
+        return None, None, None
+    span_id = _ray_to_int(ray_id)
+    if parent_ray_id and parent_ray_id != "00":
+        parent_span_id = _ray_to_int(parent_ray_id)
+        return parent_span_id, span_id, parent_span_id
+    return span_id, span_id, None
 
 
 def _build_trace_context(ray_id, parent_ray_id):
@@ -178,14 +590,11 @@ def _build_trace_context(ray_id, parent_ray_id):
     When ray_id is absent, returns (Context(), None, None) so the caller
     uses OTel's default random IDs.
     """
-    if not ray_id:
+    trace_id, span_id, parent_span_id = _span_ids(ray_id, parent_ray_id)
+    if trace_id is None:
         return trace.Context(), None, None
 
-    span_id = _ray_to_int(ray_id)
-
-    if parent_ray_id and parent_ray_id != "00":
-        parent_span_id = _ray_to_int(parent_ray_id)
-        trace_id = _ray_to_int(parent_ray_id)
+    if parent_span_id is not None:
         parent_ctx = SpanContext(
             trace_id=trace_id,
             span_id=parent_span_id,
@@ -194,12 +603,35 @@ def _build_trace_context(ray_id, parent_ray_id):
         )
         context = trace.set_span_in_context(NonRecordingSpan(parent_ctx))
     else:
-        trace_id = _ray_to_int(ray_id)
         context = trace.Context()
 
     return context, trace_id, span_id
 
 
+class _LineCounter:
+    """Counts the lines consumed from `lines`, stopping early (as if the file had
+    ended) once `deadline` has passed."""
+
+    def __init__(self, lines, count=0, deadline=None):
+        self._lines = lines
+        self.count = count
+        self.deadline = deadline
+        self.deadline_reached = False
+
+    def __iter__(self):
+        deadline = self.deadline
+        for line in self._lines:
+            self.count += 1
+            yield line
+            if (
+                deadline is not None
+                and not self.count % DEADLINE_CHECK_LINES
+                and time.monotonic() >= deadline
+            ):
+                self.deadline_reached = True
+                return
+
+
 def _ray_to_int(ray_id):
     return int(ray_id, 16)
 
@@ -235,27 +667,6 @@ class _RayIdGenerator(IdGenerator):
         return self._fallback.generate_span_id()
 
 
-def _coerce_attribute_value(value):
-    """
-    Coerce a cloudflare log entry value into a type OTel will accept on a
-    span attribute. Mirrors libhoney's "JSON-everything" behavior: dicts
-    (ResponseHeaders, Cookies, RequestHeaders, JA4Signals, etc.) and
-    mixed-type sequences become JSON strings so they land in Honeycomb
-    as queryable-by-substring fields rather than being dropped with a
-    per-attribute warning on every span.
-
-    None values should be filtered by the caller.
-    """
-    if isinstance(value, (str, bool, int, float)):
-        return value
-    if isinstance(value, (list, tuple)):
-        # OTel accepts sequences of primitives directly. Drop Nones and
-        # let them through; fall back to JSON for mixed-type sequences.
-        if all(el is None or isinstance(el, (str, bool, int, float)) for el in value):
-            return [el for el in value if el is not None]
-    return orjson.dumps(value).decode("utf-8")
-
-
 def is_already_processed(lock_bucket, object_name):
     try:
         return _processed_blob(lock_bucket, object_name).exists()
@@ -300,6 +711,98 @@ def download_file(bucket, object_name):
     return local_path
 
 
-def get_raw_file_entries(input_file):
-    with gzip.open(input_file, "rt") as fh:
-        yield from fh
+def _remove_if_exists(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def download_file_ranged(bucket, object_name, chunk_size=None, max_workers=None):
+    """
+    Download the object to `/tmp` by fetching byte ranges of it concurrently and
+    writing them out in order. Every range is pinned to the generation of the
+    object at the time we started, and the crc32c of the result is compared with
+    the one GCS holds for the object, so a partial or mixed download is never
+    processed (it's raised as a `RetriableError` instead).
+    """
+    chunk_size = chunk_size or RANGED_CHUNK_SIZE
+    max_workers = max_workers or RANGED_MAX_WORKERS
+
+    blob = bucket.blob(object_name)
+    local_path = "/tmp/" + os.path.basename(object_name)
+    try:
+        blob.reload()
+    except _RETRIABLE_DOWNLOAD_ERRORS as ex:
+        raise RetriableError() from ex
+
+    def fetch(start):
+        return blob.download_as_bytes(
+            start=start,
+            end=min(start + chunk_size, blob.size) - 1,
+            raw_download=True,
+            if_generation_match=blob.generation,
+            checksum=None,
+        )
+
+    checksum = google_crc32c.Checksum()
+    try:
+        with open(local_path, "wb") as fh, ThreadPoolExecutor(max_workers) as executor:
+            # Keep at most max_workers ranges in flight (or waiting to be written)
+            # so a slow range doesn't make us buffer the rest of the object
+            in_flight = deque()
+            for start in range(0, blob.size, chunk_size):
+                if len(in_flight) >= max_workers:
+                    data = in_flight.popleft().result()
+                    checksum.update(data)
+                    fh.write(data)
+                in_flight.append(executor.submit(fetch, start))
+            while in_flight:
+                data = in_flight.popleft().result()
+                checksum.update(data)
+                fh.write(data)
+
+        if blob.crc32c is not None:
+            crc32c = base64.b64encode(checksum.digest()).decode("utf-8")
+            if crc32c != blob.crc32c:
+                raise RetriableError(
+                    "crc32c mismatch for %s: expected %s, got %s"
+                    % (object_name, blob.crc32c, crc32c)
+                )
+    except _RETRIABLE_DOWNLOAD_ERRORS as ex:
+        _remove_if_exists(local_path)
+        raise RetriableError() from ex
+    except BaseException:
+        _remove_if_exists(local_path)
+        raise
+
+    return local_path
+
+
+def get_raw_file_entries(input_file, backend=None, threaded=True):
+    """
+    Yields the lines of the gzipped file as `bytes`. Lines are never decoded to
+    `str`: the sampler scans the bytes and orjson parses them directly, so lines
+    that are sampled away cost no decoding at all.
+    """
+    with decompress.open_gzip(input_file, backend) as fh:
+        yield from decompress.iter_lines(fh, threaded=threaded)
+
+
+def stream_file_entries(
+    bucket, object_name, chunk_size=None, backend=None, threaded=True
+):
+    """
+    Read the gzipped object through a chunked reader and decompress it
+    incrementally, yielding lines as soon as they have been downloaded instead
+    of staging the whole object in `/tmp` first.
+    """
+    blob = bucket.blob(object_name)
+    try:
+        with blob.open(
+            "rb", chunk_size=chunk_size or STREAM_CHUNK_SIZE, raw_download=True
+        ) as reader:
+            with decompress.open_gzip(reader, backend) as fh:
+                yield from decompress.iter_lines(fh, threaded=threaded)
+    except _RETRIABLE_DOWNLOAD_ERRORS as ex:
+        raise RetriableError() from ex
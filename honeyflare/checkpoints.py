@@ -0,0 +1,51 @@
+from collections import namedtuple
+
+import orjson
+from google.api_core.exceptions import NotFound
+
+from .exceptions import RetriableError
+
+
+# Progress made processing an object: the number of lines of the (decompressed)
+# object that have been fully handled, and the number of spans that were
+# exported for them. Only written after the spans have been flushed, so a retry
+# can skip `line_offset` lines without losing anything.
+Checkpoint = namedtuple("Checkpoint", "line_offset spans_flushed")
+
+
+def read_checkpoint(bucket, object_name):
+    """
+    :returns: The last `Checkpoint` written for the object, or None if there is
+        none.
+    """
+    try:
+        data = _checkpoint_blob(bucket, object_name).download_as_bytes()
+    except NotFound:
+        return None
+    except Exception as ex:
+        raise RetriableError() from ex
+    return Checkpoint(**orjson.loads(data))
+
+
+def write_checkpoint(bucket, object_name, checkpoint):
+    try:
+        _checkpoint_blob(bucket, object_name).upload_from_string(
+            orjson.dumps(checkpoint._asdict()), content_type="application/json"
+        )
+    except Exception:  # pylint: disable=broad-except
+        # A missing checkpoint only means a retry redoes more work, which is
+        # better than failing (and redoing all of it)
+        pass
+
+
+def clear_checkpoint(bucket, object_name):
+    try:
+        _checkpoint_blob(bucket, object_name).delete()
+    except Exception:  # pylint: disable=broad-except
+        # Only ever read while the object isn't marked as processed, so a stale
+        # checkpoint is harmless
+        pass
+
+
+def _checkpoint_blob(bucket, object_name):
+    return bucket.blob("checkpoints/%s" % object_name)
@@ -0,0 +1,120 @@
+import orjson
+
+
+PRIMITIVE_TYPES = (str, bool, int, float)
+
+# The types of the Logpush http_requests fields that aren't primitives, from the
+# field catalogue. Lists of these are of primitives only, so they can be sent as is
+# without checking their elements. Other fields are learned from their values.
+LOGPUSH_FIELD_TYPES = {
+    "BotDetectionIDs": list,
+    "BotDetectionTags": list,
+    "BotTags": list,
+    "ContentScanObjResults": list,
+    "ContentScanObjSizes": list,
+    "ContentScanObjTypes": list,
+    "Cookies": dict,
+    "FirewallMatchesActions": list,
+    "FirewallMatchesRuleIDs": list,
+    "FirewallMatchesSources": list,
+    "JA4Signals": dict,
+    "RequestHeaders": dict,
+    "ResponseHeaders": dict,
+    "SecurityActions": list,
+    "SecurityRuleIDs": list,
+    "SecuritySources": list,
+}
+
+
+def coerce_attribute_value(value):
+    """
+    Coerce a cloudflare log entry value into a type OTel will accept on a
+    span attribute. Mirrors libhoney's "JSON-everything" behavior: dicts
+    (ResponseHeaders, Cookies, RequestHeaders, JA4Signals, etc.) and
+    mixed-type sequences become JSON strings so they land in Honeycomb
+    as queryable-by-substring fields rather than being dropped with a
+    per-attribute warning on every span.
+
+    None values should be filtered by the caller.
+    """
+    if isinstance(value, PRIMITIVE_TYPES):
+        return value
+    if isinstance(value, (list, tuple)):
+        # OTel accepts sequences of primitives directly. Drop Nones and
+        # let them through; fall back to JSON for mixed-type sequences.
+        if all(el is None or isinstance(el, PRIMITIVE_TYPES) for el in value):
+            return [el for el in value if el is not None]
+    return _to_json(value)
+
+
+def _to_json(value):
+    return orjson.dumps(value).decode("utf-8")
+
+
+def _primitive_list(value):
+    if None in value:
+        return [el for el in value if el is not None]
+    return value
+
+
+# How values of each type are coerced when the type of the field is known, None
+# for as is
+CONVERTERS = {
+    str: None,
+    bool: None,
+    int: None,
+    float: None,
+    dict: _to_json,
+    list: _primitive_list,
+}
+
+
+class AttributeCoercer:
+    """
+    Coerces log entries into span attributes like `coerce_attribute_value`, but
+    with a converter per field picked from its type, rather than working out what
+    to do with every value. The type of a field is taken from
+    `LOGPUSH_FIELD_TYPES`, or the first value seen for it (except for lists,
+    which are only trusted to be of primitives when declared). Values that don't
+    have the type of their field are coerced the generic way.
+    """
+
+    def __init__(self, field_types=None):
+        """
+        :param field_types: A dict mapping field names to their types, defaults
+            to `LOGPUSH_FIELD_TYPES`.
+        """
+        if field_types is None:
+            field_types = LOGPUSH_FIELD_TYPES
+        self._fields = {
+            field: (field_type, CONVERTERS[field_type])
+            for field, field_type in field_types.items()
+        }
+
+    def coerce(self, entry):
+        """
+        :returns: A dict of the attributes for the entry, without None values.
+        """
+        fields = self._fields
+        attributes = {}
+        for key, value in entry.items():
+            if value is None:
+                continue
+            field = fields.get(key)
+            # The exact type rather than isinstance, as bool is a subclass of int
+            # and a bool in an int field (or the reverse) isn't of the field's type
+            # pylint: disable-next=unidiomatic-typecheck
+            if field is not None and type(value) is field[0]:
+                converter = field[1]
+                attributes[key] = value if converter is None else converter(value)
+            else:
+                attributes[key] = self._coerce_unknown(key, value)
+        return attributes
+
+    def _coerce_unknown(self, key, value):
+        value_type = type(value)
+        if key not in self._fields and value_type is not list:
+            converter = CONVERTERS.get(value_type, False)
+            if converter is not False:
+                self._fields[key] = (value_type, converter)
+        return coerce_attribute_value(value)
@@ -0,0 +1,143 @@
+"""
+Compression of OTLP export requests.
+
+The OTLP exporter can only gzip (at the max level) or deflate requests, so
+instead it's given a session that compresses request bodies itself. That allows
+picking the level, and zstd, which is about as small as gzip for a fraction of
+the CPU. zstd comes from the standard library from Python 3.14, or the
+`zstandard` package before that.
+"""
+import functools
+import gzip
+import threading
+from collections import Counter
+
+import requests
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# "none" sends requests as they are, the other algorithms are in `ALGORITHMS`
+NONE = "none"
+
+# The level used when none is given
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+
+
+def _create_gzip_compressor(level):
+    # gzip compresses from scratch each time, so there's no context to reuse
+    return functools.partial(gzip.compress, compresslevel=level, mtime=0)
+
+
+def _create_zstd_compressor(level):
+    if zstd is not None:
+        compressor = zstd.ZstdCompressor(level=level)
+        return functools.partial(
+            compressor.compress, mode=zstd.ZstdCompressor.FLUSH_FRAME
+        )
+    return zstandard.ZstdCompressor(level=level).compress
+
+
+# The algorithms available, mapping their names (which are also their
+# Content-Encoding) to functions creating a compress function for a level
+ALGORITHMS = {"gzip": _create_gzip_compressor}
+if zstd is not None or zstandard is not None:
+    ALGORITHMS["zstd"] = _create_zstd_compressor
+
+# The (min, max) levels of the algorithms available. Levels are only checked by
+# the compressors once they compress, which is in an exporter's thread.
+LEVELS = {"gzip": (0, 9)}
+if zstd is not None:
+    LEVELS["zstd"] = zstd.CompressionParameter.compression_level.bounds()
+elif zstandard is not None:
+    # zstandard has no constant for the min (negative, fast) level, this is
+    # ZSTD_minCLevel()
+    LEVELS["zstd"] = (-(1 << 17), zstandard.MAX_COMPRESSION_LEVEL)
+
+
+class Compressor:
+    """
+    Compresses request bodies with one of the `ALGORITHMS`. Compression contexts
+    aren't thread safe, so each thread gets its own, which is reused for all of
+    its requests.
+    """
+
+    def __init__(self, algorithm, level=None):
+        """
+        :param level: The compression level, defaults to `DEFAULT_LEVELS`.
+        """
+        try:
+            self._create_compressor = ALGORITHMS[algorithm]
+        except KeyError:
+            raise ValueError(
+                "Unknown or unavailable compression %r, choose one of %s"
+                % (algorithm, ", ".join([NONE] + sorted(ALGORITHMS)))
+            ) from None
+        self.algorithm = algorithm
+        self.level = DEFAULT_LEVELS[algorithm] if level is None else level
+        min_level, max_level = LEVELS[algorithm]
+        if not min_level <= self.level <= max_level:
+            raise ValueError(
+                "Compression level %d out of range for %s, choose one from %d to %d"
+                % (self.level, algorithm, min_level, max_level)
+            )
+        self._local = threading.local()
+
+    def compress(self, data):
+        compress = getattr(self._local, "compress", None)
+        if compress is None:
+            compress = self._local.compress = self._create_compressor(self.level)
+        return compress(data)
+
+
+class CompressingSession(requests.Session):
+    """
+    A `requests.Session` that compresses the `bytes` bodies of requests, and
+    counts the "uncompressed_bytes" and "compressed_bytes" sent in `stats`.
+
+    Exporters retry a failed request with the same body, so each thread keeps
+    its last body and what it compressed to. A retry isn't compressed again,
+    and the bytes of a batch are only counted once however often it's sent.
+    """
+
+    def __init__(self, compressor, stats=None):
+        """
+        :param compressor: A `Compressor`.
+        :param stats: A `collections.Counter` to count bytes in.
+        """
+        super().__init__()
+        self.compressor = compressor
+        self.stats = stats if stats is not None else Counter()
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+
+    def request(self, method, url, *args, data=None, headers=None, **kwargs):
+        # pylint: disable=arguments-differ
+        if isinstance(data, bytes):
+            data = self._compress(data)
+            headers = dict(headers or {})
+            headers["Content-Encoding"] = self.compressor.algorithm
+        return super().request(
+            method, url, *args, data=data, headers=headers, **kwargs
+        )
+
+    def _compress(self, data):
+        local = self._local
+        if getattr(local, "data", None) == data:
+            return local.compressed
+        compressed = self.compressor.compress(data)
+        with self._stats_lock:
+            self.stats.update(
+                uncompressed_bytes=len(data), compressed_bytes=len(compressed)
+            )
+        local.data = data
+        local.compressed = compressed
+        return compressed
@@ -0,0 +1,114 @@
+"""
+Pluggable gzip decompression.
+
+Inflate is the single hottest call when processing a log file, so this picks the
+fastest gzip implementation installed (python-isal, then zlib-ng, then the
+stdlib) and can run it in a background thread that hands blocks of lines to the
+consumer through a bounded queue, overlapping inflate with sampling, enrichment
+and export. zlib and both alternatives release the GIL while inflating.
+"""
+import gzip
+import queue
+import threading
+
+try:
+    from isal import igzip
+except ImportError:
+    igzip = None
+
+try:
+    from zlib_ng import gzip_ng
+except ImportError:
+    gzip_ng = None
+
+
+BACKENDS = {"gzip": gzip.open}
+if gzip_ng is not None:
+    BACKENDS["zlib-ng"] = gzip_ng.open
+if igzip is not None:
+    BACKENDS["isal"] = igzip.open
+
+# In order of preference when no backend is asked for explicitly
+PREFERRED_BACKENDS = ("isal", "zlib-ng", "gzip")
+
+# The size hint in bytes for each block of lines read in the background thread,
+# and the number of blocks that may be waiting for the consumer. Together they
+# bound the decompressed data held in memory to roughly 8 MiB.
+BLOCK_SIZE = 256 * 1024
+MAX_BLOCKS = 32
+
+_DONE = object()
+
+
+def get_backend(name=None):
+    """
+    :param name: The name of one of the `BACKENDS`, or None for the fastest one
+        installed.
+    :returns: A function with the signature of `gzip.open`.
+    """
+    if name is None:
+        name = next(n for n in PREFERRED_BACKENDS if n in BACKENDS)
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            "Unknown or unavailable decompression backend %r, choose one of %s"
+            % (name, ", ".join(sorted(BACKENDS)))
+        ) from None
+
+
+def open_gzip(file, backend=None):
+    """
+    Open a gzipped path or binary file object for reading as bytes.
+    """
+    return get_backend(backend)(file, "rb")
+
+
+def iter_lines(fh, threaded=True, block_size=BLOCK_SIZE, max_blocks=MAX_BLOCKS):
+    """
+    Yield the lines of the binary file object `fh`. If `threaded` the file is
+    read in a background thread, `max_blocks` blocks of `block_size` bytes
+    ahead of the consumer. Errors raised while reading are re-raised to the
+    consumer.
+    """
+    if not threaded:
+        yield from fh
+        return
+
+    blocks = queue.Queue(max_blocks)
+    stop = threading.Event()
+
+    def put(item):
+        # Don't block forever if the consumer went away without draining
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            while not stop.is_set():
+                block = fh.readlines(block_size)
+                if not block:
+                    break
+                put(block)
+        except BaseException as ex:  # pylint: disable=broad-except
+            put(ex)
+        else:
+            put(_DONE)
+
+    thread = threading.Thread(target=produce, name="honeyflare-decompress", daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is _DONE:
+                return
+            if isinstance(block, BaseException):
+                raise block
+            yield from block
+    finally:
+        stop.set()
+        thread.join()
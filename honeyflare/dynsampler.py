@@ -0,0 +1,354 @@
+"""
+Dynamic sampling in the style of Refinery's (dynsampler-go's) samplers: lines are
+grouped by a key, and the rate of each key is set from how common it is, so that
+the total number of events meets a target while rare keys keep a low rate
+(often 1) and the most common keys take the bulk of the sampling.
+"""
+import math
+import random
+from collections import Counter
+
+import orjson
+
+from .sampler import SAMPLING_FIELDS, Sampler, get_field_scanner
+from .urlshape import UrlShaper
+
+
+# The number of lines counted before the rates for them are set. Raw lines (or
+# entries, when the key can't be scanned for) are held until then, so this bounds
+# the memory used by the sampler.
+WINDOW_SIZE = 5000
+
+# The fields the derived key fields are computed from
+DERIVED_KEY_FIELDS = {
+    "EdgeResponseStatusClass": ("EdgeResponseStatus",),
+    "PathShape": ("ClientRequestURI", "ClientRequestHost"),
+}
+
+# The default number of distinct keys the reservoir sampler keeps a reservoir for.
+# Lines with keys beyond that share a single reservoir.
+MAX_KEYS = 1000
+
+
+class DynamicSampler(Sampler):
+    def __init__(
+        self,
+        key_fields,
+        target_events_per_second,
+        window_size=WINDOW_SIZE,
+        url_shaper=None,
+    ):
+        """
+        :param key_fields: The fields lines are grouped by, see `get_sample_key`.
+        :param target_events_per_second: The number of events to aim for per
+            second of traffic in the file, based on EdgeEndTimestamp.
+        :param window_size: The number of lines rates are computed for at a time.
+        :param url_shaper: The `.urlshape.UrlShaper` used when grouping by
+            PathShape.
+        """
+        super().__init__()
+        self.key_fields = key_fields
+        self.target_events_per_second = target_events_per_second
+        self.window_size = window_size
+        self.url_shaper = url_shaper or UrlShaper([])
+
+    def sample_lines(self, line_iterator, head_sampling_rate_by_status):
+        """
+        Applies dynamic sampling to a line-based iterator. Lines are counted per
+        key over a window of lines, then sampled with the rates computed for the
+        window. `head_sampling_rate_by_status` is not used.
+
+        :param line_iterator: An iterator of lines as `bytes`.
+        """
+        # Lines are only parsed once they're kept, unless a key field can't be
+        # scanned for, in which case the parsed entries are held in the window
+        scanner = get_key_scanner(self.key_fields, "EdgeEndTimestamp")
+        window = []
+        counts = Counter()
+        min_timestamp = max_timestamp = None
+        for line in line_iterator:
+            if scanner is not None:
+                fields = scanner.scan(line)
+                key = get_scanned_sample_key(fields, self.key_fields, self.url_shaper)
+                window.append((key, line))
+                timestamp = fields.get("EdgeEndTimestamp")
+                if timestamp is not None:
+                    timestamp = int(timestamp)
+            else:
+                entry = self.loads(line)
+                key = get_sample_key(entry, self.key_fields, self.url_shaper)
+                window.append((key, entry))
+                timestamp = entry.get("EdgeEndTimestamp")
+            counts[key] += 1
+            self.buffered_lines = len(window)
+
+            if timestamp is not None:
+                if min_timestamp is None or timestamp < min_timestamp:
+                    min_timestamp = timestamp
+                if max_timestamp is None or timestamp > max_timestamp:
+                    max_timestamp = timestamp
+
+            if len(window) >= self.window_size:
+                yield from self._sample_window(
+                    window, counts, min_timestamp, max_timestamp, scanner is not None
+                )
+                window = []
+                counts = Counter()
+                min_timestamp = max_timestamp = None
+
+        if window:
+            yield from self._sample_window(
+                window, counts, min_timestamp, max_timestamp, scanner is not None
+            )
+
+    def _sample_window(self, window, counts, min_timestamp, max_timestamp, raw):
+        seconds = 1
+        if min_timestamp is not None:
+            seconds = max((max_timestamp - min_timestamp) / 1e9, 1)
+        rates = get_dynamic_rates(counts, self.target_events_per_second * seconds)
+
+        keep = self._draws.keep
+        for index, (key, item) in enumerate(window):
+            self.buffered_lines = len(window) - index - 1
+            sampling_rate = rates[key]
+            if keep(sampling_rate):
+                yield sampling_rate, self.loads(item) if raw else item
+
+
+class ReservoirSampler(Sampler):
+    def __init__(
+        self,
+        key_fields,
+        events_per_key,
+        max_keys=MAX_KEYS,
+        url_shaper=None,
+    ):
+        """
+        :param key_fields: The fields lines are grouped by, see `get_sample_key`.
+        :param events_per_key: The max number of events sent per key and file.
+        :param max_keys: The max number of keys with a reservoir of their own, the
+            lines of any other key share one (with the key None). Together with
+            `events_per_key` this caps the number of events sent per file.
+        :param url_shaper: The `.urlshape.UrlShaper` used when grouping by
+            PathShape.
+        """
+        super().__init__()
+        self.key_fields = key_fields
+        self.events_per_key = events_per_key
+        self.max_keys = max_keys
+        self.url_shaper = url_shaper or UrlShaper([])
+
+    def sample_lines(self, line_iterator, head_sampling_rate_by_status):
+        """
+        Keeps a uniform random sample of at most `events_per_key` lines per key
+        from the whole of the line-based iterator, and yields them once it's
+        exhausted. The SampleRates of the lines of a key add up to the number of
+        lines with the key. `head_sampling_rate_by_status` is not used.
+
+        :param line_iterator: An iterator of lines as `bytes`.
+        """
+        # Lines are only parsed once they're kept, unless a key field can't be
+        # scanned for, in which case the reservoirs hold parsed entries
+        scanner = get_key_scanner(self.key_fields)
+        reservoirs = {}
+        for line in line_iterator:
+            if scanner is not None:
+                key = get_scanned_sample_key(
+                    scanner.scan(line), self.key_fields, self.url_shaper
+                )
+                item = line
+            else:
+                item = self.loads(line)
+                key = get_sample_key(item, self.key_fields, self.url_shaper)
+            reservoir = reservoirs.get(key)
+            if reservoir is None:
+                if len(reservoirs) >= self.max_keys:
+                    key = None
+                    reservoir = reservoirs.get(key)
+                if reservoir is None:
+                    reservoir = reservoirs[key] = Reservoir(self.events_per_key)
+            reservoir.add(item)
+            # Nothing is sent before the end of the file
+            self.buffered_lines += 1
+
+        loads = self.loads if scanner is not None else _parsed
+        for reservoir in reservoirs.values():
+            yield from reservoir.sample(loads)
+        self.buffered_lines = 0
+
+
+class Reservoir:
+    """
+    A uniform random sample of fixed size of the items added to it, using
+    Li's Algorithm L, which only needs random numbers for the items that end up
+    in the sample rather than for every item.
+    """
+
+    __slots__ = ("size", "items", "seen", "_weight", "_next_index")
+
+    def __init__(self, size):
+        self.size = size
+        self.items = []
+        self.seen = 0
+        self._weight = None
+        self._next_index = None
+
+    def add(self, item):
+        index = self.seen
+        self.seen += 1
+        if index < self.size:
+            self.items.append(item)
+            if self.seen == self.size:
+                self._weight = math.exp(math.log(_random()) / self.size)
+                self._skip(index)
+        elif index == self._next_index:
+            self.items[random.randrange(self.size)] = item
+            self._weight *= math.exp(math.log(_random()) / self.size)
+            self._skip(index)
+
+    def sample(self, loads=orjson.loads):
+        """
+        Yields (sampling rate, entry) for the items in the sample. Rates are
+        integers, spread so that they add up to the number of items seen.
+
+        :param loads: Parses an item (a line) into an entry.
+        """
+        if not self.items:
+            return
+        rate, remainder = divmod(self.seen, len(self.items))
+        for index, line in enumerate(self.items):
+            yield rate + 1 if index < remainder else rate, loads(line)
+
+    def _skip(self, index):
+        self._next_index = (
+            index + math.floor(math.log(_random()) / math.log1p(-self._weight)) + 1
+        )
+
+
+def _parsed(entry):
+    return entry
+
+
+def _random():
+    """A random float in the open interval (0, 1)"""
+    value = random.random()
+    while value == 0:
+        value = random.random()
+    return value
+
+
+def get_dynamic_rates(counts, goal_count):
+    """
+    Compute a sampling rate per key so that the expected number of events kept
+    is roughly `goal_count`. Like Refinery's AvgSampleRate, each key's share of
+    the goal is proportional to the logarithm of its count, and the share a key
+    doesn't use up is handed on to the more common keys.
+
+    :param counts: A mapping from key to the number of lines with it.
+    :returns: A dict mapping each key to an integer sampling rate.
+    """
+    total = sum(counts.values())
+    goal_count = max(goal_count, 1)
+    if total <= goal_count:
+        return {key: 1 for key in counts}
+
+    log_sum = sum(math.log10(count) for count in counts.values())
+    goal_ratio = goal_count / log_sum if log_sum else 0
+
+    rates = {}
+    extra = 0.0
+    keys_remaining = len(counts)
+    # From the least common key up, so spare room goes to the common ones
+    for key, count in sorted(counts.items(), key=lambda item: item[1]):
+        goal_for_key = max(1, math.log10(count) * goal_ratio)
+        extra_for_key = extra / keys_remaining
+        goal_for_key += extra_for_key
+        extra -= extra_for_key
+        keys_remaining -= 1
+
+        if count <= goal_for_key:
+            rates[key] = 1
+            extra += goal_for_key - count
+        else:
+            rate = math.ceil(count / goal_for_key)
+            rates[key] = rate
+            extra += goal_for_key - count / rate
+    return rates
+
+
+def get_sample_key(entry, key_fields, url_shaper):
+    """
+    :param key_fields: Names of fields of the entry, or one of the derived
+        fields `EdgeResponseStatusClass` (ie "4xx") and `PathShape` (the shape of
+        `ClientRequestURI` according to the `.urlshape.UrlShaper`).
+    :returns: A tuple of the values of `key_fields` for the entry.
+    """
+    key = []
+    for field in key_fields:
+        if field == "EdgeResponseStatusClass":
+            status = entry.get("EdgeResponseStatus")
+            key.append("%dxx" % (status // 100) if status is not None else None)
+        elif field == "PathShape":
+            uri = entry.get("ClientRequestURI")
+            key.append(
+                url_shaper.urlshape(uri, entry.get("ClientRequestHost")).path_shape
+                if uri is not None
+                else None
+            )
+        else:
+            key.append(entry.get(field))
+    return tuple(key)
+
+
+def get_key_scanner(key_fields, *fields):
+    """
+    :param key_fields: The key fields of a sampler, see `get_sample_key`.
+    :param fields: Other fields the sampler needs from lines.
+    :returns: A `.sampler.FieldScanner` for the fields the key is made of (and
+        `fields`), or None if any of them can't be scanned for (as it's not in
+        `.sampler.SAMPLING_FIELDS`), in which case lines need to be parsed.
+    """
+    scanned = []
+    for field in key_fields:
+        scanned.extend(DERIVED_KEY_FIELDS.get(field, (field,)))
+    scanned.extend(fields)
+    if not all(field in SAMPLING_FIELDS for field in scanned):
+        return None
+    return get_field_scanner(tuple(dict.fromkeys(scanned)))
+
+
+def get_scanned_sample_key(fields, key_fields, url_shaper):
+    """
+    Like `get_sample_key`, with the values of fields taken from the raw line.
+
+    :param fields: The `.sampler.ScannedFields` of a line, from the scanner of
+        `get_key_scanner`.
+    """
+    key = []
+    for field in key_fields:
+        if field == "EdgeResponseStatusClass":
+            status = fields.get("EdgeResponseStatus")
+            key.append("%dxx" % (int(status) // 100) if status is not None else None)
+        elif field == "PathShape":
+            uri = _decode_string(fields.get("ClientRequestURI"))
+            key.append(
+                url_shaper.urlshape(
+                    uri, _decode_string(fields.get("ClientRequestHost"))
+                ).path_shape
+                if uri is not None
+                else None
+            )
+        elif SAMPLING_FIELDS[field] is int:
+            value = fields.get(field)
+            key.append(int(value) if value is not None else None)
+        else:
+            key.append(_decode_string(fields.get(field)))
+    return tuple(key)
+
+
+def _decode_string(value):
+    if value is None:
+        return None
+    if b"\\" in value:
+        return orjson.loads(b'"%s"' % value)
+    return value.decode("utf-8")
@@ -1,13 +1,18 @@
-import ipaddress
-
 from .urlshape import urlshape
+from .useragent import classify
 
 
-def enrich_entry(entry, path_patterns, query_param_filter):
+def enrich_entry(
+    entry, path_patterns, query_param_filter, url_shaper=None, ip_ranges=None
+):
     """
     :param entry: A dictionary with the log entry fields.
     :param path_patterns: A list of `.urlshape.Pattern` for known path patterns
         to parse.
+    :param url_shaper: A `.urlshape.UrlShaper` to shape the URI with, caching the
+        result, instead of `path_patterns` and `query_param_filter`. Required
+        for patterns set per host.
+    :param ip_ranges: A `.ipranges.IPRanges` to set ClientIPRange from.
 
     Note: trace/span/service identity is no longer set here — the caller
     builds OTel SpanContext from RayID/ParentRayID and sets service.name as
@@ -26,11 +31,22 @@ def enrich_entry(entry, path_patterns, query_param_filter):
 
     client_ip = entry.get("ClientIP")
     if client_ip is not None:
-        enrich_client_ip(entry, client_ip)
+        enrich_client_ip(entry, client_ip, ip_ranges)
+
+    user_agent = entry.get("ClientRequestUserAgent")
+    if user_agent:
+        enrich_user_agent(entry, user_agent)
 
     client_request_uri = entry.get("ClientRequestURI")
     if client_request_uri is not None:
-        enrich_urlshape(entry, client_request_uri, path_patterns, query_param_filter)
+        enrich_urlshape(
+            entry,
+            client_request_uri,
+            path_patterns,
+            query_param_filter,
+            url_shaper,
+            entry.get("ClientRequestHost"),
+        )
 
 
 def enrich_duration(entry, start_ns, end_ns):
@@ -44,13 +60,36 @@ def enrich_origin_response_time(entry, origin_response_time_ns):
     entry["OriginResponseTimeMs"] = origin_response_time_ns / 1e6
 
 
-def enrich_client_ip(entry, client_ip):
-    parsed_ip = ipaddress.ip_address(client_ip)
-    entry["ClientIPVersion"] = parsed_ip.version
+def enrich_client_ip(entry, client_ip, ip_ranges=None):
+    # Only IPv6 addresses have colons, no need to parse them
+    entry["ClientIPVersion"] = 6 if ":" in client_ip else 4
+    if ip_ranges is not None:
+        ip_range = ip_ranges.lookup(client_ip)
+        if ip_range is not None:
+            entry["ClientIPRange"] = ip_range
+
+
+def enrich_user_agent(entry, user_agent):
+    # Cached, so typically a dict lookup rather than running the rules
+    classification = classify(user_agent)
+    entry["UserAgentFamily"] = classification.family
+    entry["UserAgentOS"] = classification.os
+    entry["UserAgentDevice"] = classification.device
+    entry["UserAgentBot"] = classification.bot
 
 
-def enrich_urlshape(entry, client_request_uri, path_patterns, query_param_filter):
-    url_shape = urlshape(client_request_uri, path_patterns, query_param_filter)
+def enrich_urlshape(
+    entry,
+    client_request_uri,
+    path_patterns,
+    query_param_filter,
+    url_shaper=None,
+    client_request_host=None,
+):
+    if url_shaper is not None:
+        url_shape = url_shaper.urlshape(client_request_uri, client_request_host)
+    else:
+        url_shape = urlshape(client_request_uri, path_patterns, query_param_filter)
     entry["Path"] = url_shape.path
     entry["PathShape"] = url_shape.path_shape
     entry["PathShapeStrict"] = url_shape.path_shape_strict
@@ -7,3 +7,10 @@ class RetriableError(Exception):
 
 class FileLockedError(RetriableError):
     """The given file was already locked"""
+
+
+class DeadlineReachedError(RetriableError):
+    """
+    Processing was stopped close to the function deadline. The progress made has
+    been checkpointed, the retry will pick up the rest.
+    """
@@ -0,0 +1,86 @@
+import functools
+import ipaddress
+import socket
+
+
+# The default max number of IPs an `IPRanges` caches the range of
+CACHE_SIZE = 10000
+
+
+class IPRanges:
+    """
+    Finds the label of the most specific of a set of CIDR ranges an IP is in.
+    The ranges are compiled into a binary trie per IP version, so a lookup takes
+    at most as many steps as the longest prefix, and the results for the most
+    recently seen IPs are cached as clients tend to make many requests each.
+    """
+
+    def __init__(self, ranges, cache_size=CACHE_SIZE):
+        """
+        :param ranges: A dict mapping CIDR ranges (ie `10.0.0.0/8` or
+            `2001:db8::/32`) to labels. Overlapping ranges are fine, the longest
+            prefix wins.
+        :param cache_size: The max number of IPs to cache the range of.
+        """
+        self._tries = {4: _TrieNode(), 6: _TrieNode()}
+        for cidr, label in ranges.items():
+            network = ipaddress.ip_network(cidr, strict=False)
+            node = self._tries[network.version]
+            address = int(network.network_address)
+            for index in range(network.prefixlen):
+                bit = (address >> (network.max_prefixlen - index - 1)) & 1
+                child = node.children[bit]
+                if child is None:
+                    child = node.children[bit] = _TrieNode()
+                node = child
+            node.label = label
+        self.lookup = functools.lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _lookup(self, ip):
+        """
+        :param ip: An IPv4 or IPv6 address as a string.
+        :returns: The label of the most specific range the IP is in, or None if
+            it's in none of them (or isn't a valid IP).
+        """
+        if ":" in ip:
+            family, bits, node = socket.AF_INET6, 128, self._tries[6]
+        else:
+            family, bits, node = socket.AF_INET, 32, self._tries[4]
+        try:
+            address = int.from_bytes(socket.inet_pton(family, ip), "big")
+        except OSError:
+            return None
+
+        label = node.label
+        for shift in range(bits - 1, -1, -1):
+            node = node.children[(address >> shift) & 1]
+            if node is None:
+                break
+            if node.label is not None:
+                label = node.label
+        return label
+
+
+class _TrieNode:
+    __slots__ = ("children", "label")
+
+    def __init__(self):
+        self.children = [None, None]
+        self.label = None
+
+
+def get_ip_ranges(ranges):
+    """
+    :param ranges: See `IPRanges`.
+    :returns: An `IPRanges` for the ranges, or None if there are none. The same
+        one is returned for the same ranges, so its cache stays warm between
+        invocations.
+    """
+    if not ranges:
+        return None
+    return _get_ip_ranges(tuple(sorted(ranges.items())))
+
+
+@functools.lru_cache(maxsize=16)
+def _get_ip_ranges(ranges):
+    return IPRanges(dict(ranges))
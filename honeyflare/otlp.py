@@ -0,0 +1,264 @@
+"""
+Export of spans built straight from log entries as OTLP protobuf, without going
+through the OTel SDK. Spans from logs are final when they're created, so the
+SDK's per span bookkeeping (contexts, ID generation, attribute validation, the
+span processor queue) is overhead. Here each entry becomes a protobuf `Span`,
+and the resource and scope are shared by each batch of them.
+"""
+import logging
+import random
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import (
+    ExportTraceServiceRequest,
+)
+from opentelemetry.proto.common.v1.common_pb2 import (
+    AnyValue,
+    ArrayValue,
+    InstrumentationScope,
+    KeyValue,
+)
+from opentelemetry.proto.resource.v1.resource_pb2 import Resource
+from opentelemetry.proto.trace.v1.trace_pb2 import (
+    ResourceSpans,
+    ScopeSpans,
+    Span,
+    SpanFlags,
+    Status,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# The default number of spans per export request, as the SDK's batch processor
+BATCH_SIZE = 512
+
+# The max number of batches waiting to be exported before adding spans blocks
+MAX_PENDING_BATCHES = 4
+
+# Failed requests are retried this many times, backing off exponentially
+MAX_RETRIES = 5
+RETRYABLE_STATUS_CODES = (429, 502, 503, 504)
+
+TIMEOUT_SECONDS = 10
+
+# The flags of spans the SDK exports, depending on whether the parent is remote
+ROOT_SPAN_FLAGS = SpanFlags.SPAN_FLAGS_CONTEXT_HAS_IS_REMOTE_MASK
+CHILD_SPAN_FLAGS = (
+    SpanFlags.SPAN_FLAGS_CONTEXT_HAS_IS_REMOTE_MASK
+    | SpanFlags.SPAN_FLAGS_CONTEXT_IS_REMOTE_MASK
+)
+
+# Spans from logs have no status, which the SDK encodes as an empty message
+UNSET_STATUS = Status()
+
+
+class DirectSpanExporter:
+    """
+    Encodes spans into OTLP export requests in batches and sends them to an OTLP
+    HTTP endpoint from a background thread. Has the `force_flush` and `shutdown`
+    of a `TracerProvider`, so it can stand in for one.
+
+    Adding spans blocks while `max_pending_batches` are waiting to be sent, so
+    spans are never dropped for being produced faster than they're exported. Up
+    to `export_workers` of them are sent at once.
+    """
+
+    def __init__(
+        self,
+        endpoint,
+        resource,
+        scope_name="honeyflare",
+        batch_size=BATCH_SIZE,
+        max_pending_batches=MAX_PENDING_BATCHES,
+        session=None,
+        timeout=TIMEOUT_SECONDS,
+        stats=None,
+        export_workers=1,
+    ):
+        """
+        :param endpoint: The URL of the OTLP traces endpoint.
+        :param resource: The `opentelemetry.sdk.resources.Resource` of the spans.
+        :param scope_name: The name of the instrumentation scope of the spans.
+        :param session: The `requests.Session` to send requests with.
+        :param stats: A `collections.Counter` to count the spans "exported",
+            "retried" and "dropped" (after running out of retries) in.
+        :param export_workers: The max number of batches sent at once, with a
+            pool of at least as many connections in the session.
+        """
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        # Enough batches waiting to keep every worker busy
+        self.max_pending_batches = max(max_pending_batches, export_workers)
+        self.timeout = timeout
+        self.stats = stats if stats is not None else Counter()
+        self._stats_lock = threading.Lock()
+        self._session = session or requests.Session()
+        self._session.headers.update({"Content-Type": "application/x-protobuf"})
+        self._resource = Resource(
+            attributes=encode_attributes(dict(resource.attributes))
+        )
+        self._scope = InstrumentationScope(name=scope_name)
+        self._spans = []
+        self._pending = deque()
+        self._failed = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=export_workers, thread_name_prefix="honeyflare-export"
+        )
+        self._shutdown = threading.Event()
+
+    def add_span(
+        self, name, time_ns, trace_id, span_id, parent_span_id, attributes
+    ):
+        """
+        Adds a span to the current batch, sending the batch when it's full.
+
+        :param time_ns: The start (and end) time of the span.
+        :param trace_id: The trace ID as an int, None for a random one.
+        :param span_id: The span ID as an int, None for a random one.
+        :param parent_span_id: The span ID of the parent as an int, None for a
+            root span.
+        :param attributes: A dict of attributes, with values OTel accepts.
+        """
+        if trace_id is None:
+            trace_id = random.getrandbits(128)
+        if span_id is None:
+            span_id = random.getrandbits(64)
+        self._spans.append(
+            Span(
+                trace_id=trace_id.to_bytes(16, "big"),
+                span_id=span_id.to_bytes(8, "big"),
+                parent_span_id=(
+                    parent_span_id.to_bytes(8, "big")
+                    if parent_span_id is not None
+                    else b""
+                ),
+                name=name,
+                kind=Span.SpanKind.SPAN_KIND_INTERNAL,
+                start_time_unix_nano=time_ns,
+                end_time_unix_nano=time_ns,
+                attributes=encode_attributes(attributes),
+                status=UNSET_STATUS,
+                flags=(
+                    CHILD_SPAN_FLAGS if parent_span_id is not None else ROOT_SPAN_FLAGS
+                ),
+            )
+        )
+        if len(self._spans) >= self.batch_size:
+            self._send_batch()
+
+    def force_flush(self):
+        """
+        Sends the spans added so far and waits for them to be exported.
+
+        :returns: True if all spans since the last flush were exported.
+        """
+        if self._spans:
+            self._send_batch()
+        while self._pending:
+            self._pending.popleft().result()
+        succeeded = not self._failed
+        self._failed = False
+        return succeeded
+
+    def shutdown(self):
+        try:
+            self.force_flush()
+        finally:
+            self._shutdown.set()
+            self._executor.shutdown()
+            self._session.close()
+
+    def _send_batch(self):
+        request = ExportTraceServiceRequest(
+            resource_spans=[
+                ResourceSpans(
+                    resource=self._resource,
+                    scope_spans=[ScopeSpans(scope=self._scope, spans=self._spans)],
+                )
+            ]
+        )
+        span_count = len(self._spans)
+        self._spans = []
+        while len(self._pending) >= self.max_pending_batches:
+            self._pending.popleft().result()
+        self._pending.append(
+            self._executor.submit(
+                self._export, request.SerializeToString(), span_count
+            )
+        )
+
+    def _export(self, data, span_count):
+        for retry in range(MAX_RETRIES + 1):
+            if retry:
+                self._count("retried", span_count)
+            try:
+                response = self._session.post(
+                    self.endpoint, data=data, timeout=self.timeout
+                )
+                if response.ok:
+                    self._count("exported", span_count)
+                    return True
+                retryable = response.status_code in RETRYABLE_STATUS_CODES
+                reason = response.status_code
+            except requests.exceptions.RequestException as ex:
+                retryable = isinstance(ex, requests.exceptions.ConnectionError)
+                reason = ex
+
+            if not retryable or retry == MAX_RETRIES:
+                break
+            if self._shutdown.wait(2**retry * random.uniform(0.8, 1.2)):
+                break
+
+        logger.error("Failed to export span batch: %s", reason)
+        self._count("dropped", span_count)
+        self._failed = True
+        return False
+
+    def _count(self, key, span_count):
+        with self._stats_lock:
+            self.stats[key] += span_count
+
+
+def encode_attributes(attributes):
+    """
+    :param attributes: A dict of attributes, with values OTel accepts.
+    :returns: A list of `KeyValue` protobufs for the attributes.
+    """
+    return [
+        KeyValue(key=key, value=encode_value(value))
+        for key, value in attributes.items()
+        if value is not None
+    ]
+
+
+def encode_value(value):
+    encoder = _VALUE_ENCODERS.get(type(value))
+    if encoder is not None:
+        try:
+            return encoder(value)
+        except ValueError:
+            # Ints that don't fit in 64 bits
+            pass
+    return AnyValue(string_value=str(value))
+
+
+def _encode_array(value):
+    return AnyValue(
+        array_value=ArrayValue(
+            values=[encode_value(element) for element in value if element is not None]
+        )
+    )
+
+
+_VALUE_ENCODERS = {
+    str: lambda value: AnyValue(string_value=value),
+    bool: lambda value: AnyValue(bool_value=value),
+    int: lambda value: AnyValue(int_value=value),
+    float: lambda value: AnyValue(double_value=value),
+    list: _encode_array,
+    tuple: _encode_array,
+}
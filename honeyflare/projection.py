@@ -0,0 +1,100 @@
+import fnmatch
+import functools
+
+
+# The fields spans are built from, which are never dropped
+REQUIRED_FIELDS = frozenset(
+    ("EdgeEndTimestamp", "RayID", "ParentRayID", "ClientRequestMethod")
+)
+
+# The estimated size of an item of an object or array, about that of a header like
+# `"accept-encoding":"gzip, br",`
+ITEM_SIZE_ESTIMATE = 32
+
+
+class FieldProjection:
+    """
+    Drops the fields of log entries that aren't wanted as span attributes before
+    any work is done on them. Whether a field is kept is decided once per field
+    name, so projecting an entry costs a dict lookup per field.
+    """
+
+    def __init__(self, allowlist=None, denylist=None):
+        """
+        :param allowlist: A list of the fields to keep, either names or globs
+            like `Edge*`. None to keep all fields.
+        :param denylist: A list of fields (or globs) to drop, even if they're in
+            the allowlist.
+
+        Fields in `REQUIRED_FIELDS` are always kept. Fields added by enrichment
+        are not affected, but they can only be derived from fields that are kept.
+        """
+        self.allowlist = allowlist
+        self.denylist = denylist
+        self._decisions = {}
+
+    def project(self, entry):
+        """
+        Removes the unwanted fields from the entry, in place.
+
+        :returns: An estimate of the number of bytes of the fields removed, see
+            `estimate_size`.
+        """
+        dropped = [field for field in entry if not self.keeps(field)]
+        dropped_bytes = 0
+        for field in dropped:
+            dropped_bytes += len(field) + estimate_size(entry.pop(field))
+        return dropped_bytes
+
+    def keeps(self, field):
+        keep = self._decisions.get(field)
+        if keep is None:
+            keep = self._decisions[field] = self._keeps(field)
+        return keep
+
+    def _keeps(self, field):
+        if field in REQUIRED_FIELDS:
+            return True
+        if self.allowlist is not None and not _matches_any(field, self.allowlist):
+            return False
+        if self.denylist is not None and _matches_any(field, self.denylist):
+            return False
+        return True
+
+
+def _matches_any(field, patterns):
+    return any(fnmatch.fnmatchcase(field, pattern) for pattern in patterns)
+
+
+def estimate_size(value):
+    """
+    Estimates the size of a value in the log line from what's at hand, without
+    serializing it again (which would cost more than the fields are worth).
+    Strings, including the objects of `.rawfields.RawFieldDecoder` fields, are
+    their length, parsed objects and arrays `ITEM_SIZE_ESTIMATE` per item.
+    """
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (dict, list)):
+        return len(value) * ITEM_SIZE_ESTIMATE
+    # Numbers, booleans and null, roughly as encoded
+    return 8
+
+
+def get_field_projection(allowlist=None, denylist=None):
+    """
+    :returns: A `FieldProjection` for the lists, or None if neither is set. The
+        same one is returned for the same lists, so its decisions are reused
+        between invocations.
+    """
+    if allowlist is None and denylist is None:
+        return None
+    return _get_field_projection(
+        tuple(allowlist) if allowlist is not None else None,
+        tuple(denylist) if denylist is not None else None,
+    )
+
+
+@functools.lru_cache(maxsize=16)
+def _get_field_projection(allowlist, denylist):
+    return FieldProjection(allowlist, denylist)
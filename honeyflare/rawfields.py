@@ -0,0 +1,113 @@
+"""
+Parsing of log lines that keeps the JSON objects of some fields as they are.
+Fields like RequestHeaders or Cookies end up as JSON strings on spans anyway (see
+`.coercion.coerce_attribute_value`), so parsing them into dicts only to serialize them
+again is wasted work, and lots of short-lived allocations.
+"""
+import functools
+import re
+
+import orjson
+
+
+# A JSON object without objects or arrays in it, which covers the header, cookie
+# and signal fields Cloudflare logs. Strings are matched as a whole so braces in
+# them don't count.
+FLAT_OBJECT_RE = re.compile(rb'\{(?:[^{}\[\]"]++|"(?:[^"\\]++|\\.)*+")*+\}')
+
+
+class RawFieldDecoder:
+    """
+    Parses log lines like `orjson.loads`, except that the values of the given
+    fields are the JSON text of their objects as in the line, rather than dicts.
+    Values that aren't flat objects (ie that are null, or have nested objects)
+    are parsed as usual.
+
+    Fields are looked for by their key anywhere in the line, so they need to be
+    top-level fields whose names don't occur as keys of nested objects.
+    """
+
+    def __init__(self, fields):
+        """
+        :param fields: The names of the fields to keep as JSON text.
+        """
+        self.fields = fields
+        # Logpush writes fields in alphabetical order by default, looking for them
+        # in that order means each line is scanned about once
+        self.keys = [
+            (field, b'"%s":' % field.encode("utf-8")) for field in sorted(fields)
+        ]
+
+    def loads(self, line):
+        """
+        :param line: A log line as `bytes`.
+        :returns: The log entry as a dict.
+        """
+        raw_values = None
+        position = 0
+        for field, key in self.keys:
+            start = line.find(key, position)
+            if start == -1:
+                start = line.find(key, 0, position)
+                if start == -1:
+                    continue
+            start += len(key)
+            if line[start] == 0x20:
+                start += 1
+            if line[start] != 0x7B:  # {
+                continue
+
+            # Typically the first closing brace ends the object, which is the
+            # case when there's an even number of quotes before it (and no
+            # escapes or nesting)
+            end = line.find(b"}", start) + 1
+            if not (
+                end
+                and line.count(b'"', start, end) % 2 == 0
+                and line.find(b"{", start + 1, end) == -1
+                and line.find(b"[", start, end) == -1
+                and line.find(b"\\", start, end) == -1
+            ):
+                match = FLAT_OBJECT_RE.match(line, start)
+                if match is None:
+                    continue
+                end = match.end()
+
+            if raw_values is None:
+                raw_values = []
+            raw_values.append((start, end, field))
+            position = end
+
+        if raw_values is None:
+            return orjson.loads(line)
+
+        # Parse the rest of the line with the objects replaced by nulls
+        if len(raw_values) > 1:
+            raw_values.sort()
+        parts = []
+        position = 0
+        for start, end, _ in raw_values:
+            parts.append(line[position:start])
+            parts.append(b"null")
+            position = end
+        parts.append(line[position:])
+        entry = orjson.loads(b"".join(parts))
+
+        for start, end, field in raw_values:
+            entry[field] = line[start:end].decode("utf-8", errors="replace")
+        return entry
+
+
+def get_raw_field_decoder(fields):
+    """
+    :returns: A (shared) `RawFieldDecoder` for the list of fields, or None if
+        it's empty.
+    """
+    if not fields:
+        return None
+    return _get_raw_field_decoder(tuple(fields))
+
+
+@functools.lru_cache(maxsize=16)
+def _get_raw_field_decoder(fields):
+    return RawFieldDecoder(fields)
@@ -1,58 +1,309 @@
+import functools
+import hashlib
 import random
 import re
 import sys
 
 import orjson
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-STATUS_CODE_RE = re.compile(r'"EdgeResponseStatus":\s?(\d{3})')
-ORIGIN_RESPONSE_TIME_RE = re.compile(r'"OriginResponseTime":\s?(\d+)')
+
+# The fields a sampling decision (or the key of a dynamic sampler) can be based on,
+# and the type of their values
+SAMPLING_FIELDS = {
+    "CacheCacheStatus": str,
+    "ClientCountry": str,
+    "ClientDeviceType": str,
+    "ClientRequestHost": str,
+    "ClientRequestMethod": str,
+    "ClientRequestPath": str,
+    "ClientRequestURI": str,
+    "EdgeColoCode": str,
+    "EdgeEndTimestamp": int,
+    "EdgeResponseStatus": int,
+    "OriginResponseStatus": int,
+    "OriginResponseTime": int,
+    "ParentRayID": str,
+    "RayID": str,
+}
+
+# A JSON string after a key, with the (still escaped) characters of the string in
+# the group. Lines are matched as bytes, as they come out of the decompressor, so
+# that lines we skip are never decoded.
+STRING_VALUE_RE = re.compile(rb'\s?"((?:[^"\\]++|\\.)*+)"')
+
+# The number of random numbers drawn at a time for sampling decisions
+DRAW_BLOCK_SIZE = 4096
 
 
 class Sampler:
+    # The number of the most recently consumed lines that haven't been emitted or
+    # dropped yet. Used to find how far into the file it's safe to checkpoint.
+    # Samplers that decide one line at a time never hold any back.
+    buffered_lines = 0
+
+    # The number of lines dropped for not having an EdgeResponseStatus, which
+    # sampling by status needs
+    missing_status_lines = 0
+
+    # Parses the lines that are kept, see `.rawfields.RawFieldDecoder` for an
+    # alternative
+    loads = staticmethod(orjson.loads)
+
+    def __init__(self, deterministic=False):
+        """
+        :param deterministic: Base the decision on a hash of the trace root
+            (ParentRayID when set, RayID otherwise) rather than on a random
+            number, so every span of a trace is kept or dropped together, across
+            files and invocations. Lines without a RayID are sampled randomly.
+        """
+        self.deterministic = deterministic
+        self._draws = RandomDraws()
+
     def sample_lines(self, line_iterator, head_sampling_rate_by_status):
         """
         Applies head sampling to a line-based iterator.
+
+        :param line_iterator: An iterator of lines as `bytes`.
         """
+        keep = self._draws.keep
+        loads = self.loads
+        scanner = get_field_scanner(
+            self.get_sampling_fields(head_sampling_rate_by_status)
+        )
         for line in line_iterator:
-            # Use regex to extract status first to not incur the overhead of json
-            # parsing on lines we'll skip
+            # Scan for the fields needed to decide first to not incur the
+            # overhead of json parsing on lines we'll skip
             sampling_rate = 1
+            fields = scanner.scan(line) if scanner is not None else None
 
             if head_sampling_rate_by_status:
-                sampling_rate = sample_line_by_status(
-                    line, head_sampling_rate_by_status
+                status_code = fields.get("EdgeResponseStatus")
+                if not status_code:
+                    self.missing_status_lines += 1
+                sampling_rate = get_sampling_rate(
+                    line, status_code, head_sampling_rate_by_status
                 )
 
             if sampling_rate == 0:
                 continue
 
             if sampling_rate == 1:
-                yield sampling_rate, orjson.loads(line)
+                yield sampling_rate, loads(line)
                 continue
 
-            match = ORIGIN_RESPONSE_TIME_RE.search(line)
-            response_time = int(match.group(1)) if match else 0
+            response_time = fields.get("OriginResponseTime")
+            response_time = int(response_time) if response_time else 0
 
             # Treat any request slower than 1s as an error
             if response_time > 1e9:
-                if head_sampling_rate_by_status:
-                    sampling_rate = head_sampling_rate_by_status.get(500, 1)
+                sampling_rate = head_sampling_rate_by_status.get(500, 1)
+
+            if self.deterministic:
+                trace_root = get_trace_root(fields)
+                if trace_root is not None:
+                    keep_line = keep_trace(trace_root, sampling_rate)
                 else:
-                    sampling_rate = 1
+                    keep_line = keep(sampling_rate)
+            else:
+                keep_line = keep(sampling_rate)
+
+            if keep_line:
+                yield sampling_rate, loads(line)
+
+    def get_sampling_fields(self, head_sampling_rate_by_status):
+        """
+        :returns: The fields a sampling decision can need given the rules, as a
+            tuple of field names.
+        """
+        if not head_sampling_rate_by_status:
+            return ()
+        fields = ["EdgeResponseStatus"]
+        if any(rate > 1 for rate in head_sampling_rate_by_status.values()):
+            fields.append("OriginResponseTime")
+            if self.deterministic:
+                fields.extend(("ParentRayID", "RayID"))
+        return tuple(fields)
+
+
+class FieldScanner:
+    """
+    Finds the values of the fields a sampling decision needs in a raw log line,
+    without scanning more of it than necessary.
+
+    Fields are looked up lazily, in the order they're asked for, each search
+    continuing from where the previous field was found. Logpush writes fields in
+    a fixed (by default alphabetical) order, so as long as they're asked for in
+    that order a line is scanned at most once, and never past the last field
+    needed. A field that isn't found further along is looked for in the part of
+    the line before it. The searches are for the literal `"Field":` key, which is
+    several times faster than running a regex (let alone an alternation of them)
+    over the line.
+    """
+
+    def __init__(self, fields):
+        """
+        :param fields: Names of fields in `SAMPLING_FIELDS`.
+        """
+        self.fields = fields
+        self.keys = {field: b'"%s":' % field.encode("ascii") for field in fields}
+
+    def scan(self, line):
+        return ScannedFields(self, line)
+
+
+class ScannedFields:
+    __slots__ = ("_keys", "_line", "_position", "_found")
+
+    def __init__(self, scanner, line):
+        self._keys = scanner.keys
+        self._line = line
+        self._position = 0
+        self._found = {}
+
+    def get(self, field):
+        """
+        :returns: The raw value of `field` in the line as bytes (without quotes
+            for strings, but with any escapes), or None if it's not in the line or
+            not of the expected type.
+        """
+        found = self._found
+        if field in found:
+            return found[field]
+
+        line = self._line
+        key = self._keys[field]
+        position = self._position
+        start = line.find(key, position)
+        if start == -1 and position:
+            start = line.find(key, 0, position)
+
+        value = None
+        if start != -1:
+            start += len(key)
+            if SAMPLING_FIELDS[field] is str:
+                # Strings can contain commas, so they're matched as a whole
+                match = STRING_VALUE_RE.match(line, start)
+                if match is not None:
+                    value = match.group(1)
+                    start = match.end()
+                self._position = start
+            else:
+                end = line.find(b",", start)
+                if end == -1:
+                    end = line.find(b"}", start)
+                value = line[start:end].strip()
+                self._position = end
+                if not value.isdigit():
+                    value = None
+
+        found[field] = value
+        return value
+
+
+@functools.lru_cache(maxsize=None)
+def get_field_scanner(fields):
+    """
+    :returns: A (shared) `FieldScanner` for the tuple of fields, or None if
+        there are no fields to scan for.
+    """
+    if not fields:
+        return None
+    return FieldScanner(fields)
+
+
+class RandomDraws:
+    """
+    Serves random keep/drop decisions from blocks of pre-drawn 32-bit integers,
+    which is a lot cheaper per decision than `random.randint`. The blocks are
+    drawn with numpy when it's installed, `random.getrandbits` otherwise.
+    """
+
+    def __init__(self, block_size=DRAW_BLOCK_SIZE):
+        self._block_size = block_size
+        self._draws = iter(())
+        self._thresholds = {}
+        self._rng = numpy.random.default_rng() if numpy is not None else None
+
+    def keep(self, sampling_rate):
+        """
+        :returns: True with a probability of 1 / `sampling_rate`.
+        """
+        try:
+            draw = next(self._draws)
+        except StopIteration:
+            self._draws = iter(self._draw_block())
+            draw = next(self._draws)
+
+        threshold = self._thresholds.get(sampling_rate)
+        if threshold is None:
+            # The bias from 2**32 not being divisible by the rate is at most
+            # 2**-32 per decision
+            threshold = self._thresholds[sampling_rate] = 2**32 // sampling_rate
+        return draw < threshold
+
+    def _draw_block(self):
+        if self._rng is not None:
+            return self._rng.integers(
+                0, 2**32, size=self._block_size, dtype=numpy.uint32
+            ).tolist()
+        data = random.getrandbits(32 * self._block_size).to_bytes(
+            4 * self._block_size, "little"
+        )
+        return memoryview(data).cast("I").tolist()
+
+
+def get_trace_root(fields):
+    """
+    :param fields: The `ScannedFields` of a line.
+    :returns: The ray ID of the root of the trace the line belongs to, the
+        ParentRayID for subrequests and the RayID otherwise, as bytes. None if
+        the line doesn't have a RayID.
+    """
+    parent_ray_id = fields.get("ParentRayID")
+    if parent_ray_id and parent_ray_id != b"00":
+        return parent_ray_id
+    return fields.get("RayID")
+
+
+def keep_trace(trace_root, sampling_rate):
+    """
+    Deterministically decide whether to keep the trace with the given root ray
+    ID, from a SHA-1 hash of the (hex) OTel trace ID the ray maps to. The same
+    trace is kept or dropped in every file and invocation. This isn't tied to
+    the decisions of Refinery's deterministic sampler, whose hash depends on its
+    own configuration.
 
-            if random.randint(1, sampling_rate) == 1:
-                yield sampling_rate, orjson.loads(line)
+    A trace kept at one rate is kept at every lower rate too, so when the spans
+    of a trace are sampled at different rates (ie by status), keeping any span
+    guarantees that the spans of the trace with a lower rate are kept as well.
+    """
+    if sampling_rate == 1:
+        return True
+    trace_id = b"%032x" % int(trace_root, 16)
+    value = int.from_bytes(hashlib.sha1(trace_id).digest()[:4], "big")
+    return value <= 0xFFFFFFFF // sampling_rate
 
 
-def sample_line_by_status(line, rate_by_status):
-    match = STATUS_CODE_RE.search(line)
-    if not match:
-        # TODO: Instrument this somehow
-        sys.stderr.write("Log line with missing status code: %s" % line)
+def get_sampling_rate(line, status_code, rate_by_status):
+    """
+    :param line: The raw line, only used for reporting a missing status.
+    :param status_code: The raw EdgeResponseStatus of the line, or None if
+        missing.
+    """
+    if not status_code:
+        # Counted by the sampler as missing_status_lines
+        sys.stderr.write(
+            "Log line with missing status code: %s"
+            % line.decode("utf-8", errors="replace")
+        )
         return 0
 
-    status_code = int(match.group(1))
+    status_code = int(status_code)
     direct_rate = rate_by_status.get(status_code)
     if direct_rate is not None:
         return direct_rate
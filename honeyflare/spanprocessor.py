@@ -0,0 +1,236 @@
+"""
+A span processor that applies backpressure instead of dropping spans. The SDK's
+`BatchSpanProcessor` drops spans once its queue is full, which happens as soon as
+a log file produces spans faster than they can be exported, and only logs about it.
+"""
+import itertools
+import logging
+import queue
+import random
+import threading
+import time
+from collections import Counter
+from concurrent import futures
+
+from opentelemetry.sdk.trace import SpanProcessor
+from opentelemetry.sdk.trace.export import SpanExportResult
+
+
+logger = logging.getLogger(__name__)
+
+# "batch" is the SDK's processor, "blocking" is `BlockingBatchSpanProcessor`
+SPAN_PROCESSORS = ("batch", "blocking")
+
+# The defaults of the SDK's processor
+MAX_QUEUE_SIZE = 2048
+MAX_EXPORT_BATCH_SIZE = 512
+SCHEDULE_DELAY_SECONDS = 5
+
+# Failed batches are exported again this many times, backing off exponentially
+MAX_RETRIES = 3
+
+_SHUTDOWN = object()
+
+
+class _FlushRequest:
+    def __init__(self):
+        self.done = threading.Event()
+        self.succeeded = False
+
+
+class BlockingBatchSpanProcessor(SpanProcessor):
+    """
+    Exports ended spans in batches from a background thread, like the SDK's
+    `BatchSpanProcessor`, except that ending a span blocks while the queue is
+    full rather than dropping it. Batches that fail to export are retried.
+
+    Up to `export_workers` batches are exported at once, each by its own worker
+    thread and retried independently of the others, so the order batches arrive
+    in isn't guaranteed. The exporter needs to be thread safe for more than one,
+    which an `OTLPSpanExporter` is, and can use a connection per worker when
+    given a `requests.Session` with a large enough pool.
+
+    The number of spans exported, retried and dropped (after running out of
+    retries, or for ending after shutdown) are counted in `stats`, along with
+    the requests, spans and seconds spent exporting of each worker, see
+    `export_worker_attributes`.
+    """
+
+    def __init__(
+        self,
+        exporter,
+        max_queue_size=MAX_QUEUE_SIZE,
+        max_export_batch_size=MAX_EXPORT_BATCH_SIZE,
+        schedule_delay=SCHEDULE_DELAY_SECONDS,
+        max_retries=MAX_RETRIES,
+        export_workers=1,
+        stats=None,
+    ):
+        """
+        :param exporter: The `SpanExporter` to export batches with.
+        :param max_queue_size: The max number of spans waiting to be exported
+            before ending a span blocks.
+        :param max_export_batch_size: The max number of spans per export.
+        :param schedule_delay: The max number of seconds a span waits for its
+            batch to fill up before it's exported anyway.
+        :param export_workers: The max number of batches exported at once.
+        :param stats: A `collections.Counter` to count spans in, the keys are
+            "exported", "retried" and "dropped".
+        """
+        if max_export_batch_size > max_queue_size:
+            raise ValueError("The batch size can't be larger than the queue size")
+        self.exporter = exporter
+        self.max_export_batch_size = max_export_batch_size
+        self.schedule_delay = schedule_delay
+        self.max_retries = max_retries
+        self.export_workers = export_workers
+        self.stats = stats if stats is not None else Counter()
+        self._stats_lock = threading.Lock()
+        self._queue = queue.Queue(max_queue_size)
+        self._failed = False
+        self._shutdown = False
+        self._in_flight = set()
+        self._worker_ids = itertools.count()
+        self._worker_local = threading.local()
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=export_workers, thread_name_prefix="honeyflare-span-export"
+        )
+        self._worker = threading.Thread(
+            target=self._run, name="honeyflare-span-processor", daemon=True
+        )
+        self._worker.start()
+
+    def on_end(self, span):
+        if not span.context.trace_flags.sampled:
+            return
+        if self._shutdown:
+            self.stats["dropped"] += 1
+            return
+        self._queue.put(span)
+
+    def force_flush(self, timeout_millis=30000):
+        """
+        Exports the spans ended so far.
+
+        :returns: True if all spans since the last flush were exported.
+        """
+        if self._shutdown:
+            return False
+        request = _FlushRequest()
+        self._queue.put(request)
+        return request.done.wait(timeout_millis / 1000) and request.succeeded
+
+    def shutdown(self):
+        if self._shutdown:
+            return
+        self._shutdown = True
+        self._queue.put(_SHUTDOWN)
+        self._worker.join()
+        self._executor.shutdown()
+        self.exporter.shutdown()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None
+            if batch:
+                timeout = max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _SHUTDOWN:
+                self._submit(batch)
+                self._wait_for_exports()
+                return
+            if isinstance(item, _FlushRequest):
+                self._submit(batch)
+                batch = []
+                self._wait_for_exports()
+                item.succeeded = not self._failed
+                self._failed = False
+                item.done.set()
+                continue
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.schedule_delay
+                batch.append(item)
+                if len(batch) < self.max_export_batch_size:
+                    continue
+            self._submit(batch)
+            batch = []
+
+    def _submit(self, batch):
+        if not batch:
+            return
+        while len(self._in_flight) >= self.export_workers:
+            _, self._in_flight = futures.wait(
+                self._in_flight, return_when=futures.FIRST_COMPLETED
+            )
+        self._in_flight.add(self._executor.submit(self._export, batch))
+
+    def _wait_for_exports(self):
+        futures.wait(self._in_flight)
+        self._in_flight = set()
+
+    def _export(self, batch):
+        worker = self._worker_id()
+        for retry in range(self.max_retries + 1):
+            if retry:
+                self._count({"retried": len(batch)})
+                time.sleep(2 ** (retry - 1) * random.uniform(0.8, 1.2))
+            start_time = time.perf_counter()
+            try:
+                result = self.exporter.export(batch)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Exception while exporting spans")
+                result = SpanExportResult.FAILURE
+            counts = {
+                "worker.%d.requests" % worker: 1,
+                "worker.%d.seconds" % worker: time.perf_counter() - start_time,
+            }
+            if result == SpanExportResult.SUCCESS:
+                counts["worker.%d.spans" % worker] = len(batch)
+                counts["exported"] = len(batch)
+                self._count(counts)
+                return
+            self._count(counts)
+
+        logger.error("Dropping %d spans that failed to export", len(batch))
+        self._count({"dropped": len(batch)})
+        self._failed = True
+
+    def _worker_id(self):
+        worker = getattr(self._worker_local, "id", None)
+        if worker is None:
+            worker = self._worker_local.id = next(self._worker_ids)
+        return worker
+
+    def _count(self, counts):
+        with self._stats_lock:
+            self.stats.update(counts)
+
+
+def export_worker_attributes(stats):
+    """
+    :param stats: The `stats` of a `BlockingBatchSpanProcessor`.
+    :returns: A dict of meta span attributes with the number of requests, mean
+        latency and throughput (of spans exported per second spent exporting) of
+        each export worker.
+    """
+    attributes = {}
+    workers = sorted(
+        {key.split(".")[1] for key in stats if key.startswith("worker.")}, key=int
+    )
+    for worker in workers:
+        requests = stats["worker.%s.requests" % worker]
+        seconds = stats["worker.%s.seconds" % worker]
+        prefix = "export.worker_%s." % worker
+        attributes[prefix + "requests"] = requests
+        attributes[prefix + "latency_ms"] = seconds * 1000 / requests
+        attributes[prefix + "spans_per_second"] = (
+            stats["worker.%s.spans" % worker] / seconds if seconds else 0.0
+        )
+    return attributes
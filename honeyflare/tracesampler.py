@@ -0,0 +1,162 @@
+"""
+Trace-aware sampling within a file: the lines of a trace (a worker request and its
+subrequests) are held back until the trace is complete, then kept or dropped as a
+whole, always keeping traces where any span is an error or slow.
+"""
+from collections import OrderedDict
+
+from .sampler import Sampler, get_field_scanner, get_trace_root, keep_trace
+
+
+TRACE_FIELDS = (
+    "EdgeEndTimestamp",
+    "EdgeResponseStatus",
+    "OriginResponseTime",
+    "ParentRayID",
+    "RayID",
+)
+
+# A trace is considered complete once lines this much newer than its first line
+# have been seen
+WINDOW_SECONDS = 30
+
+# The max number of lines held back, the oldest traces are decided early beyond it
+MAX_BUFFERED_LINES = 20000
+
+# Requests slower than this are considered interesting, like errors
+SLOW_THRESHOLD_NS = 10**9
+
+
+class TraceSampler(Sampler):
+    def __init__(
+        self,
+        sampling_rate,
+        error_status=500,
+        slow_threshold_ns=SLOW_THRESHOLD_NS,
+        window_seconds=WINDOW_SECONDS,
+        max_buffered_lines=MAX_BUFFERED_LINES,
+    ):
+        """
+        :param sampling_rate: The rate traces without any interesting spans are
+            sampled at. The decision is a hash of the trace root, like
+            `Sampler(deterministic=True)`, so it's the same for the parts of a
+            trace that end up in other files.
+        :param error_status: Traces with a span with this status or higher are
+            always kept.
+        :param slow_threshold_ns: Traces with a span with an OriginResponseTime
+            above this are always kept.
+        :param window_seconds: How long after its first span (by
+            EdgeEndTimestamp) a trace is held back waiting for more spans.
+        :param max_buffered_lines: The max number of lines held back.
+        """
+        super().__init__()
+        self.sampling_rate = sampling_rate
+        self.error_status = error_status
+        self.slow_threshold_ns = slow_threshold_ns
+        self.window_ns = int(window_seconds * 10**9)
+        self.max_buffered_lines = max_buffered_lines
+
+    def sample_lines(self, line_iterator, head_sampling_rate_by_status):
+        """
+        Applies trace-aware sampling to a line-based iterator.
+        `head_sampling_rate_by_status` is not used.
+
+        :param line_iterator: An iterator of lines as `bytes`.
+        """
+        scanner = get_field_scanner(TRACE_FIELDS)
+        keep = self._draws.keep
+        traces = OrderedDict()
+        buffered = 0
+        latest_timestamp = None
+        consumed = 0
+        for line in line_iterator:
+            consumed += 1
+            fields = scanner.scan(line)
+            timestamp = fields.get("EdgeEndTimestamp")
+            timestamp = int(timestamp) if timestamp else None
+            interesting = self.is_interesting(fields)
+            trace_root = get_trace_root(fields)
+
+            if trace_root is None:
+                # Not part of any trace, decide right away, but only once the
+                # line counts as consumed, or a checkpoint taken while it's sent
+                # would skip the lines of the traces still held back
+                self._update_buffered_lines(traces, consumed)
+                if interesting:
+                    yield 1, self.loads(line)
+                elif keep(self.sampling_rate):
+                    yield self.sampling_rate, self.loads(line)
+            else:
+                trace = traces.get(trace_root)
+                if trace is None:
+                    trace = traces[trace_root] = BufferedTrace(
+                        consumed - 1, timestamp
+                    )
+                trace.lines.append(line)
+                trace.interesting = trace.interesting or interesting
+                buffered += 1
+
+            if timestamp is not None and (
+                latest_timestamp is None or timestamp > latest_timestamp
+            ):
+                latest_timestamp = timestamp
+
+            while traces:
+                trace_root, trace = next(iter(traces.items()))
+                if buffered <= self.max_buffered_lines and (
+                    trace.timestamp is None
+                    or latest_timestamp - trace.timestamp <= self.window_ns
+                ):
+                    break
+                del traces[trace_root]
+                buffered -= len(trace.lines)
+                self.buffered_lines = consumed - trace.first_index
+                yield from self._sample_trace(trace_root, trace)
+
+            self._update_buffered_lines(traces, consumed)
+
+        while traces:
+            trace_root, trace = traces.popitem(last=False)
+            self.buffered_lines = consumed - trace.first_index
+            yield from self._sample_trace(trace_root, trace)
+        self.buffered_lines = 0
+
+    def is_interesting(self, fields):
+        """
+        :param fields: The `ScannedFields` of a line.
+        """
+        status = fields.get("EdgeResponseStatus")
+        if status and int(status) >= self.error_status:
+            return True
+        response_time = fields.get("OriginResponseTime")
+        return bool(response_time) and int(response_time) > self.slow_threshold_ns
+
+    def _sample_trace(self, trace_root, trace):
+        if trace.interesting:
+            sampling_rate = 1
+        elif keep_trace(trace_root, self.sampling_rate):
+            sampling_rate = self.sampling_rate
+        else:
+            return
+        for line in trace.lines:
+            yield sampling_rate, self.loads(line)
+
+    def _update_buffered_lines(self, traces, consumed):
+        # Traces are decided oldest first, but their lines are interleaved with
+        # those of newer ones. Report everything from the first line of the oldest
+        # trace still held back, so a checkpoint never skips a line that hasn't
+        # been sent (at the cost of a resumed invocation resending some).
+        if traces:
+            self.buffered_lines = consumed - next(iter(traces.values())).first_index
+        else:
+            self.buffered_lines = 0
+
+
+class BufferedTrace:
+    __slots__ = ("first_index", "timestamp", "lines", "interesting")
+
+    def __init__(self, first_index, timestamp):
+        self.first_index = first_index
+        self.timestamp = timestamp
+        self.lines = []
+        self.interesting = False
@@ -1,3 +1,4 @@
+import functools
 import re
 import urllib.parse
 from collections import namedtuple
@@ -19,6 +20,35 @@ UrlShape = namedtuple(
     ],
 )
 
+# The default max number of URIs a `UrlShaper` caches the shape of
+CACHE_SIZE = 10000
+
+# The max number of hosts a `UrlShaper` caches the patterns of
+HOST_CACHE_SIZE = 1024
+
+# The default max number of distinct shapes a `PathShapeInferrer` infers. Paths
+# with shapes beyond that all get `OVERFLOW_PATH_SHAPE`.
+MAX_INFERRED_SHAPES = 1000
+OVERFLOW_PATH_SHAPE = "/:other"
+
+# The max number of paths a `PathShapeInferrer` caches the shape of
+INFERENCE_CACHE_SIZE = 10000
+
+# Path segments that look like identifiers, by the placeholder they're replaced with
+SEGMENT_PLACEHOLDER_RE = re.compile(
+    r"""
+    (?P<id>[0-9]+)
+    |(?P<uuid>[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})
+    |(?P<hash>[0-9a-fA-F]{16,})
+    |(?P<token>(?=[^0-9]*[0-9])[A-Za-z0-9_=~.-]{20,})
+    """,
+    re.VERBOSE,
+)
+
+# Characters that make a (non-parameter) part of a pattern behave as a regex rather
+# than a literal path segment
+REGEX_CHARACTERS_RE = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
 
 def compile_pattern(path_pattern):
     """
@@ -47,39 +77,34 @@ def compile_pattern(path_pattern):
     return Pattern(path_pattern, regex)
 
 
-def urlshape(uri, patterns, query_param_filter=None):
+def urlshape(uri, patterns, query_param_filter=None, path_shape_inferrer=None):
     """
     :param uri: A relative uri to be parsed.
-    :param patterns: A list of `Pattern` to match against.
+    :param patterns: A list of `Pattern` to match against, or a `PatternRouter`
+        for them.
     :param query_param_filter: A set of the query parameters that will be included
         in the result. If `None` all params will be included, if empty set none
         will be included.
+    :param path_shape_inferrer: A `PathShapeInferrer` giving the shape of paths
+        that don't match any pattern. If `None` those paths are their own shape.
     :returns: A UrlShape
     """
-    parsed_uri = urllib.parse.urlparse("s://" + uri)
+    path, query = split_uri(uri)
     path_params = {}
-    query_params = {}
-    for pattern in patterns:
-        match = pattern.regex.match(parsed_uri.path)
-        if not match:
-            continue
+    pattern, match = match_path(path, patterns)
+    if pattern is not None:
         path_shape = pattern.shape
         path_shape_strict = pattern.shape
         path_params = match.groupdict()
-        break
+    elif path_shape_inferrer is not None:
+        path_shape = path_shape_inferrer.infer(path)
+        path_shape_strict = None
     else:
-        path_shape = parsed_uri.path
+        path_shape = path
         path_shape_strict = None
 
-    params = []
-    for param, value in sorted(
-        urllib.parse.parse_qsl(parsed_uri.query, keep_blank_values=True)
-    ):
-        if query_param_filter is None or param in query_param_filter:
-            query_params[param] = value
-        params.append(param)
-
-    query_shape = "&".join("%s=?" % param for param in params)
+    params, query_params = parse_query(query, query_param_filter)
+    query_shape = "=?&".join(params) + "=?" if params else ""
 
     if query_shape:
         uri_shape = path_shape + "?" + query_shape
@@ -88,11 +113,346 @@ def urlshape(uri, patterns, query_param_filter=None):
 
     return UrlShape(
         uri_shape,
-        parsed_uri.path,
-        parsed_uri.query,
+        path,
+        query,
         path_shape,
         path_shape_strict,
         query_shape,
         path_params,
         query_params,
     )
+
+
+def split_uri(uri):
+    """
+    :param uri: A relative uri, ie ClientRequestURI.
+    :returns: A tuple of the path and query of the uri, as `urllib.parse.urlparse`
+        parses them.
+    """
+    # Cloudflare's request URIs are origin-form, for which the path and query are
+    # simply split by the first "?". Anything urlparse would treat specially
+    # (fragments, stripped characters, a leading host) is left to it.
+    if uri[:1] != "/" or "#" in uri or "\t" in uri or "\r" in uri or "\n" in uri:
+        parsed_uri = urllib.parse.urlparse("s://" + uri)
+        return parsed_uri.path, parsed_uri.query
+    path, _, query = uri.partition("?")
+    return path, query
+
+
+def parse_query(query, query_param_filter=None):
+    """
+    Parses a query string the way `urllib.parse.parse_qsl` does with
+    `keep_blank_values`, only decoding what needs to be decoded.
+
+    :param query_param_filter: See `urlshape`.
+    :returns: A tuple of the sorted list of parameter names (repeated for
+        repeated parameters) and a dict of the values of those in
+        `query_param_filter`, the greatest value for repeated parameters.
+    """
+    params = []
+    query_params = {}
+    if not query:
+        return params, query_params
+
+    unquote = urllib.parse.unquote
+    for name_value in query.split("&"):
+        if not name_value:
+            continue
+        name, _, value = name_value.partition("=")
+        if "+" in name or "%" in name:
+            name = unquote(name.replace("+", " "), errors="replace")
+        params.append(name)
+        if query_param_filter is None or name in query_param_filter:
+            if "+" in value or "%" in value:
+                value = unquote(value.replace("+", " "), errors="replace")
+            previous = query_params.get(name)
+            if previous is None or value > previous:
+                query_params[name] = value
+
+    params.sort()
+    return params, query_params
+
+
+def match_path(path, patterns):
+    """
+    :param patterns: A list of `Pattern`, or a `PatternRouter` for them.
+    :returns: A tuple of the first pattern matching the path and the regex match
+        object, or (None, None) if there's no match.
+    """
+    if isinstance(patterns, PatternRouter):
+        return patterns.match(path)
+    for pattern in patterns:
+        match = pattern.regex.match(path)
+        if match:
+            return pattern, match
+    return None, None
+
+
+class PatternRouter:
+    """
+    Finds the first of a list of `Pattern` that matches a path without trying
+    every pattern in turn. Patterns are indexed in a trie with an edge per
+    static path segment and one for any `:param` segment, so looking up a path
+    walks roughly one node per segment of it. That gives the patterns that can
+    match the path, and the regexes of only those are tried, in their original
+    order, so the first match wins as before.
+
+    Patterns ending in `*` are indexed one segment short of their prefix, since
+    their last segment before the `*` also matches segments it's a prefix of.
+    The rare patterns with regex characters in a static part can't be indexed
+    and are always tried.
+    """
+
+    def __init__(self, patterns):
+        """
+        :param patterns: A list of `Pattern`, in order of priority.
+        """
+        self.patterns = patterns
+        self._root = _RouterNode()
+        self._always = []
+        for index, pattern in enumerate(patterns):
+            self._add(index, pattern)
+
+    def match(self, path):
+        """
+        :returns: A tuple of the first pattern matching the path and the regex
+            match object, or (None, None) if there's no match.
+        """
+        patterns = self.patterns
+        for index in sorted(self._candidates(path)):
+            match = patterns[index].regex.match(path)
+            if match:
+                return patterns[index], match
+        return None, None
+
+    def _add(self, index, pattern):
+        parts = PurePosixPath(pattern.shape).parts[1:]
+        wildcard = pattern.shape.endswith("*")
+        if wildcard:
+            if not parts or parts[-1] != "*":
+                self._always.append(index)
+                return
+            parts = parts[:-2]
+
+        if any(
+            not part.startswith(":") and REGEX_CHARACTERS_RE.search(part)
+            for part in parts
+        ):
+            self._always.append(index)
+            return
+
+        node = self._root
+        for part in parts:
+            if part.startswith(":"):
+                if node.param is None:
+                    node.param = _RouterNode()
+                node = node.param
+            else:
+                node = node.static.setdefault(part, _RouterNode())
+
+        if wildcard:
+            node.wildcard.append(index)
+        else:
+            node.exact.append(index)
+
+    def _candidates(self, path):
+        segments = path.split("/")[1:]
+        if segments and not segments[-1]:
+            # A single trailing slash is optional or required by the regex
+            segments.pop()
+
+        candidates = list(self._always)
+        stack = [(self._root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            candidates.extend(node.wildcard)
+            if depth == len(segments):
+                candidates.extend(node.exact)
+                continue
+            segment = segments[depth]
+            child = node.static.get(segment)
+            if child is not None:
+                stack.append((child, depth + 1))
+            if node.param is not None and segment:
+                stack.append((node.param, depth + 1))
+        return candidates
+
+
+class _RouterNode:
+    __slots__ = ("static", "param", "exact", "wildcard")
+
+    def __init__(self):
+        self.static = {}
+        self.param = None
+        self.exact = []
+        self.wildcard = []
+
+
+class PathShapeInferrer:
+    """
+    Guesses the shape of paths no pattern matches by replacing the segments that
+    look like identifiers with placeholders: `:id` for numbers, `:uuid`, `:hash`
+    for long hex strings and `:token` for other long strings with digits in them.
+    Ie `/users/1337/files/9f86d081884c7d65` becomes `/users/:id/files/:hash`.
+
+    Results are cached, and the number of distinct shapes is capped so the
+    cardinality of PathShape stays bounded whatever the heuristics miss.
+    """
+
+    def __init__(
+        self,
+        max_shapes=MAX_INFERRED_SHAPES,
+        cache_size=INFERENCE_CACHE_SIZE,
+    ):
+        """
+        :param max_shapes: The max number of distinct shapes to infer. Paths with
+            shapes beyond that get `OVERFLOW_PATH_SHAPE`.
+        :param cache_size: The max number of paths to cache the shape of.
+        """
+        self.max_shapes = max_shapes
+        self.shapes = set()
+        self.overflowed = 0
+        self.infer = functools.lru_cache(maxsize=cache_size)(self._infer)
+
+    def _infer(self, path):
+        segments = path.split("/")
+        for index, segment in enumerate(segments):
+            if not segment:
+                continue
+            match = SEGMENT_PLACEHOLDER_RE.fullmatch(segment)
+            if match:
+                segments[index] = ":" + match.lastgroup
+        shape = "/".join(segments)
+
+        if shape not in self.shapes:
+            if len(self.shapes) >= self.max_shapes:
+                self.overflowed += 1
+                return OVERFLOW_PATH_SHAPE
+            self.shapes.add(shape)
+        return shape
+
+
+class UrlShaper:
+    """
+    Shapes URIs with a fixed set of patterns and query parameter filter, caching
+    the shapes of the most recently seen URIs. Traffic tends to be dominated by a
+    limited set of distinct URIs, which then cost a cache lookup rather than a
+    parse.
+    """
+
+    def __init__(
+        self,
+        patterns,
+        query_param_filter=None,
+        cache_size=CACHE_SIZE,
+        path_shape_inferrer=None,
+    ):
+        """
+        :param patterns: A list of `Pattern` to match against, or a dict mapping
+            hosts to such lists. Hosts are either exact (`example.com`) or
+            wildcards matching any subdomain (`*.example.com`), and the patterns
+            of the `*` host, if any, apply to all other hosts.
+        :param query_param_filter: See `urlshape`.
+        :param cache_size: The max number of URIs to cache the shape of.
+        :param path_shape_inferrer: See `urlshape`.
+        """
+        self.patterns = patterns
+        self.query_param_filter = query_param_filter
+        self.path_shape_inferrer = path_shape_inferrer
+        self.routers_by_host = {}
+        self.wildcard_routers = []
+        if isinstance(patterns, dict):
+            self.router = PatternRouter(patterns.get("*", []))
+            for host, host_patterns in patterns.items():
+                host = host.lower()
+                if host == "*":
+                    continue
+                if host.startswith("*."):
+                    self.wildcard_routers.append(
+                        (host[1:], PatternRouter(host_patterns))
+                    )
+                else:
+                    self.routers_by_host[host] = PatternRouter(host_patterns)
+            # The most specific wildcard wins
+            self.wildcard_routers.sort(key=lambda item: len(item[0]), reverse=True)
+        else:
+            self.router = PatternRouter(patterns)
+        self._urlshape = functools.lru_cache(maxsize=cache_size)(self._shape)
+        self.get_router = functools.lru_cache(maxsize=HOST_CACHE_SIZE)(self._get_router)
+
+    def urlshape(self, uri, host=None):
+        """
+        :param uri: See `urlshape`.
+        :param host: The host of the request, ie ClientRequestHost, which picks
+            the patterns to match against when they're set per host.
+        :returns: A UrlShape
+        """
+        if host is None or not (self.routers_by_host or self.wildcard_routers):
+            return self._urlshape(uri, self.router)
+        return self._urlshape(uri, self.get_router(host))
+
+    def _shape(self, uri, router):
+        return urlshape(uri, router, self.query_param_filter, self.path_shape_inferrer)
+
+    def _get_router(self, host):
+        host = host.lower()
+        router = self.routers_by_host.get(host)
+        if router is not None:
+            return router
+        for suffix, router in self.wildcard_routers:
+            if host.endswith(suffix):
+                return router
+        return self.router
+
+    def cache_info(self):
+        """
+        :returns: The `functools.lru_cache` statistics (hits, misses, maxsize,
+            currsize) of the cache.
+        """
+        return self._urlshape.cache_info()
+
+
+def get_url_shaper(patterns, query_param_filter=None, max_inferred_shapes=None):
+    """
+    :param patterns: A list of path patterns like `/user/:userId/`, or a dict
+        mapping hosts to such lists, see `UrlShaper`.
+    :param query_param_filter: See `urlshape`.
+    :param max_inferred_shapes: Infer the shape of paths matching no pattern with
+        a `PathShapeInferrer` capped at this many shapes. None to disable.
+    :returns: A `UrlShaper` for the arguments. The same one is returned for the
+        same arguments, so its cache stays warm between invocations.
+    """
+    if query_param_filter is not None:
+        query_param_filter = frozenset(query_param_filter)
+    if isinstance(patterns, dict):
+        return _get_url_shaper(
+            tuple(
+                sorted(
+                    (host, tuple(host_patterns))
+                    for host, host_patterns in patterns.items()
+                )
+            ),
+            query_param_filter,
+            max_inferred_shapes,
+            by_host=True,
+        )
+    return _get_url_shaper(
+        tuple(patterns or ()), query_param_filter, max_inferred_shapes
+    )
+
+
+@functools.lru_cache(maxsize=16)
+def _get_url_shaper(patterns, query_param_filter, max_inferred_shapes, by_host=False):
+    path_shape_inferrer = None
+    if max_inferred_shapes is not None:
+        path_shape_inferrer = PathShapeInferrer(max_inferred_shapes)
+    if by_host:
+        patterns = {
+            host: [compile_pattern(p) for p in host_patterns]
+            for host, host_patterns in patterns
+        }
+    else:
+        patterns = [compile_pattern(p) for p in patterns]
+    return UrlShaper(
+        patterns, query_param_filter, path_shape_inferrer=path_shape_inferrer
+    )
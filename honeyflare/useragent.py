@@ -0,0 +1,111 @@
+"""
+A coarse classification of user agents by a table of rules, which is enough to
+group traffic by browser, OS, device type and bot without pulling in a full
+user agent parser.
+"""
+import functools
+import re
+from collections import namedtuple
+
+
+UserAgent = namedtuple("UserAgent", "family os device bot")
+
+# The max number of distinct user agents the classification of is cached
+CACHE_SIZE = 4096
+
+OTHER = "Other"
+
+# Rules are (regex, value) tried in order, the first match wins. Order matters as
+# most user agents claim to be several others, ie Edge claims Chrome and Safari.
+BOT_RULES = [
+    (re.compile(regex, re.IGNORECASE), family)
+    for regex, family in (
+        (r"Googlebot|Google-InspectionTool|AdsBot-Google", "Googlebot"),
+        (r"bingbot|BingPreview", "Bingbot"),
+        (r"YandexBot", "YandexBot"),
+        (r"Baiduspider", "Baiduspider"),
+        (r"DuckDuckBot", "DuckDuckBot"),
+        (r"Applebot", "Applebot"),
+        (r"facebookexternalhit|meta-externalagent", "Facebook"),
+        (r"Twitterbot", "Twitterbot"),
+        (r"Slackbot", "Slackbot"),
+        (r"AhrefsBot", "AhrefsBot"),
+        (r"SemrushBot", "SemrushBot"),
+        (r"GPTBot|ChatGPT-User|OAI-SearchBot", "OpenAI"),
+        (r"ClaudeBot|Claude-User|Claude-SearchBot", "Anthropic"),
+        (r"CCBot", "CCBot"),
+        (r"UptimeRobot", "UptimeRobot"),
+        (r"Pingdom", "Pingdom"),
+        (r"HeadlessChrome", "HeadlessChrome"),
+        (r"^curl/", "curl"),
+        (r"^Wget/", "Wget"),
+        (r"python-requests|python-urllib|aiohttp|httpx", "Python"),
+        (r"Go-http-client", "Go"),
+        (r"okhttp", "OkHttp"),
+        (r"^Java/|Apache-HttpClient", "Java"),
+        # "bot" as a word or ending a name with a version (ie "DotBot/1.2"), but
+        # not device names that happen to end in it (ie "CUBOT X19")
+        (r"\bbot\b|[a-z]bot/|crawl|spider|slurp|scrape", OTHER),
+    )
+]
+
+FAMILY_RULES = [
+    (re.compile(regex), family)
+    for regex, family in (
+        (r"Edg(e|A|iOS)?/", "Edge"),
+        (r"OPR/|Opera", "Opera"),
+        (r"SamsungBrowser/", "Samsung Internet"),
+        (r"YaBrowser/", "Yandex Browser"),
+        (r"Firefox/|FxiOS/", "Firefox"),
+        (r"Chrome/|CriOS/", "Chrome"),
+        (r"Version/[\d.]+.*Safari/", "Safari"),
+        (r"MSIE |Trident/", "Internet Explorer"),
+    )
+]
+
+OS_RULES = [
+    (re.compile(regex), os_name)
+    for regex, os_name in (
+        (r"Windows", "Windows"),
+        (r"iPhone|iPad|iPod", "iOS"),
+        (r"Mac OS X|Macintosh", "macOS"),
+        (r"Android", "Android"),
+        (r"CrOS", "Chrome OS"),
+        (r"Linux", "Linux"),
+    )
+]
+
+DEVICE_RULES = [
+    (re.compile(regex), device)
+    for regex, device in (
+        (r"iPad|Tablet|Android(?!.*Mobile)", "tablet"),
+        (r"Mobi|iPhone|iPod|Android", "mobile"),
+    )
+]
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def classify(user_agent):
+    """
+    :param user_agent: A User-Agent header, ie ClientRequestUserAgent.
+    :returns: A `UserAgent` with the browser (or bot) family, OS and device type
+        ("desktop", "mobile", "tablet" or "bot"), and whether it's a bot. Parts
+        that aren't recognized are "Other".
+    """
+    os_name = _first_match(OS_RULES, user_agent)
+    bot = _first_match(BOT_RULES, user_agent, None)
+    if bot is not None:
+        return UserAgent(bot, os_name, "bot", True)
+    return UserAgent(
+        _first_match(FAMILY_RULES, user_agent),
+        os_name,
+        _first_match(DEVICE_RULES, user_agent, "desktop"),
+        False,
+    )
+
+
+def _first_match(rules, user_agent, default=OTHER):
+    for regex, value in rules:
+        if regex.search(user_agent):
+            return value
+    return default
@@ -8,11 +8,20 @@ from flask import abort  # pylint: disable=import-error
 from google.cloud import storage
 
 from honeyflare import (
+    DOWNLOAD_MODES,
+    EXPORT_ENGINES,
+    SPAN_PROCESSORS,
     create_otel_tracer,
     process_bucket_object,
     RetriableError,
+    Sampler,
+    compress,
+    decompress,
     logfmt,
 )
+from honeyflare.dynsampler import DynamicSampler, ReservoirSampler
+from honeyflare.tracesampler import TraceSampler
+from honeyflare.urlshape import get_url_shaper
 
 # Ignoring invalid names here due to all the globals we cache (which aren't necessarily
 # constants)
@@ -26,6 +35,8 @@ storage_client._http.mount("https://", adapter)
 storage_client._http._auth_request.session.mount("https://", adapter)
 
 
+# Either a list of path patterns, or an object mapping hosts (ClientRequestHost, ie
+# "example.com" or "*.example.com") to lists of them
 patterns = os.environ.get("PATTERNS")
 if patterns is not None:
     patterns = json.loads(patterns)
@@ -36,10 +47,156 @@ query_param_filter = os.environ.get("QUERY_PARAM_FILTER")
 if query_param_filter is not None:
     query_param_filter = set(json.loads(query_param_filter))
 
+# Set to infer the PathShape of paths matching no pattern, with at most this many
+# distinct shapes
+max_inferred_shapes = os.environ.get("MAX_INFERRED_PATH_SHAPES")
+if max_inferred_shapes is not None:
+    max_inferred_shapes = int(max_inferred_shapes)
+
+# An object mapping CIDR ranges to labels, set as ClientIPRange for client IPs in them
+client_ip_ranges = os.environ.get("CLIENT_IP_RANGES")
+if client_ip_ranges is not None:
+    client_ip_ranges = json.loads(client_ip_ranges)
+
+# Lists of log fields (or globs like "Edge*") to send and not to send as attributes
+field_allowlist = os.environ.get("FIELD_ALLOWLIST")
+if field_allowlist is not None:
+    field_allowlist = json.loads(field_allowlist)
+
+field_denylist = os.environ.get("FIELD_DENYLIST")
+if field_denylist is not None:
+    field_denylist = json.loads(field_denylist)
+
+# A list of fields with JSON object values (ie RequestHeaders) to send as they are in
+# the logs, without parsing them
+raw_fields = os.environ.get("RAW_FIELDS")
+if raw_fields is not None:
+    raw_fields = json.loads(raw_fields)
+
+# "sdk" (default) creates spans with the OTel SDK, "direct" encodes OTLP requests
+# straight from the logs, which is a lot cheaper per span
+export_engine = os.environ.get("EXPORT_ENGINE", "sdk")
+if export_engine not in EXPORT_ENGINES:
+    raise ValueError("Unknown EXPORT_ENGINE %r" % export_engine)
+
+# "batch" (default) is the OTel SDK's span processor, which drops spans when exports
+# can't keep up, "blocking" waits for them instead
+span_processor = os.environ.get("SPAN_PROCESSOR", "batch")
+if span_processor not in SPAN_PROCESSORS:
+    raise ValueError("Unknown SPAN_PROCESSOR %r" % span_processor)
+
+span_queue_size = os.environ.get("SPAN_QUEUE_SIZE")
+if span_queue_size is not None:
+    span_queue_size = int(span_queue_size)
+
+span_batch_size = os.environ.get("SPAN_BATCH_SIZE")
+if span_batch_size is not None:
+    span_batch_size = int(span_batch_size)
+
+# The number of span batches exported at once, needs SPAN_PROCESSOR=blocking with
+# the SDK export engine
+export_workers = int(os.environ.get("EXPORT_WORKERS", "1"))
+if export_workers > 1 and export_engine == "sdk" and span_processor != "blocking":
+    raise ValueError("EXPORT_WORKERS > 1 needs SPAN_PROCESSOR=blocking or EXPORT_ENGINE=direct")
+
+# "none" (default), "gzip" or "zstd" (needs Python 3.14 or the zstandard package)
+export_compression = os.environ.get("EXPORT_COMPRESSION", "none")
+
+export_compression_level = os.environ.get("EXPORT_COMPRESSION_LEVEL")
+if export_compression_level is not None:
+    export_compression_level = int(export_compression_level)
+
+# Raises if the algorithm isn't available or the level is out of its range, which
+# would otherwise only show once the first batch is compressed
+if export_compression != compress.NONE:
+    compress.Compressor(export_compression, export_compression_level)
+
 lock_bucket = os.environ.get("LOCK_BUCKET")
 if lock_bucket is not None:
     lock_bucket = storage_client.bucket(lock_bucket)
 
+# "stream" (default) reads the object straight into the decompressor, "file" stages
+# it in /tmp first and "ranged" stages it in /tmp using concurrent ranged requests
+# over the connection pool mounted above
+download_mode = os.environ.get("DOWNLOAD_MODE", "stream")
+# Checked here rather than per file, which would drop every file as non-retriable
+if download_mode not in DOWNLOAD_MODES:
+    raise ValueError("Unknown DOWNLOAD_MODE %r" % download_mode)
+
+stream_chunk_size = os.environ.get("STREAM_CHUNK_SIZE")
+if stream_chunk_size is not None:
+    stream_chunk_size = int(stream_chunk_size)
+
+ranged_chunk_size = os.environ.get("RANGED_CHUNK_SIZE")
+if ranged_chunk_size is not None:
+    ranged_chunk_size = int(ranged_chunk_size)
+
+ranged_max_workers = os.environ.get("RANGED_MAX_WORKERS")
+if ranged_max_workers is not None:
+    ranged_max_workers = int(ranged_max_workers)
+
+# One of honeyflare.decompress.BACKENDS, defaults to the fastest one installed
+decompression_backend = os.environ.get("DECOMPRESSION_BACKEND")
+# Raises if it's unknown or not installed, rather than failing every file
+decompress.get_backend(decompression_backend)
+
+threaded_decompression = os.environ.get("THREADED_DECOMPRESSION", "true") == "true"
+
+# Stop processing this long before the function times out, leaving time to flush and
+# checkpoint so the retry resumes where we stopped. FUNCTION_TIMEOUT_SEC is set by the
+# 1st gen Cloud Functions runtime only, so there's no deadline unless it's set (by
+# hand on other runtimes), as guessing a timeout longer than the real one is useless.
+function_timeout_seconds = os.environ.get("FUNCTION_TIMEOUT_SEC")
+if function_timeout_seconds is not None:
+    function_timeout_seconds = float(function_timeout_seconds)
+deadline_margin_seconds = float(os.environ.get("DEADLINE_MARGIN_SECONDS", "30"))
+
+# Checkpoints are only safe when lost spans are reported, which the OTel SDK's span
+# processor doesn't do
+checkpoint_interval = os.environ.get("CHECKPOINT_INTERVAL_SECONDS")
+if export_engine == "direct" or span_processor == "blocking":
+    checkpoint_interval = float(checkpoint_interval or "60")
+elif checkpoint_interval is not None:
+    raise ValueError(
+        "CHECKPOINT_INTERVAL_SECONDS needs EXPORT_ENGINE=direct or "
+        "SPAN_PROCESSOR=blocking"
+    )
+
+# "random" (default) samples each line on its own, "deterministic" keeps or drops
+# all spans of a trace together based on a hash of its root ray ID, "dynamic" sets
+# rates per key to meet a target number of events per second, "reservoir" sends at
+# most a fixed number of events per key and file and "trace" samples whole traces,
+# always keeping those with errors or slow requests
+sampler_name = os.environ.get("SAMPLER", "random")
+SAMPLERS = ("random", "deterministic", "dynamic", "reservoir", "trace")
+if sampler_name not in SAMPLERS:
+    raise ValueError("Unknown SAMPLER %r" % sampler_name)
+
+dynamic_sampler_key_fields = json.loads(
+    os.environ.get("DYNAMIC_SAMPLER_KEY_FIELDS", '["EdgeResponseStatusClass"]')
+)
+dynamic_sampler_events_per_second = float(
+    os.environ.get("DYNAMIC_SAMPLER_EVENTS_PER_SECOND", "10")
+)
+
+reservoir_sampler_key_fields = json.loads(
+    os.environ.get(
+        "RESERVOIR_SAMPLER_KEY_FIELDS", '["EdgeResponseStatus", "PathShape"]'
+    )
+)
+reservoir_sampler_events_per_key = int(
+    os.environ.get("RESERVOIR_SAMPLER_EVENTS_PER_KEY", "100")
+)
+reservoir_sampler_max_keys = int(os.environ.get("RESERVOIR_SAMPLER_MAX_KEYS", "1000"))
+
+trace_sampler_rate = int(os.environ.get("TRACE_SAMPLER_RATE", "10"))
+trace_sampler_window_seconds = float(
+    os.environ.get("TRACE_SAMPLER_WINDOW_SECONDS", "30")
+)
+trace_sampler_max_buffered_lines = int(
+    os.environ.get("TRACE_SAMPLER_MAX_BUFFERED_LINES", "20000")
+)
+
 # Convert string keys (the only kind permitted by json) to ints
 sampling_rate_by_status = {
     int(key): val
@@ -65,6 +222,13 @@ def main(event, context):
             instrument_invocation(meta_span, event, context)
 
             start_time = time.time()
+            deadline = None
+            if function_timeout_seconds is not None:
+                deadline = (
+                    time.monotonic()
+                    + function_timeout_seconds
+                    - deadline_margin_seconds
+                )
             try:
                 if event["name"].startswith("ownership-challenge"):
                     meta_span.set_attribute("success", True)
@@ -79,6 +243,27 @@ def main(event, context):
                     query_param_filter=query_param_filter,
                     lock_bucket=lock_bucket,
                     sampling_rate_by_status=sampling_rate_by_status,
+                    download_mode=download_mode,
+                    stream_chunk_size=stream_chunk_size,
+                    ranged_chunk_size=ranged_chunk_size,
+                    ranged_max_workers=ranged_max_workers,
+                    decompression_backend=decompression_backend,
+                    threaded_decompression=threaded_decompression,
+                    deadline=deadline,
+                    checkpoint_interval=checkpoint_interval,
+                    sampler=create_sampler(),
+                    max_inferred_shapes=max_inferred_shapes,
+                    client_ip_ranges=client_ip_ranges,
+                    field_allowlist=field_allowlist,
+                    field_denylist=field_denylist,
+                    raw_fields=raw_fields,
+                    export_engine=export_engine,
+                    span_processor=span_processor,
+                    span_queue_size=span_queue_size,
+                    span_batch_size=span_batch_size,
+                    export_workers=export_workers,
+                    compression=export_compression,
+                    compression_level=export_compression_level,
                 )
                 meta_span.set_attribute("events", events_handled)
                 meta_span.set_attribute("success", True)
@@ -105,6 +290,37 @@ def main(event, context):
         meta_provider.shutdown()
 
 
+def create_sampler():
+    if sampler_name == "random":
+        return Sampler()
+    if sampler_name == "deterministic":
+        return Sampler(deterministic=True)
+    if sampler_name == "dynamic":
+        return DynamicSampler(
+            dynamic_sampler_key_fields,
+            dynamic_sampler_events_per_second,
+            url_shaper=get_url_shaper(
+                patterns, query_param_filter, max_inferred_shapes
+            ),
+        )
+    if sampler_name == "reservoir":
+        return ReservoirSampler(
+            reservoir_sampler_key_fields,
+            reservoir_sampler_events_per_key,
+            max_keys=reservoir_sampler_max_keys,
+            url_shaper=get_url_shaper(
+                patterns, query_param_filter, max_inferred_shapes
+            ),
+        )
+    if sampler_name == "trace":
+        return TraceSampler(
+            trace_sampler_rate,
+            window_seconds=trace_sampler_window_seconds,
+            max_buffered_lines=trace_sampler_max_buffered_lines,
+        )
+    raise ValueError("Unknown sampler %r" % sampler_name)
+
+
 def instrument_invocation(span, event, context):
     for event_key in ("name", "bucket", "contentType", "timeCreated", "size"):
         span.set_attribute("event.%s" % event_key, event[event_key])
@@ -1,9 +1,12 @@
 import gzip
+import io
 import json
 import os
 import tempfile
+from datetime import datetime, timezone
 
 import pytest
+from google.api_core.exceptions import NotFound, PreconditionFailed
 from google.cloud import storage
 
 
@@ -48,3 +51,69 @@ def test_files():
         yield file_factory
     finally:
         file_factory.clean_up()
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.time_created = None
+
+    def exists(self):
+        return self.name in self.bucket.objects
+
+    def reload(self):
+        if not self.exists():
+            raise NotFound(self.name)
+        self.time_created = self.bucket.created[self.name]
+
+    @property
+    def size(self):
+        return len(self.bucket.objects[self.name])
+
+    def upload_from_string(self, data, if_generation_match=None, **kwargs):
+        if if_generation_match == 0 and self.exists():
+            raise PreconditionFailed(self.name)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.bucket.objects[self.name] = data
+        self.bucket.created[self.name] = datetime.now(timezone.utc)
+
+    def download_as_bytes(self, start=None, end=None, **kwargs):
+        if not self.exists():
+            raise NotFound(self.name)
+        data = self.bucket.objects[self.name]
+        if start is not None:
+            data = data[start : None if end is None else end + 1]
+        return data
+
+    def open(self, mode="rb", **kwargs):
+        return io.BytesIO(self.download_as_bytes())
+
+    def delete(self):
+        if not self.exists():
+            raise NotFound(self.name)
+        del self.bucket.objects[self.name]
+
+
+class FakeBucket:
+    """
+    An in-memory stand-in for `google.cloud.storage.bucket.Bucket`, covering what
+    honeyflare uses of it.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.created = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def add_log_file(self, name, path):
+        with open(path, "rb") as fh:
+            self.blob(name).upload_from_string(fh.read())
+
+
+@pytest.fixture
+def fake_bucket():
+    return FakeBucket()
@@ -14,7 +14,8 @@ from honeyflare.exceptions import RetriableError
 pytestmark = pytest.mark.integration
 
 
-def test_process_file(bucket, test_files, blob_name):
+@pytest.mark.parametrize("download_mode", ["stream", "file", "ranged"])
+def test_process_file(bucket, test_files, blob_name, download_mode):
     patterns = [
         "/authors/:id/*",
         "/books/:isbn",
@@ -53,6 +54,7 @@ def test_process_file(bucket, test_files, blob_name):
             blob_name,
             patterns=patterns,
             query_param_filter=set(),
+            download_mode=download_mode,
         )
 
     assert events_handled == 2
@@ -0,0 +1,169 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+import pytest
+from opentelemetry.sdk.trace.export import SpanExportResult
+
+from honeyflare import process_bucket_object
+from honeyflare.checkpoints import Checkpoint, read_checkpoint, write_checkpoint
+from honeyflare.exceptions import DeadlineReachedError
+from honeyflare.tracesampler import TraceSampler
+
+
+def _log_lines(count):
+    return [
+        {
+            "EdgeResponseStatus": 200,
+            "EdgeEndTimestamp": 1000000000 + i,
+            "EdgeStartTimestamp": 900000000,
+            "ClientRequestMethod": "GET",
+            "RayID": "%016x" % (i + 1),
+        }
+        for i in range(count)
+    ]
+
+
+def _exported_spans(mock_exporter):
+    spans = []
+    for call in mock_exporter.export.call_args_list:
+        spans.extend(call[0][0])
+    return spans
+
+
+def test_checkpoint_round_trip(fake_bucket):
+    assert read_checkpoint(fake_bucket, "logs/file.gz") is None
+
+    write_checkpoint(fake_bucket, "logs/file.gz", Checkpoint(1024, 512))
+
+    assert read_checkpoint(fake_bucket, "logs/file.gz") == Checkpoint(1024, 512)
+    assert "checkpoints/logs/file.gz" in fake_bucket.objects
+
+
+def test_deadline_checkpoints_and_retry_resumes(fake_bucket, test_files):
+    fake_bucket.add_log_file("logs/file.gz", test_files.create_file(*_log_lines(3000)))
+
+    with mock.patch("honeyflare.OTLPSpanExporter") as mock_exporter_cls:
+        mock_exporter = mock_exporter_cls.return_value
+        mock_exporter.export.return_value = SpanExportResult.SUCCESS
+
+        with pytest.raises(DeadlineReachedError):
+            process_bucket_object(
+                fake_bucket,
+                "logs/file.gz",
+                deadline=time.monotonic() - 1,
+                span_processor="blocking",
+            )
+
+        assert read_checkpoint(fake_bucket, "logs/file.gz") == Checkpoint(1024, 1024)
+        assert "locks/logs/file.gz" not in fake_bucket.objects
+        assert "completed/logs/file.gz" not in fake_bucket.objects
+
+        events_handled = process_bucket_object(
+            fake_bucket, "logs/file.gz", span_processor="blocking"
+        )
+
+    assert events_handled == 1976
+    span_ids = [span.context.span_id for span in _exported_spans(mock_exporter)]
+    assert sorted(span_ids) == list(range(1, 3001))
+    assert "completed/logs/file.gz" in fake_bucket.objects
+    assert "checkpoints/logs/file.gz" not in fake_bucket.objects
+
+
+def test_periodic_checkpoints(fake_bucket, test_files):
+    fake_bucket.add_log_file("logs/file.gz", test_files.create_file(*_log_lines(10)))
+
+    with mock.patch("honeyflare.OTLPSpanExporter") as mock_exporter_cls, mock.patch(
+        "honeyflare.write_checkpoint"
+    ) as write_checkpoint_mock:
+        mock_exporter_cls.return_value.export.return_value = SpanExportResult.SUCCESS
+        process_bucket_object(
+            fake_bucket,
+            "logs/file.gz",
+            checkpoint_interval=0,
+            span_processor="blocking",
+        )
+
+    checkpoints = [call[0][2] for call in write_checkpoint_mock.call_args_list]
+    assert checkpoints == [Checkpoint(i, i) for i in range(1, 11)]
+
+
+def test_checkpoints_dont_skip_buffered_traces(fake_bucket, test_files):
+    # A trace, then errors without a RayID which are sent while it's held back
+    log_lines = _log_lines(1)
+    for _ in range(2):
+        log_lines.append(
+            {
+                "EdgeResponseStatus": 500,
+                "EdgeEndTimestamp": 1000000000,
+                "ClientRequestMethod": "GET",
+            }
+        )
+    fake_bucket.add_log_file("logs/file.gz", test_files.create_file(*log_lines))
+
+    with mock.patch("honeyflare.OTLPSpanExporter") as mock_exporter_cls, mock.patch(
+        "honeyflare.write_checkpoint"
+    ) as write_checkpoint_mock:
+        mock_exporter_cls.return_value.export.return_value = SpanExportResult.SUCCESS
+        process_bucket_object(
+            fake_bucket,
+            "logs/file.gz",
+            sampler=TraceSampler(sampling_rate=1),
+            checkpoint_interval=0,
+            span_processor="blocking",
+        )
+
+    checkpoints = [call[0][2] for call in write_checkpoint_mock.call_args_list]
+    assert checkpoints == [Checkpoint(0, 1), Checkpoint(0, 2), Checkpoint(0, 3)]
+
+
+def test_no_checkpoints_after_lost_spans(fake_bucket, test_files):
+    fake_bucket.add_log_file("logs/file.gz", test_files.create_file(*_log_lines(10)))
+
+    with mock.patch("honeyflare.OTLPSpanExporter") as mock_exporter_cls, mock.patch(
+        "honeyflare.write_checkpoint"
+    ) as write_checkpoint_mock, mock.patch("honeyflare.spanprocessor.time.sleep"):
+        # The first batch is lost, the rest are exported
+        mock_exporter_cls.return_value.export.side_effect = [
+            SpanExportResult.FAILURE
+        ] * 4 + [SpanExportResult.SUCCESS] * 20
+        process_bucket_object(
+            fake_bucket,
+            "logs/file.gz",
+            checkpoint_interval=0,
+            span_processor="blocking",
+        )
+
+    assert write_checkpoint_mock.call_count == 0
+
+
+def test_checkpoints_need_an_export_that_reports_loss(fake_bucket, test_files):
+    fake_bucket.add_log_file("logs/file.gz", test_files.create_file(*_log_lines(10)))
+
+    with pytest.raises(ValueError):
+        process_bucket_object(fake_bucket, "logs/file.gz", checkpoint_interval=60)
+
+
+def test_deadline_without_checkpoints_removes_download(fake_bucket, test_files):
+    log_file = test_files.create_file(*_log_lines(2000))
+    local_path = os.path.join(tempfile.mkdtemp(), "file.gz")
+    shutil.copy(log_file, local_path)
+
+    with mock.patch("honeyflare.OTLPSpanExporter"), mock.patch(
+        "honeyflare.write_checkpoint"
+    ) as write_checkpoint_mock, mock.patch(
+        "honeyflare.download_file", return_value=local_path
+    ):
+        fake_bucket.add_log_file("logs/file.gz", log_file)
+        with pytest.raises(DeadlineReachedError):
+            process_bucket_object(
+                fake_bucket,
+                "logs/file.gz",
+                download_mode="file",
+                deadline=time.monotonic() - 1,
+            )
+
+    assert write_checkpoint_mock.call_count == 0
+    assert not os.path.exists(local_path)
@@ -1,4 +1,5 @@
 from honeyflare import _coerce_attribute_value
+from honeyflare.coercion import AttributeCoercer
 
 
 def test_primitives_pass_through():
@@ -44,3 +45,42 @@ def test_nested_structure_serializes_fully():
     result = _coerce_attribute_value({"outer": {"inner": [1, 2, 3]}})
     assert isinstance(result, str)
     assert "inner" in result
+
+
+def test_attribute_coercer_matches_generic_coercion():
+    coercer = AttributeCoercer()
+    entries = [
+        {
+            "EdgeResponseStatus": 200,
+            "RayID": "6f2de346beec9644",
+            "RequestHeaders": {"accept": "*/*"},
+            "FirewallMatchesActions": ["block", None],
+            "Unknown": [1, "a"],
+            "Mixed": [{"a": 1}],
+            "Empty": None,
+        },
+        {
+            "EdgeResponseStatus": "200",
+            "RayID": None,
+            "RequestHeaders": '{"accept": "*/*"}',
+            "FirewallMatchesActions": [],
+            "Unknown": {"a": 1},
+            "Mixed": "str",
+        },
+    ]
+
+    for entry in entries:
+        assert coercer.coerce(entry) == {
+            key: _coerce_attribute_value(value)
+            for key, value in entry.items()
+            if value is not None
+        }
+
+
+def test_attribute_coercer_declared_types():
+    coercer = AttributeCoercer({"Headers": dict, "Tags": list})
+
+    assert coercer.coerce({"Headers": {"a": "b"}, "Tags": ["a", "b"]}) == {
+        "Headers": '{"a":"b"}',
+        "Tags": ["a", "b"],
+    }
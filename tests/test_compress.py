@@ -0,0 +1,77 @@
+import gzip
+from collections import Counter
+from unittest import mock
+
+import pytest
+
+from honeyflare import compress
+
+
+@pytest.mark.parametrize("algorithm", sorted(compress.ALGORITHMS))
+def test_compressor_reuses_context(algorithm):
+    compressor = compress.Compressor(algorithm)
+    data = b'{"ClientRequestURI": "/users/1"}' * 100
+    first = compressor.compress(data)
+    assert len(first) < len(data)
+    # Compressing again with the same context gives a complete frame again
+    assert compressor.compress(data) == first
+    assert decompress(algorithm, first) == data
+
+
+def decompress(algorithm, data):
+    if algorithm == "gzip":
+        return gzip.decompress(data)
+    if compress.zstd is not None:
+        return compress.zstd.decompress(data)
+    return compress.zstandard.ZstdDecompressor().decompress(data)
+
+
+def test_compressor_levels():
+    assert compress.Compressor("gzip").level == 6
+    assert compress.Compressor("gzip", 1).level == 1
+    with pytest.raises(ValueError):
+        compress.Compressor("brotli")
+    with pytest.raises(ValueError):
+        compress.Compressor("gzip", 15)
+    with pytest.raises(ValueError):
+        compress.Compressor("gzip", -1)
+
+
+def test_compressing_session():
+    stats = Counter()
+    session = compress.CompressingSession(compress.Compressor("gzip"), stats)
+    data = b"span" * 1000
+    with mock.patch("requests.Session.request") as mock_request:
+        session.post("http://refinery.local/v1/traces", data=data, timeout=10)
+
+    (method, url), kwargs = mock_request.call_args
+    assert (method, url) == ("POST", "http://refinery.local/v1/traces")
+    assert gzip.decompress(kwargs["data"]) == data
+    assert kwargs["headers"] == {"Content-Encoding": "gzip"}
+    assert kwargs["timeout"] == 10
+    assert stats == {
+        "uncompressed_bytes": len(data),
+        "compressed_bytes": len(kwargs["data"]),
+    }
+
+
+def test_compressing_session_counts_retries_once():
+    stats = Counter()
+    compressor = compress.Compressor("gzip")
+    session = compress.CompressingSession(compressor, stats)
+    data = b"span" * 1000
+    with mock.patch("requests.Session.request") as mock_request:
+        with mock.patch.object(
+            compressor, "compress", wraps=compressor.compress
+        ) as mock_compress:
+            for _ in range(3):
+                session.post("http://refinery.local/v1/traces", data=bytes(data))
+            session.post("http://refinery.local/v1/traces", data=b"other" * 1000)
+
+    assert mock_compress.call_count == 2
+    sent = [call.kwargs["data"] for call in mock_request.call_args_list]
+    assert sent[0] == sent[1] == sent[2]
+    assert stats == {
+        "uncompressed_bytes": len(data) + 5000,
+        "compressed_bytes": len(sent[0]) + len(sent[3]),
+    }
@@ -1,12 +1,405 @@
+import base64
+import gzip
+import io
+import os
 from collections import defaultdict
+from unittest import mock
 
-from honeyflare import get_raw_file_entries, __version__
+import google_crc32c
+import pytest
+import requests
+from google.api_core.exceptions import (
+    InternalServerError,
+    PreconditionFailed,
+    ServiceUnavailable,
+    TooManyRequests,
+)
+from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import (
+    ExportTraceServiceRequest,
+)
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SpanExportResult
+from urllib3.exceptions import ProtocolError
+
+from honeyflare import (
+    download_file_ranged,
+    get_raw_file_entries,
+    process_bucket_object,
+    stream_file_entries,
+    __version__,
+)
+from honeyflare.exceptions import RetriableError
+from honeyflare.projection import ITEM_SIZE_ESTIMATE
 
 
 def test_get_raw_file_entries(test_files):
     file_path = test_files.create_file({"eventName": "value1"}, {"eventName": "value2"})
     entries = list(get_raw_file_entries(file_path))
     assert entries == [
-        '{"eventName": "value1"}\n',
-        '{"eventName": "value2"}\n',
+        b'{"eventName": "value1"}\n',
+        b'{"eventName": "value2"}\n',
+    ]
+
+
+def test_stream_file_entries(test_files):
+    file_path = test_files.create_file({"eventName": "value1"}, {"eventName": "value2"})
+    bucket = mock.Mock()
+    bucket.blob.return_value.open.side_effect = lambda *args, **kwargs: open(
+        file_path, "rb"
+    )
+
+    entries = list(stream_file_entries(bucket, "some/object.gz", chunk_size=1024))
+
+    assert entries == [
+        b'{"eventName": "value1"}\n',
+        b'{"eventName": "value2"}\n',
+    ]
+    bucket.blob.assert_called_once_with("some/object.gz")
+    bucket.blob.return_value.open.assert_called_once_with(
+        "rb", chunk_size=1024, raw_download=True
+    )
+
+
+def test_stream_file_entries_raises_retriable_exception():
+    bucket = mock.Mock()
+    bucket.blob.return_value.open.side_effect = ProtocolError()
+
+    with pytest.raises(RetriableError):
+        list(stream_file_entries(bucket, "some/object.gz"))
+
+
+class _FailingReader(io.RawIOBase):
+    """Reads the first `size` bytes of a file, then raises `error`."""
+
+    def __init__(self, path, size, error):
+        with open(path, "rb") as fh:
+            self._data = io.BytesIO(fh.read(size))
+        self._error = error
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        read = self._data.readinto(buffer)
+        if not read:
+            raise self._error
+        return read
+
+
+@pytest.mark.parametrize("threaded", [True, False])
+@pytest.mark.parametrize(
+    "error",
+    [
+        ServiceUnavailable("unavailable"),
+        TooManyRequests("slow down"),
+        InternalServerError("oops"),
+        requests.exceptions.ConnectionError(),
+    ],
+)
+def test_stream_file_entries_fails_partway_retriably(test_files, error, threaded):
+    file_path = test_files.create_file(
+        *[{"RayID": "%016x" % i, "ClientRequestURI": "/%d" % i} for i in range(20000)]
+    )
+    bucket = mock.Mock()
+    bucket.blob.return_value.open.side_effect = lambda *args, **kwargs: _FailingReader(
+        file_path, 32 * 1024, error
+    )
+
+    entries = []
+    with pytest.raises(RetriableError):
+        for entry in stream_file_entries(bucket, "some/object.gz", threaded=threaded):
+            entries.append(entry)
+
+    assert 0 < len(entries) < 20000
+
+
+def _ranged_bucket(data, crc32c=None):
+    bucket = mock.Mock()
+    blob = bucket.blob.return_value
+    blob.size = len(data)
+    blob.generation = 42
+    if crc32c is None:
+        crc32c = base64.b64encode(google_crc32c.value(data).to_bytes(4, "big"))
+        crc32c = crc32c.decode("utf-8")
+    blob.crc32c = crc32c
+    blob.download_as_bytes.side_effect = lambda start, end, **kwargs: data[
+        start : end + 1
     ]
+    return bucket
+
+
+def test_download_file_ranged(test_files):
+    file_path = test_files.create_file(
+        *[{"eventName": "value%d" % i} for i in range(100)]
+    )
+    with open(file_path, "rb") as fh:
+        data = fh.read()
+    bucket = _ranged_bucket(data)
+
+    local_path = download_file_ranged(
+        bucket, "some/ranged-object.gz", chunk_size=7, max_workers=3
+    )
+    try:
+        with open(local_path, "rb") as fh:
+            assert fh.read() == data
+        assert len(list(get_raw_file_entries(local_path))) == 100
+    finally:
+        os.remove(local_path)
+
+    for call in bucket.blob.return_value.download_as_bytes.call_args_list:
+        assert call.kwargs["if_generation_match"] == 42
+        assert call.kwargs["raw_download"] is True
+
+
+def test_download_file_ranged_checksum_mismatch():
+    bucket = _ranged_bucket(b"some bytes", crc32c="AAAAAA==")
+
+    with pytest.raises(RetriableError):
+        download_file_ranged(bucket, "some/mismatched-object.gz", chunk_size=3)
+
+    assert not os.path.exists("/tmp/mismatched-object.gz")
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        ServiceUnavailable("unavailable"),
+        PreconditionFailed("generation changed"),
+        requests.exceptions.ConnectionError(),
+    ],
+)
+def test_download_file_ranged_retriable_errors(error):
+    data = b"some bytes that are downloaded in ranges"
+    bucket = _ranged_bucket(data)
+    fetch = bucket.blob.return_value.download_as_bytes.side_effect
+
+    def fail_one_range(start, end, **kwargs):
+        if start == 9:
+            raise error
+        return fetch(start, end, **kwargs)
+
+    bucket.blob.return_value.download_as_bytes.side_effect = fail_one_range
+
+    with pytest.raises(RetriableError):
+        download_file_ranged(
+            bucket, "some/failed-object.gz", chunk_size=3, max_workers=2
+        )
+
+    assert not os.path.exists("/tmp/failed-object.gz")
+
+
+def test_process_bucket_object_reports_urlshape_cache(fake_bucket, test_files):
+    fake_bucket.add_log_file(
+        "logs/file.gz",
+        test_files.create_file(
+            *[
+                {
+                    "ClientRequestURI": "/users/%d" % (i % 3),
+                    "EdgeEndTimestamp": 1000000000,
+                    "RayID": "%016x" % (i + 1),
+                }
+                for i in range(10)
+            ]
+        ),
+    )
+
+    meta_tracer = TracerProvider().get_tracer("test")
+    with mock.patch("honeyflare.OTLPSpanExporter") as mock_exporter_cls:
+        mock_exporter_cls.return_value.export.return_value = 0
+        with meta_tracer.start_as_current_span("process-logfile") as meta_span:
+            events_handled = process_bucket_object(
+                fake_bucket, "logs/file.gz", patterns=["/users/:userId/cached"]
+            )
+
+    assert events_handled == 10
+    assert meta_span.attributes["urlshape_cache.misses"] == 3
+    assert meta_span.attributes["urlshape_cache.hits"] == 7
+
+
+def test_process_bucket_object_reports_inferred_shapes_per_file(
+    fake_bucket, test_files
+):
+    for name, paths in (("first", ["/a/1", "/b/2", "/a/3"]), ("second", ["/c/4"])):
+        fake_bucket.add_log_file(
+            "logs/%s.gz" % name,
+            test_files.create_file(
+                *[
+                    {
+                        "ClientRequestURI": path,
+                        "EdgeEndTimestamp": 1000000000,
+                        "RayID": "%016x" % (i + 1),
+                    }
+                    for i, path in enumerate(paths)
+                ]
+            ),
+        )
+
+    meta_tracer = TracerProvider().get_tracer("test")
+    meta_spans = []
+    with mock.patch("honeyflare.OTLPSpanExporter") as mock_exporter_cls:
+        mock_exporter_cls.return_value.export.return_value = 0
+        for name in ("first", "second"):
+            with meta_tracer.start_as_current_span("process-logfile") as meta_span:
+                process_bucket_object(
+                    fake_bucket,
+                    "logs/%s.gz" % name,
+                    patterns=["/inferred-shapes-test"],
+                    max_inferred_shapes=1,
+                )
+            meta_spans.append(meta_span)
+
+    assert meta_spans[0].attributes["urlshape_inferred.shapes"] == 1
+    assert meta_spans[0].attributes["urlshape_inferred.overflowed"] == 1
+    assert meta_spans[1].attributes["urlshape_inferred.shapes"] == 0
+    assert meta_spans[1].attributes["urlshape_inferred.overflowed"] == 1
+
+
+def test_process_bucket_object_projects_fields(fake_bucket, test_files):
+    fake_bucket.add_log_file(
+        "logs/projected.gz",
+        test_files.create_file(
+            {
+                "ClientRequestURI": "/users/1",
+                "EdgeEndTimestamp": 1000000000,
+                "RayID": "0000000000000001",
+                "RequestHeaders": {"accept": "*/*"},
+            }
+        ),
+    )
+
+    meta_tracer = TracerProvider().get_tracer("test")
+    with mock.patch("honeyflare.OTLPSpanExporter") as mock_exporter_cls:
+        mock_exporter_cls.return_value.export.return_value = 0
+        with meta_tracer.start_as_current_span("process-logfile") as meta_span:
+            process_bucket_object(
+                fake_bucket, "logs/projected.gz", field_denylist=["Request*"]
+            )
+
+    exported_spans = [
+        span
+        for call in mock_exporter_cls.return_value.export.call_args_list
+        for span in call.args[0]
+    ]
+    assert len(exported_spans) == 1
+    assert "RequestHeaders" not in exported_spans[0].attributes
+    assert exported_spans[0].attributes["PathShape"] == "/users/1"
+    assert meta_span.attributes["projection.bytes_dropped"] == (
+        len("RequestHeaders") + ITEM_SIZE_ESTIMATE
+    )
+
+
+def test_process_bucket_object_reports_export_stats(fake_bucket, test_files):
+    fake_bucket.add_log_file(
+        "logs/stats.gz",
+        test_files.create_file(
+            *[
+                {"EdgeEndTimestamp": 1000000000, "RayID": "%016x" % (i + 1)}
+                for i in range(5)
+            ]
+        ),
+    )
+
+    meta_tracer = TracerProvider().get_tracer("test")
+    with mock.patch("honeyflare.OTLPSpanExporter") as mock_exporter_cls:
+        mock_exporter_cls.return_value.export.return_value = SpanExportResult.SUCCESS
+        with meta_tracer.start_as_current_span("process-logfile") as meta_span:
+            process_bucket_object(
+                fake_bucket,
+                "logs/stats.gz",
+                span_processor="blocking",
+                span_queue_size=4,
+                span_batch_size=2,
+            )
+
+    batches = mock_exporter_cls.return_value.export.call_args_list
+    assert [len(call.args[0]) for call in batches] == [2, 2, 1]
+    assert meta_span.attributes["export.spans_exported"] == 5
+    assert meta_span.attributes["export.spans_retried"] == 0
+    assert meta_span.attributes["export.spans_dropped"] == 0
+    assert meta_span.attributes["export.worker_0.requests"] == 3
+
+
+def test_process_bucket_object_direct_export_matches_sdk(fake_bucket, test_files):
+    entries = (
+        {
+            "ClientRequestMethod": "GET",
+            "ClientRequestURI": "/users/1",
+            "EdgeEndTimestamp": 1000000000,
+            "EdgeResponseStatus": 200,
+            "RayID": "6f2de346beec9644",
+            "ParentRayID": "00",
+            "RequestHeaders": {"accept": "*/*"},
+            "FirewallMatchesActions": ["block"],
+        },
+        {
+            "ClientRequestMethod": "POST",
+            "EdgeEndTimestamp": 2000000000,
+            "RayID": "bbbbbbbbbbbbbbbb",
+            "ParentRayID": "aaaaaaaaaaaaaaaa",
+            "OriginResponseTime": 1.5,
+        },
+    )
+    fake_bucket.add_log_file("logs/sdk.gz", test_files.create_file(*entries))
+    fake_bucket.add_log_file("logs/direct.gz", test_files.create_file(*entries))
+
+    with mock.patch("honeyflare.OTLPSpanExporter") as mock_exporter_cls:
+        mock_exporter_cls.return_value.export.return_value = 0
+        process_bucket_object(fake_bucket, "logs/sdk.gz")
+    sdk_spans = encode_spans(
+        [
+            span
+            for call in mock_exporter_cls.return_value.export.call_args_list
+            for span in call.args[0]
+        ]
+    ).resource_spans[0]
+
+    with mock.patch("honeyflare.otlp.requests.Session") as mock_session_cls:
+        mock_session_cls.return_value.post.return_value.ok = True
+        process_bucket_object(
+            fake_bucket, "logs/direct.gz", export_engine="direct"
+        )
+    (call,) = mock_session_cls.return_value.post.call_args_list
+    assert call.args[0] == "https://api.honeycomb.io/v1/traces"
+    direct_spans = ExportTraceServiceRequest.FromString(
+        call.kwargs["data"]
+    ).resource_spans[0]
+
+    assert direct_spans.resource == sdk_spans.resource
+    assert direct_spans.scope_spans[0].scope.name == "honeyflare"
+    assert list(direct_spans.scope_spans[0].spans) == list(
+        sdk_spans.scope_spans[0].spans
+    )
+
+
+def test_process_bucket_object_compresses_direct_export(fake_bucket, test_files):
+    fake_bucket.add_log_file(
+        "logs/compressed.gz",
+        test_files.create_file(
+            *[
+                {"EdgeEndTimestamp": 1000000000, "RayID": "%016x" % (i + 1)}
+                for i in range(5)
+            ]
+        ),
+    )
+
+    meta_tracer = TracerProvider().get_tracer("test")
+    with mock.patch("requests.Session.request") as mock_request:
+        mock_request.return_value.ok = True
+        with meta_tracer.start_as_current_span("process-logfile") as meta_span:
+            process_bucket_object(
+                fake_bucket,
+                "logs/compressed.gz",
+                export_engine="direct",
+                compression="gzip",
+            )
+
+    (call,) = mock_request.call_args_list
+    assert call.kwargs["headers"] == {"Content-Encoding": "gzip"}
+    request = ExportTraceServiceRequest.FromString(
+        gzip.decompress(call.kwargs["data"])
+    )
+    assert len(request.resource_spans[0].scope_spans[0].spans) == 5
+    assert meta_span.attributes["export.spans_exported"] == 5
+    assert meta_span.attributes["export.compressed_bytes"] == len(call.kwargs["data"])
+    assert meta_span.attributes["export.uncompressed_bytes"] > len(call.kwargs["data"])
@@ -0,0 +1,56 @@
+import io
+import threading
+
+import pytest
+
+from honeyflare import decompress
+
+
+def test_threaded_and_unthreaded_lines_match(test_files):
+    file_path = test_files.create_file(
+        *[{"eventName": "value%d" % i} for i in range(5000)]
+    )
+
+    with decompress.open_gzip(file_path) as fh:
+        unthreaded = list(decompress.iter_lines(fh, threaded=False))
+    with decompress.open_gzip(file_path) as fh:
+        threaded = list(decompress.iter_lines(fh, block_size=64, max_blocks=2))
+
+    assert len(threaded) == 5000
+    assert threaded == unthreaded
+    assert threaded[0] == b'{"eventName": "value0"}\n'
+
+
+@pytest.mark.parametrize("backend", sorted(decompress.BACKENDS))
+def test_backends(test_files, backend):
+    file_path = test_files.create_file({"eventName": "value1"})
+
+    with decompress.open_gzip(file_path, backend) as fh:
+        assert list(decompress.iter_lines(fh)) == [b'{"eventName": "value1"}\n']
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        decompress.get_backend("snappy")
+
+
+def test_errors_are_raised_to_the_consumer():
+    fh = io.BytesIO(b"not gzip at all")
+
+    with pytest.raises(OSError):
+        list(decompress.iter_lines(decompress.open_gzip(fh)))
+
+
+def test_closing_early_stops_the_thread(test_files):
+    file_path = test_files.create_file(
+        *[{"eventName": "value%d" % i} for i in range(5000)]
+    )
+
+    with decompress.open_gzip(file_path) as fh:
+        lines = decompress.iter_lines(fh, block_size=64, max_blocks=1)
+        next(lines)
+        lines.close()
+
+    assert not [
+        t for t in threading.enumerate() if t.name == "honeyflare-decompress"
+    ]
@@ -0,0 +1,199 @@
+import json
+from collections import Counter, defaultdict
+from unittest import mock
+
+import orjson
+
+from honeyflare import compile_pattern
+from honeyflare.urlshape import UrlShaper
+from honeyflare.dynsampler import (
+    DynamicSampler,
+    Reservoir,
+    ReservoirSampler,
+    get_dynamic_rates,
+    get_key_scanner,
+    get_sample_key,
+    get_scanned_sample_key,
+)
+
+
+def test_dynamic_rates_meet_goal():
+    counts = Counter({"a": 10000, "b": 1000, "c": 50, "d": 2, "e": 1})
+
+    rates = get_dynamic_rates(counts, 500)
+
+    assert rates["e"] == rates["d"] == rates["c"] == 1
+    assert rates["a"] > rates["b"] > 1
+    expected_events = sum(count / rates[key] for key, count in counts.items())
+    assert 450 < expected_events < 550
+
+
+def test_dynamic_rates_under_goal_keep_everything():
+    assert get_dynamic_rates(Counter({"a": 10, "b": 5}), 100) == {"a": 1, "b": 1}
+
+
+def test_sample_key():
+    entry = {
+        "EdgeResponseStatus": 404,
+        "ClientRequestMethod": "GET",
+        "ClientRequestURI": "/users/1337?page=2",
+    }
+
+    key = get_sample_key(
+        entry,
+        ["EdgeResponseStatusClass", "ClientRequestMethod", "PathShape", "Missing"],
+        UrlShaper([compile_pattern("/users/:userId")]),
+    )
+
+    assert key == ("4xx", "GET", "/users/:userId", None)
+
+
+def test_scanned_sample_key_matches_parsed():
+    key_fields = [
+        "EdgeResponseStatusClass",
+        "ClientRequestMethod",
+        "PathShape",
+        "EdgeResponseStatus",
+        "ClientCountry",
+    ]
+    url_shaper = UrlShaper([compile_pattern("/users/:userId")])
+    scanner = get_key_scanner(key_fields)
+    entries = [
+        {
+            "ClientRequestHost": "example.com",
+            "ClientRequestMethod": "GET",
+            "ClientRequestURI": "/users/1,2?q=\"a\",b",
+            "EdgeResponseStatus": 404,
+        },
+        {"ClientRequestURI": "/caf\u00e9", "ClientCountry": None},
+        {"EdgeResponseStatus": 200, "ClientCountry": "se"},
+    ]
+
+    for entry in entries:
+        for line in (orjson.dumps(entry), json.dumps(entry).encode("utf-8")):
+            assert get_scanned_sample_key(
+                scanner.scan(line), key_fields, url_shaper
+            ) == get_sample_key(entry, key_fields, url_shaper)
+
+
+def test_key_scanner_needs_scannable_fields():
+    assert get_key_scanner(["PathShape"], "EdgeEndTimestamp").fields == (
+        "ClientRequestURI",
+        "ClientRequestHost",
+        "EdgeEndTimestamp",
+    )
+    assert get_key_scanner(["SomeField"]) is None
+
+
+def test_dynamic_sampler():
+    lines = []
+    for i in range(10000):
+        # 100 seconds of traffic, one 500 for every 99 200s
+        lines.append(
+            orjson.dumps(
+                {
+                    "EdgeResponseStatus": 500 if i % 100 == 0 else 200,
+                    "EdgeEndTimestamp": i * 10**7,
+                }
+            )
+        )
+
+    sampler = DynamicSampler(
+        ["EdgeResponseStatusClass"], target_events_per_second=4, window_size=5000
+    )
+    kept = list(sampler.sample_lines(lines, {}))
+
+    kept_by_status = defaultdict(list)
+    for sample_rate, entry in kept:
+        kept_by_status[entry["EdgeResponseStatus"]].append(sample_rate)
+
+    # Rare errors are all kept, the bulk of the goal of ~400 events goes to 200s
+    assert kept_by_status[500] == [1] * 100
+    assert 200 < len(kept_by_status[200]) < 400
+    # Weighted by SampleRate the kept events still add up to the traffic
+    assert 8000 < sum(kept_by_status[200]) < 12000
+    assert sampler.buffered_lines == 0
+
+
+def test_reservoir_sampler():
+    lines = [orjson.dumps({"EdgeResponseStatus": 200, "Index": i}) for i in range(1000)]
+    lines += [orjson.dumps({"EdgeResponseStatus": 404, "Index": i}) for i in range(30)]
+
+    sampler = ReservoirSampler(["EdgeResponseStatus"], events_per_key=50)
+    kept = list(sampler.sample_lines(lines, {}))
+
+    rates_by_status = defaultdict(list)
+    for sample_rate, entry in kept:
+        rates_by_status[entry["EdgeResponseStatus"]].append(sample_rate)
+
+    assert len(rates_by_status[200]) == 50
+    assert sum(rates_by_status[200]) == 1000
+    assert set(rates_by_status[200]) == {20}
+    assert rates_by_status[404] == [1] * 30
+    assert sampler.buffered_lines == 0
+
+
+def test_reservoir_sampler_spreads_rates():
+    lines = [orjson.dumps({"EdgeResponseStatus": 200}) for _ in range(1010)]
+
+    kept = list(ReservoirSampler(["EdgeResponseStatus"], 100).sample_lines(lines, {}))
+
+    assert sorted(rate for rate, _ in kept) == [10] * 90 + [11] * 10
+
+
+def test_reservoir_sampler_max_keys():
+    lines = [orjson.dumps({"ClientRequestHost": "host%d" % i}) for i in range(100)]
+
+    sampler = ReservoirSampler(["ClientRequestHost"], events_per_key=2, max_keys=10)
+    kept = list(sampler.sample_lines(lines, {}))
+
+    # 10 hosts with a reservoir of their own, the other 90 share one
+    assert len(kept) == 10 + 2
+    assert sum(rate for rate, _ in kept) == 100
+
+
+def test_reservoir_is_uniform():
+    reservoir = Reservoir(500)
+    for i in range(10000):
+        reservoir.add(i)
+
+    assert reservoir.seen == 10000
+    assert len(set(reservoir.items)) == 500
+    # Expected range computed with ./tools/expected-success.py 500 2
+    assert 205 < sum(1 for i in reservoir.items if i < 5000) < 295
+
+
+def test_dynamic_sampler_parses_kept_lines_once():
+    lines = [
+        orjson.dumps({"EdgeResponseStatus": 200, "EdgeEndTimestamp": i * 10**7})
+        for i in range(1000)
+    ]
+
+    for key_fields in (["EdgeResponseStatusClass"], ["SomeField"]):
+        sampler = DynamicSampler(key_fields, 1)
+        sampler.loads = mock.Mock(side_effect=orjson.loads)
+        kept = list(sampler.sample_lines(lines, {}))
+
+        assert 0 < len(kept) < len(lines)
+        if key_fields == ["SomeField"]:
+            # Can't be scanned for, so every line is parsed, once
+            assert sampler.loads.call_count == len(lines)
+        else:
+            assert sampler.loads.call_count == len(kept)
+
+
+def test_reservoir_sampler_parses_kept_lines_once():
+    lines = [orjson.dumps({"EdgeResponseStatus": 200 + i % 3}) for i in range(1000)]
+
+    for key_fields in (["EdgeResponseStatus"], ["SomeField"]):
+        sampler = ReservoirSampler(key_fields, 10)
+        sampler.loads = mock.Mock(side_effect=orjson.loads)
+        kept = list(sampler.sample_lines(lines, {}))
+
+        if key_fields == ["SomeField"]:
+            assert len(kept) == 10
+            assert sampler.loads.call_count == len(lines)
+        else:
+            assert len(kept) == 30
+            assert sampler.loads.call_count == len(kept)
+        assert sum(rate for rate, _ in kept) == len(lines)
@@ -2,6 +2,7 @@ import pytest
 
 from honeyflare import compile_pattern
 from honeyflare.enrichment import enrich_entry
+from honeyflare.urlshape import get_url_shaper
 
 
 def test_enrich_entry():
@@ -72,6 +73,21 @@ def test_enrich_path_shape_explicit_trailing_slash():
     assert entry["PathShape"] == "/users/id1337"
 
 
+def test_enrich_path_shape_by_host():
+    url_shaper = get_url_shaper(
+        {"example.com": ["/users/:userId"], "other.com": ["/posts/:postId"]}
+    )
+    entry = {"ClientRequestURI": "/users/id1337", "ClientRequestHost": "example.com"}
+
+    enrich_entry(entry, url_shaper.patterns, None, url_shaper=url_shaper)
+    assert entry["PathShape"] == "/users/:userId"
+    assert entry["Path_userId"] == "id1337"
+
+    entry = {"ClientRequestURI": "/users/id1337", "ClientRequestHost": "other.com"}
+    enrich_entry(entry, url_shaper.patterns, None, url_shaper=url_shaper)
+    assert entry["PathShape"] == "/users/id1337"
+
+
 def test_enrich_path_shape_implicit_trailing_slash():
     entry = {
         "ClientRequestURI": "/users/id1337/",
@@ -0,0 +1,61 @@
+import pytest
+
+from honeyflare.enrichment import enrich_entry
+from honeyflare.ipranges import IPRanges, get_ip_ranges
+
+
+RANGES = {
+    "10.0.0.0/8": "internal",
+    "10.1.0.0/16": "office",
+    "10.1.2.3/32": "printer",
+    "2001:db8::/32": "monitoring",
+    "2001:db8:1::/48": "partner",
+}
+
+
+@pytest.mark.parametrize(
+    "ip, expected",
+    [
+        ("10.2.3.4", "internal"),
+        ("10.1.3.4", "office"),
+        ("10.1.2.3", "printer"),
+        ("11.0.0.1", None),
+        ("2001:db8::1", "monitoring"),
+        ("2001:db8:1:2::1", "partner"),
+        ("2001:db9::1", None),
+        ("::ffff:10.1.2.3", None),
+        ("not an ip", None),
+        ("10.1", None),
+    ],
+)
+def test_ip_ranges_lookup(ip, expected):
+    assert IPRanges(RANGES).lookup(ip) == expected
+
+
+def test_ip_ranges_catch_all():
+    ip_ranges = IPRanges({"0.0.0.0/0": "anywhere", "192.0.2.0/24": "test"})
+
+    assert ip_ranges.lookup("8.8.8.8") == "anywhere"
+    assert ip_ranges.lookup("192.0.2.1") == "test"
+    assert ip_ranges.lookup("::1") is None
+
+
+def test_get_ip_ranges_is_shared():
+    ip_ranges = get_ip_ranges(RANGES)
+
+    assert get_ip_ranges(dict(RANGES)) is ip_ranges
+    assert get_ip_ranges({}) is None
+    assert get_ip_ranges(None) is None
+
+
+def test_enrich_client_ip_range():
+    entry = {"ClientIP": "10.1.3.4"}
+
+    enrich_entry(entry, [], None, ip_ranges=get_ip_ranges(RANGES))
+
+    assert entry["ClientIPVersion"] == 4
+    assert entry["ClientIPRange"] == "office"
+
+    entry = {"ClientIP": "11.0.0.1"}
+    enrich_entry(entry, [], None, ip_ranges=get_ip_ranges(RANGES))
+    assert "ClientIPRange" not in entry
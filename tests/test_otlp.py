@@ -0,0 +1,108 @@
+import threading
+from unittest import mock
+
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import (
+    ExportTraceServiceRequest,
+)
+from opentelemetry.sdk.resources import Resource
+
+from honeyflare import otlp
+
+
+def create_exporter(*status_codes, **kwargs):
+    session = mock.Mock(headers={})
+    session.post.side_effect = [
+        mock.Mock(ok=status_code < 300, status_code=status_code)
+        for status_code in status_codes
+    ]
+    exporter = otlp.DirectSpanExporter(
+        "https://example.com/v1/traces",
+        Resource.create({"service.name": "test"}),
+        session=session,
+        **kwargs
+    )
+    return exporter, session
+
+
+def sent_requests(session):
+    return [
+        ExportTraceServiceRequest.FromString(call.kwargs["data"])
+        for call in session.post.call_args_list
+    ]
+
+
+def test_direct_span_exporter_batches():
+    exporter, session = create_exporter(200, 200, batch_size=2)
+    exporter.add_span("HTTP GET", 1000, 1, 2, None, {"a": 1})
+    exporter.add_span("HTTP GET", 2000, 1, 3, 2, {"a": 2})
+    exporter.add_span("HTTP GET", 3000, None, None, None, {})
+
+    assert exporter.force_flush()
+    requests = sent_requests(session)
+    assert [len(r.resource_spans[0].scope_spans[0].spans) for r in requests] == [2, 1]
+    assert session.headers["Content-Type"] == "application/x-protobuf"
+
+    first, second = requests[0].resource_spans[0].scope_spans[0].spans
+    assert first.trace_id == (1).to_bytes(16, "big")
+    assert first.parent_span_id == b""
+    assert first.flags == otlp.ROOT_SPAN_FLAGS
+    assert second.parent_span_id == (2).to_bytes(8, "big")
+    assert second.flags == otlp.CHILD_SPAN_FLAGS
+    assert second.end_time_unix_nano == 2000
+
+    resource = requests[0].resource_spans[0].resource
+    assert resource == requests[1].resource_spans[0].resource
+    attributes = {kv.key: kv.value.string_value for kv in resource.attributes}
+    assert attributes["service.name"] == "test"
+
+
+def test_direct_span_exporter_retries():
+    exporter, session = create_exporter(503, 200)
+    exporter.add_span("HTTP GET", 1000, 1, 2, None, {})
+    with mock.patch.object(exporter._shutdown, "wait", return_value=False):
+        assert exporter.force_flush()
+    assert session.post.call_count == 2
+    assert exporter.stats == {"exported": 1, "retried": 1}
+
+
+def test_direct_span_exporter_failure():
+    exporter, session = create_exporter(400, 200)
+    exporter.add_span("HTTP GET", 1000, 1, 2, None, {})
+    assert not exporter.force_flush()
+    assert session.post.call_count == 1
+    assert exporter.stats == {"dropped": 1}
+
+    # Failures are reported once
+    exporter.add_span("HTTP GET", 1000, 1, 2, None, {})
+    assert exporter.force_flush()
+
+
+def test_direct_span_exporter_workers():
+    exporter, session = create_exporter(batch_size=1, export_workers=2)
+    # Each request waits for the other, which only works when they're sent at once
+    barrier = threading.Barrier(2, timeout=5)
+
+    def post(*args, **kwargs):
+        barrier.wait()
+        return mock.Mock(ok=True, status_code=200)
+
+    session.post.side_effect = post
+    exporter.add_span("HTTP GET", 1000, 1, 2, None, {})
+    exporter.add_span("HTTP GET", 1000, 1, 3, None, {})
+
+    assert exporter.force_flush()
+    assert session.post.call_count == 2
+    assert exporter.stats == {"exported": 2}
+
+
+def test_encode_value():
+    assert otlp.encode_value("a").string_value == "a"
+    assert otlp.encode_value(True).bool_value is True
+    assert otlp.encode_value(3).int_value == 3
+    assert otlp.encode_value(1.5).double_value == 1.5
+    assert [
+        value.string_value
+        for value in otlp.encode_value(["a", None, "b"]).array_value.values
+    ] == ["a", "b"]
+    assert otlp.encode_value(2**70).string_value == str(2**70)
+    assert otlp.encode_attributes({"a": None, "b": 1})[0].key == "b"
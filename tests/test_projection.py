@@ -0,0 +1,79 @@
+from unittest import mock
+
+from honeyflare.projection import (
+    ITEM_SIZE_ESTIMATE,
+    FieldProjection,
+    get_field_projection,
+)
+
+
+def _entry():
+    return {
+        "EdgeEndTimestamp": 1582850070117000000,
+        "EdgeResponseStatus": 200,
+        "RayID": "6f2de346beec9644",
+        "ClientRequestURI": "/users/1",
+        "RequestHeaders": {"accept": "*/*"},
+        "Cookies": {"session": "abc"},
+    }
+
+
+def test_field_projection_allowlist():
+    entry = _entry()
+
+    dropped_bytes = FieldProjection(allowlist=["Edge*"]).project(entry)
+
+    assert entry == {
+        "EdgeEndTimestamp": 1582850070117000000,
+        "EdgeResponseStatus": 200,
+        "RayID": "6f2de346beec9644",
+    }
+    assert dropped_bytes == (
+        len("ClientRequestURI/users/1")
+        + len("RequestHeaders")
+        + ITEM_SIZE_ESTIMATE
+        + len("Cookies")
+        + ITEM_SIZE_ESTIMATE
+    )
+
+
+def test_field_projection_denylist():
+    entry = _entry()
+
+    FieldProjection(
+        allowlist=["Edge*", "Client*", "*Headers"],
+        denylist=["*Headers", "EdgeEndTimestamp"],
+    ).project(entry)
+
+    assert entry == {
+        "EdgeEndTimestamp": 1582850070117000000,
+        "EdgeResponseStatus": 200,
+        "RayID": "6f2de346beec9644",
+        "ClientRequestURI": "/users/1",
+    }
+
+
+def test_field_projection_doesnt_serialize_dropped_fields():
+    entry = _entry()
+
+    with mock.patch("orjson.dumps") as mock_dumps:
+        FieldProjection(denylist=["RequestHeaders"]).project(entry)
+
+    assert "RequestHeaders" not in entry
+    mock_dumps.assert_not_called()
+
+
+def test_field_projection_measures_raw_fields():
+    entry = _entry()
+    entry["RequestHeaders"] = '{"accept":"*/*"}'
+
+    dropped_bytes = FieldProjection(denylist=["RequestHeaders"]).project(entry)
+
+    assert dropped_bytes == len('RequestHeaders{"accept":"*/*"}')
+
+
+def test_get_field_projection_is_shared():
+    projection = get_field_projection(denylist=["Cookies"])
+
+    assert get_field_projection(denylist=("Cookies",)) is projection
+    assert get_field_projection() is None
@@ -0,0 +1,57 @@
+import orjson
+import pytest
+
+from honeyflare import _coerce_attribute_value
+from honeyflare.rawfields import RawFieldDecoder, get_raw_field_decoder
+from honeyflare.sampler import Sampler
+
+
+FIELDS = ["RequestHeaders", "Cookies", "JA4Signals"]
+
+
+@pytest.mark.parametrize(
+    "entry",
+    [
+        {"RayID": "1", "RequestHeaders": {"accept": "*/*", "x-brace": "{[\"}"}},
+        {"RequestHeaders": {}, "Cookies": {"a": "b"}, "EdgeResponseStatus": 200},
+        {"Cookies": {"a": "b"}, "RequestHeaders": {"accept": "text/html"}},
+        {"JA4Signals": {"h2h3_ratio_1h": 0.9, "uas_rank_1h": 1}},
+        {"RequestHeaders": None},
+        {"RequestHeaders": {"nested": {"a": 1}}},
+        {"RequestHeaders": {"list": [1, 2]}},
+        {"RayID": "1"},
+        {"RequestHeaders": {"x-quote": "\"}\"", "x-brace": "}"}},
+        {"Cookies": {"a": "{"}, "RequestHeaders": {"b": "["}},
+    ],
+)
+def test_raw_field_decoder(entry):
+    line = orjson.dumps(entry) + b"\n"
+
+    decoded = RawFieldDecoder(FIELDS).loads(line)
+
+    assert decoded.keys() == entry.keys()
+    for field, value in entry.items():
+        if value is None:
+            assert decoded[field] is None
+        else:
+            assert _coerce_attribute_value(decoded[field]) == (
+                _coerce_attribute_value(value)
+            )
+
+
+def test_raw_field_decoder_keeps_json_text():
+    line = b'{"RequestHeaders": {"accept": "text/html", "x-tag": "\\u003cb\\u003e"}}'
+
+    assert RawFieldDecoder(FIELDS).loads(line) == {
+        "RequestHeaders": '{"accept": "text/html", "x-tag": "\\u003cb\\u003e"}'
+    }
+
+
+def test_sampler_uses_raw_field_decoder():
+    sampler = Sampler()
+    sampler.loads = get_raw_field_decoder(FIELDS).loads
+
+    assert list(sampler.sample_lines([b'{"Cookies":{"a":"b"}}'], {})) == [
+        (1, {"Cookies": '{"a":"b"}'})
+    ]
+    assert get_raw_field_decoder([]) is None
@@ -1,19 +1,28 @@
 from collections import defaultdict
+from unittest import mock
 
-from honeyflare.sampler import Sampler
+import pytest
+
+from honeyflare import sampler as sampler_module
+from honeyflare.sampler import (
+    RandomDraws,
+    Sampler,
+    get_field_scanner,
+    keep_trace,
+)
 
 
 def test_get_sampled_lines():
     lines = []
     for _ in range(200):
-        lines.append('{"EdgeResponseStatus": 200}')
-        lines.append('{"EdgeResponseStatus": 201}')
-        lines.append('{"EdgeResponseStatus": 204}')
-        lines.append('{"EdgeResponseStatus": 301}')
-        lines.append('{"EdgeResponseStatus": 403}')
-        lines.append('{"EdgeResponseStatus": 404}')
-        lines.append('{"EdgeResponseStatus": 502}')
-        lines.append('{"EdgeResponseStatus": 503}')
+        lines.append(b'{"EdgeResponseStatus": 200}')
+        lines.append(b'{"EdgeResponseStatus": 201}')
+        lines.append(b'{"EdgeResponseStatus": 204}')
+        lines.append(b'{"EdgeResponseStatus": 301}')
+        lines.append(b'{"EdgeResponseStatus": 403}')
+        lines.append(b'{"EdgeResponseStatus": 404}')
+        lines.append(b'{"EdgeResponseStatus": 502}')
+        lines.append(b'{"EdgeResponseStatus": 503}')
 
     sampler = Sampler()
     entries = list(
@@ -50,8 +59,8 @@ def test_get_sampled_lines():
 def test_get_sample_default():
     lines = []
     for _ in range(10):
-        lines.append('{"EdgeResponseStatus": 200}')
-        lines.append('{"EdgeResponseStatus": 300}')
+        lines.append(b'{"EdgeResponseStatus": 200}')
+        lines.append(b'{"EdgeResponseStatus": 300}')
 
     sampler = Sampler()
     entries = list(
@@ -76,7 +85,7 @@ def test_slow_request_sampling():
     lines = []
     for _ in range(50):
         lines.append(
-            '{"EdgeResponseStatus": 200, "OriginResponseTime": %d}' % (1500 * 1e6)
+            b'{"EdgeResponseStatus": 200, "OriginResponseTime": %d}' % (1500 * 10**6)
         )
 
     sampler = Sampler()
@@ -96,9 +105,117 @@ def test_slow_request_sampling():
 def test_noop_head_sampling():
     lines = []
     for _ in range(50):
-        lines.append('{"EdgeResponseStatus": 200}')
+        lines.append(b'{"EdgeResponseStatus": 200}')
 
     sampler = Sampler()
     entries = list(sampler.sample_lines(lines, {}))
 
     assert len(entries) == 50
+
+
+def test_line_without_status_is_dropped(capsys):
+    lines = [b'{"EdgeResponseStatus": 200}', b'{"ClientRequestHost": "example.com"}']
+
+    sampler = Sampler()
+    entries = list(sampler.sample_lines(lines, {200: 1}))
+
+    assert entries == [(1, {"EdgeResponseStatus": 200})]
+    assert "example.com" in capsys.readouterr().err
+    assert sampler.missing_status_lines == 1
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_random_draws(use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+        draws = RandomDraws(block_size=1000)
+    else:
+        with mock.patch.object(sampler_module, "numpy", None):
+            draws = RandomDraws(block_size=1000)
+
+    kept = sum(draws.keep(4) for _ in range(20000))
+
+    # Expected range computed with ./tools/expected-success.py 20000 4
+    assert 4761 < kept < 5239
+    assert all(draws.keep(1) for _ in range(2000))
+
+
+def test_deterministic_sampling_keeps_traces_together():
+    lines = []
+    for i in range(2000):
+        ray_id = "%016x" % (i * 7919 + 1)
+        lines.append(
+            b'{"EdgeResponseStatus": 200, "RayID": "%s", "ParentRayID": "00"}'
+            % ray_id.encode()
+        )
+        for j in range(3):
+            lines.append(
+                b'{"EdgeResponseStatus": 200, "RayID": "%016x", "ParentRayID": "%s"}'
+                % (10**9 + i * 3 + j, ray_id.encode())
+            )
+
+    kept_by_trace = defaultdict(int)
+    for _, entry in Sampler(deterministic=True).sample_lines(lines, {200: 10}):
+        trace_root = entry["ParentRayID"]
+        if trace_root == "00":
+            trace_root = entry["RayID"]
+        kept_by_trace[trace_root] += 1
+
+    # Expected range computed with ./tools/expected-success.py 2000 10
+    assert 146 < len(kept_by_trace) < 254
+    assert set(kept_by_trace.values()) == {4}
+
+    # The same decisions are made on every run
+    kept_again = {
+        entry["RayID"]
+        for _, entry in Sampler(deterministic=True).sample_lines(lines, {200: 10})
+        if entry["ParentRayID"] == "00"
+    }
+    assert kept_again == set(kept_by_trace)
+
+
+def test_deterministic_sampling_is_nested_across_rates():
+    for i in range(1000):
+        trace_root = b"%016x" % i
+        if keep_trace(trace_root, 20):
+            assert keep_trace(trace_root, 10)
+            assert keep_trace(trace_root, 2)
+        assert keep_trace(trace_root, 1)
+
+
+def test_field_scanner():
+    scanner = get_field_scanner(
+        ("EdgeResponseStatus", "OriginResponseTime", "ParentRayID", "RayID")
+    )
+    line = (
+        b'{"RayID": "6f2de346beec9644", "EdgeResponseStatus": 404, '
+        b'"RequestHeaders": {"x": "\\"EdgeResponseStatus\\": 200"}, '
+        b'"OriginResponseTime": 1500000000, "EdgeResponseStatus": 500, '
+        b'"ParentRayID": null}'
+    )
+
+    fields = scanner.scan(line)
+
+    assert fields.get("EdgeResponseStatus") == b"404"
+    assert fields.get("RayID") == b"6f2de346beec9644"
+    assert fields.get("OriginResponseTime") == b"1500000000"
+    assert fields.get("ParentRayID") is None
+    assert get_field_scanner(("EdgeResponseStatus",)) is get_field_scanner(
+        ("EdgeResponseStatus",)
+    )
+    assert get_field_scanner(()) is None
+
+
+def test_sampling_fields_follow_rules():
+    assert Sampler().get_sampling_fields({}) == ()
+    assert Sampler().get_sampling_fields({200: 1, 500: 0}) == ("EdgeResponseStatus",)
+    assert Sampler().get_sampling_fields({200: 10}) == (
+        "EdgeResponseStatus",
+        "OriginResponseTime",
+    )
+    assert Sampler(deterministic=True).get_sampling_fields({200: 10}) == (
+        "EdgeResponseStatus",
+        "OriginResponseTime",
+        "ParentRayID",
+        "RayID",
+    )
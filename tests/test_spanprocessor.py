@@ -0,0 +1,141 @@
+import threading
+from collections import Counter
+from unittest import mock
+
+import pytest
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SpanExportResult
+
+from honeyflare.spanprocessor import (
+    BlockingBatchSpanProcessor,
+    export_worker_attributes,
+)
+
+
+class SlowExporter:
+    def __init__(self, *results):
+        self.results = list(results)
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def export(self, spans):
+        self.release.wait()
+        self.batches.append([span.name for span in spans])
+        if self.results:
+            return self.results.pop(0)
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+def span_counts(stats):
+    return {key: stats[key] for key in ("exported", "retried", "dropped") if stats[key]}
+
+
+def create_tracer(exporter, **kwargs):
+    stats = Counter()
+    processor = BlockingBatchSpanProcessor(exporter, stats=stats, **kwargs)
+    provider = TracerProvider()
+    provider.add_span_processor(processor)
+    return provider.get_tracer("test"), provider, stats
+
+
+def test_blocking_processor_never_drops():
+    exporter = SlowExporter()
+    exporter.release.clear()
+    tracer, provider, stats = create_tracer(
+        exporter, max_queue_size=4, max_export_batch_size=2
+    )
+
+    def end_spans():
+        for i in range(20):
+            tracer.start_span(str(i)).end()
+
+    producer = threading.Thread(target=end_spans)
+    producer.start()
+    producer.join(0.1)
+    # Blocked on the full queue while the exporter is stuck
+    assert producer.is_alive()
+
+    exporter.release.set()
+    producer.join()
+    assert provider.force_flush()
+    provider.shutdown()
+
+    names = [name for batch in exporter.batches for name in batch]
+    assert names == [str(i) for i in range(20)]
+    assert max(len(batch) for batch in exporter.batches) == 2
+    assert span_counts(stats) == {"exported": 20}
+
+
+def test_blocking_processor_retries():
+    exporter = SlowExporter(SpanExportResult.FAILURE)
+    tracer, provider, stats = create_tracer(exporter)
+    tracer.start_span("a").end()
+    with mock.patch("honeyflare.spanprocessor.time.sleep"):
+        assert provider.force_flush()
+    provider.shutdown()
+
+    assert exporter.batches == [["a"], ["a"]]
+    assert span_counts(stats) == {"exported": 1, "retried": 1}
+
+
+def test_blocking_processor_drops_after_retries():
+    exporter = SlowExporter(*[SpanExportResult.FAILURE] * 3)
+    tracer, provider, stats = create_tracer(exporter, max_retries=2)
+    tracer.start_span("a").end()
+    with mock.patch("honeyflare.spanprocessor.time.sleep"):
+        assert not provider.force_flush()
+    # Failures are reported once
+    assert provider.force_flush()
+    provider.shutdown()
+
+    tracer.start_span("b").end()
+    assert span_counts(stats) == {"retried": 2, "dropped": 2}
+
+
+def test_blocking_processor_exports_on_shutdown():
+    exporter = SlowExporter()
+    tracer, provider, stats = create_tracer(exporter)
+    tracer.start_span("a").end()
+    provider.shutdown()
+
+    assert exporter.batches == [["a"]]
+    assert span_counts(stats) == {"exported": 1}
+
+
+def test_blocking_processor_batch_size():
+    with pytest.raises(ValueError):
+        BlockingBatchSpanProcessor(
+            SlowExporter(), max_queue_size=2, max_export_batch_size=4
+        )
+
+
+def test_blocking_processor_export_workers():
+    # Each export waits for the other, which only returns if both are in flight
+    barrier = threading.Barrier(2, timeout=5)
+
+    class ConcurrentExporter(SlowExporter):
+        def export(self, spans):
+            barrier.wait()
+            return super().export(spans)
+
+    exporter = ConcurrentExporter()
+    tracer, provider, stats = create_tracer(
+        exporter, max_export_batch_size=1, export_workers=2
+    )
+    for name in "ab":
+        tracer.start_span(name).end()
+    assert provider.force_flush()
+    provider.shutdown()
+
+    assert sorted(exporter.batches) == [["a"], ["b"]]
+    assert span_counts(stats) == {"exported": 2}
+
+    attributes = export_worker_attributes(stats)
+    assert attributes["export.worker_0.requests"] == 1
+    assert attributes["export.worker_1.requests"] == 1
+    assert attributes["export.worker_0.latency_ms"] > 0
+    assert attributes["export.worker_1.spans_per_second"] > 0
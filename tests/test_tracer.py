@@ -1,6 +1,13 @@
+from collections import Counter
 from unittest import mock
 
+import pytest
+
+from opentelemetry.exporter.otlp.proto.http import Compression
+
 from honeyflare import create_otel_tracer
+from honeyflare.compress import CompressingSession
+from honeyflare.spanprocessor import BlockingBatchSpanProcessor
 
 
 def test_exporter_points_at_otlp_traces_endpoint():
@@ -30,3 +37,74 @@ def test_endpoint_trailing_slash_is_stripped():
     mock_exporter.assert_called_once_with(
         endpoint="http://refinery.local/v1/traces",
     )
+
+
+def test_blocking_span_processor():
+    stats = Counter()
+    with mock.patch("honeyflare.OTLPSpanExporter"), mock.patch(
+        "honeyflare.TracerProvider.add_span_processor"
+    ) as mock_add_span_processor:
+        create_otel_tracer(
+            service_name="cloudflare",
+            honeycomb_api="http://refinery.local",
+            span_processor="blocking",
+            max_export_batch_size=16,
+            stats=stats,
+        )
+
+    (processor,), _ = mock_add_span_processor.call_args
+    assert isinstance(processor, BlockingBatchSpanProcessor)
+    assert processor.max_export_batch_size == 16
+    assert processor.stats is stats
+    processor.shutdown()
+
+
+def test_unknown_span_processor():
+    with pytest.raises(ValueError):
+        create_otel_tracer(
+            service_name="cloudflare",
+            honeycomb_api="http://refinery.local",
+            span_processor="lossy",
+        )
+
+
+def test_export_workers_share_a_session():
+    with mock.patch("honeyflare.OTLPSpanExporter") as mock_exporter:
+        _, provider = create_otel_tracer(
+            service_name="cloudflare",
+            honeycomb_api="http://refinery.local",
+            span_processor="blocking",
+            export_workers=4,
+        )
+        provider.shutdown()
+
+    session = mock_exporter.call_args.kwargs["session"]
+    assert session.get_adapter("http://refinery.local")._pool_maxsize == 4
+
+    with pytest.raises(ValueError):
+        create_otel_tracer(
+            service_name="cloudflare",
+            honeycomb_api="http://refinery.local",
+            export_workers=4,
+        )
+
+
+def test_compression():
+    stats = Counter()
+    with mock.patch("honeyflare.OTLPSpanExporter") as mock_exporter:
+        _, provider = create_otel_tracer(
+            service_name="cloudflare",
+            honeycomb_api="http://refinery.local",
+            compression="gzip",
+            compression_level=1,
+            stats=stats,
+        )
+        provider.shutdown()
+
+    kwargs = mock_exporter.call_args.kwargs
+    # The exporter mustn't compress again
+    assert kwargs["compression"] == Compression.NoCompression
+    session = kwargs["session"]
+    assert isinstance(session, CompressingSession)
+    assert session.compressor.level == 1
+    assert session.stats is stats
@@ -0,0 +1,98 @@
+from collections import defaultdict
+
+import orjson
+
+from honeyflare.tracesampler import TraceSampler
+
+
+def _line(ray_id, parent_ray_id="00", status=200, timestamp=0, **fields):
+    return orjson.dumps(
+        {
+            "EdgeEndTimestamp": timestamp,
+            "EdgeResponseStatus": status,
+            "ParentRayID": parent_ray_id,
+            "RayID": ray_id,
+            **fields,
+        }
+    )
+
+
+def _trace_root(entry):
+    if entry["ParentRayID"] != "00":
+        return entry["ParentRayID"]
+    return entry["RayID"]
+
+
+def test_traces_are_kept_whole():
+    lines = []
+    for i in range(1000):
+        root = "%016x" % (i + 1)
+        lines.append(_line(root))
+        for j in range(3):
+            status = 502 if i % 100 == 0 and j == 2 else 200
+            lines.append(_line("%016x" % (10**6 + i * 3 + j), root, status))
+
+    kept = list(TraceSampler(sampling_rate=10).sample_lines(lines, {}))
+
+    spans_by_trace = defaultdict(list)
+    for sample_rate, entry in kept:
+        spans_by_trace[_trace_root(entry)].append(sample_rate)
+
+    assert set(len(spans) for spans in spans_by_trace.values()) == {4}
+    # Every trace with an error is kept in full, at a rate of 1
+    for i in range(0, 1000, 100):
+        assert spans_by_trace["%016x" % (i + 1)] == [1, 1, 1, 1]
+    # The rest are sampled at 1 in 10
+    sampled = [spans for spans in spans_by_trace.values() if spans[0] == 10]
+    assert 50 < len(sampled) < 150
+
+
+def test_slow_trace_is_kept():
+    lines = [
+        _line("aaaaaaaaaaaaaaaa"),
+        _line("bbbbbbbbbbbbbbbb", "aaaaaaaaaaaaaaaa", OriginResponseTime=2 * 10**9),
+    ]
+
+    kept = list(TraceSampler(sampling_rate=10**9).sample_lines(lines, {}))
+
+    assert [rate for rate, _ in kept] == [1, 1]
+
+
+def test_traces_are_decided_after_window():
+    lines = [
+        _line("aaaaaaaaaaaaaaaa", status=500, timestamp=0),
+        _line("bbbbbbbbbbbbbbbb", status=500, timestamp=5 * 10**9),
+        _line("cccccccccccccccc", status=500, timestamp=20 * 10**9),
+    ]
+    sampler = TraceSampler(sampling_rate=1, window_seconds=10)
+
+    kept = sampler.sample_lines(iter(lines), {})
+
+    # The first trace is sent once the third line shows its window has passed
+    assert next(kept)[1]["RayID"] == "aaaaaaaaaaaaaaaa"
+    assert sampler.buffered_lines == 3
+    assert next(kept)[1]["RayID"] == "bbbbbbbbbbbbbbbb"
+    assert sampler.buffered_lines == 2
+    assert next(kept)[1]["RayID"] == "cccccccccccccccc"
+    assert sampler.buffered_lines == 1
+    assert list(kept) == []
+    assert sampler.buffered_lines == 0
+
+
+def test_buffer_is_bounded():
+    lines = [_line("%016x" % (i + 1), status=500) for i in range(100)]
+    sampler = TraceSampler(sampling_rate=1, max_buffered_lines=10)
+
+    kept = sampler.sample_lines(iter(lines), {})
+
+    next(kept)
+    assert sampler.buffered_lines == 11
+    assert len(list(kept)) == 99
+
+
+def test_lines_without_ray_id():
+    lines = [orjson.dumps({"EdgeResponseStatus": 500}) for _ in range(10)]
+
+    kept = list(TraceSampler(sampling_rate=10**9).sample_lines(lines, {}))
+
+    assert len(kept) == 10
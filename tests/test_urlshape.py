@@ -1,6 +1,18 @@
+import urllib.parse
+
 import pytest
 
-from honeyflare.urlshape import compile_pattern, urlshape, UrlShape
+from honeyflare.urlshape import (
+    compile_pattern,
+    get_url_shaper,
+    parse_query,
+    PathShapeInferrer,
+    split_uri,
+    urlshape,
+    PatternRouter,
+    UrlShape,
+    UrlShaper,
+)
 
 
 @pytest.mark.parametrize(
@@ -86,3 +98,192 @@ from honeyflare.urlshape import compile_pattern, urlshape, UrlShape
 def test_urlshape(uri, pattern, query_params_filter, expected):
     ret = urlshape(uri, [compile_pattern(pattern)], query_params_filter)
     assert ret == expected
+
+
+def test_url_shaper_caches_shapes():
+    shaper = UrlShaper([compile_pattern("/user/:userId/*")], set(["key"]), cache_size=2)
+
+    shape = shaper.urlshape("/user/id1337/pictures?key=val&other=1")
+    assert shape == urlshape(
+        "/user/id1337/pictures?key=val&other=1",
+        [compile_pattern("/user/:userId/*")],
+        set(["key"]),
+    )
+    assert shaper.urlshape("/user/id1337/pictures?key=val&other=1") is shape
+    assert shaper.cache_info().hits == 1
+    assert shaper.cache_info().misses == 1
+
+    shaper.urlshape("/a")
+    shaper.urlshape("/b")
+    assert shaper.cache_info().currsize == 2
+
+
+def test_get_url_shaper_is_shared():
+    shaper = get_url_shaper(["/user/:userId"], ["key"])
+
+    assert get_url_shaper(["/user/:userId"], set(["key"])) is shaper
+    assert get_url_shaper(["/user/:userId"], None) is not shaper
+    assert shaper.urlshape("/user/1").path_shape == "/user/:userId"
+
+
+ROUTER_PATTERNS = [
+    "/",
+    "/users/",
+    "/users/:userId",
+    "/users/:userId/pictures/",
+    "/users/me",
+    "/users/:userId/*",
+    "/books/*",
+    "/books/:bookId/chapters/:chapter",
+    "/static/v[0-9]+/:file",
+    "/files*",
+    "/*",
+]
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "",
+        "/",
+        "//",
+        "/users",
+        "/users/",
+        "/users/me",
+        "/users/me/",
+        "/users/1337",
+        "/users/1337/pictures",
+        "/users/1337/pictures/",
+        "/users/1337/pictures/1",
+        "/users//pictures/",
+        "/books",
+        "/booksellers/1",
+        "/books/1/chapters/2",
+        "/static/v12/app.js",
+        "/static/vx/app.js",
+        "/files/a/b",
+        "/other",
+        "relative/path",
+    ],
+)
+@pytest.mark.parametrize("patterns", [ROUTER_PATTERNS, ROUTER_PATTERNS[:-1]])
+def test_pattern_router_matches_first_pattern(path, patterns):
+    patterns = [compile_pattern(pattern) for pattern in patterns]
+    expected = next(
+        (pattern for pattern in patterns if pattern.regex.match(path)), None
+    )
+
+    pattern, match = PatternRouter(patterns).match(path)
+
+    assert pattern == expected
+    assert (match is not None) == (expected is not None)
+
+
+def test_url_shaper_patterns_by_host():
+    shaper = get_url_shaper(
+        {
+            "example.com": ["/users/:userId"],
+            "*.example.com": ["/api/:version/*"],
+            "*.eu.example.com": ["/eu/*"],
+            "*": ["/*"],
+        }
+    )
+
+    assert shaper.urlshape("/users/1", "example.com").path_shape == "/users/:userId"
+    assert shaper.urlshape("/users/1", "EXAMPLE.com").path_shape == "/users/:userId"
+    assert shaper.urlshape("/api/v1/x", "example.com").path_shape == "/api/v1/x"
+    assert shaper.urlshape("/api/v1/x", "a.example.com").path_shape == "/api/:version/*"
+    assert shaper.urlshape("/eu/x", "a.eu.example.com").path_shape == "/eu/*"
+    assert shaper.urlshape("/users/1", "other.com").path_shape == "/*"
+    assert shaper.urlshape("/users/1").path_shape == "/*"
+    assert shaper.urlshape("/users/1", "notexample.com").path_shape == "/*"
+
+
+def test_get_url_shaper_by_host_is_shared():
+    shaper = get_url_shaper({"example.com": ["/users/:userId"]})
+
+    assert get_url_shaper({"example.com": ["/users/:userId"]}) is shaper
+    assert get_url_shaper({"example.com": ["/users/:id"]}) is not shaper
+
+
+@pytest.mark.parametrize(
+    "uri",
+    [
+        "/",
+        "/path",
+        "/path?",
+        "/path?a=1&b=2",
+        "/path?b=2&a=1&a=0&a=3",
+        "/path?a&b=&=c&&d=1=2",
+        "/path?na+me=va+lue&%C3%A6=%C3%B8&bad=%ZZ%E2",
+        "/path?a=1#fragment",
+        "/path;params?a=1",
+        "//double/slash?a=1",
+        "/tab\tin?a=1",
+        "relative/path?a=1",
+        "",
+    ],
+)
+@pytest.mark.parametrize("query_param_filter", [None, set(["a", "na me"])])
+def test_split_uri_and_parse_query_match_urllib(uri, query_param_filter):
+    parsed_uri = urllib.parse.urlparse("s://" + uri)
+    expected_params = []
+    expected_query_params = {}
+    for param, value in sorted(
+        urllib.parse.parse_qsl(parsed_uri.query, keep_blank_values=True)
+    ):
+        if query_param_filter is None or param in query_param_filter:
+            expected_query_params[param] = value
+        expected_params.append(param)
+
+    path, query = split_uri(uri)
+
+    assert (path, query) == (parsed_uri.path, parsed_uri.query)
+    assert parse_query(query, query_param_filter) == (
+        expected_params,
+        expected_query_params,
+    )
+
+
+@pytest.mark.parametrize(
+    "path, expected",
+    [
+        ("/", "/"),
+        ("/users/1337", "/users/:id"),
+        ("/users/1337/", "/users/:id/"),
+        ("/files/3f2504e0-4f89-11d3-9a0c-0305e82c3301/raw", "/files/:uuid/raw"),
+        ("/commits/9f86d081884c7d659a2feaa0c55ad015", "/commits/:hash"),
+        ("/reset/eyJhbGciOiJIUzI1NiJ9.abc123xyz", "/reset/:token"),
+        ("/blog/a-long-post-title-without-numbers", "/blog/a-long-post-title-without-numbers"),
+        ("/v2/api", "/v2/api"),
+    ],
+)
+def test_path_shape_inferrer(path, expected):
+    assert PathShapeInferrer().infer(path) == expected
+
+
+def test_path_shape_inferrer_caps_shapes():
+    inferrer = PathShapeInferrer(max_shapes=2)
+
+    assert inferrer.infer("/a/1") == "/a/:id"
+    assert inferrer.infer("/b/2") == "/b/:id"
+    assert inferrer.infer("/c/3") == "/:other"
+    assert inferrer.infer("/a/4") == "/a/:id"
+    assert inferrer.shapes == set(["/a/:id", "/b/:id"])
+    assert inferrer.overflowed == 1
+
+
+def test_url_shaper_infers_unmatched_path_shapes():
+    shaper = get_url_shaper(["/users/:userId"], max_inferred_shapes=10)
+
+    shape = shaper.urlshape("/users/1337")
+    assert (shape.path_shape, shape.path_shape_strict) == (
+        "/users/:userId",
+        "/users/:userId",
+    )
+    shape = shaper.urlshape("/posts/1337?page=2")
+    assert (shape.path_shape, shape.path_shape_strict) == ("/posts/:id", None)
+    assert shape.uri_shape == "/posts/:id?page=?"
+    assert get_url_shaper(["/users/:userId"]).urlshape("/posts/1").path_shape == (
+        "/posts/1"
+    )
@@ -0,0 +1,76 @@
+import pytest
+
+from honeyflare.enrichment import enrich_entry
+from honeyflare.useragent import classify, UserAgent
+
+
+@pytest.mark.parametrize(
+    "user_agent, expected",
+    [
+        (
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+            "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+            UserAgent("Chrome", "Windows", "desktop", False),
+        ),
+        (
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+            "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0",
+            UserAgent("Edge", "Windows", "desktop", False),
+        ),
+        (
+            "Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) "
+            "AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Mobile/15E148 "
+            "Safari/604.1",
+            UserAgent("Safari", "iOS", "mobile", False),
+        ),
+        (
+            "Mozilla/5.0 (Macintosh; Intel Mac OS X 14.1; rv:120.0) Gecko/20100101 "
+            "Firefox/120.0",
+            UserAgent("Firefox", "macOS", "desktop", False),
+        ),
+        (
+            "Mozilla/5.0 (Linux; Android 14; SM-X710) AppleWebKit/537.36 (KHTML, "
+            "like Gecko) Chrome/120.0.0.0 Safari/537.36",
+            UserAgent("Chrome", "Android", "tablet", False),
+        ),
+        (
+            "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, "
+            "like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36",
+            UserAgent("Chrome", "Android", "mobile", False),
+        ),
+        (
+            "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+            UserAgent("Googlebot", "Other", "bot", True),
+        ),
+        ("curl/8.4.0", UserAgent("curl", "Other", "bot", True)),
+        ("SomeCrawler/1.0", UserAgent("Other", "Other", "bot", True)),
+        (
+            "Mozilla/5.0 (compatible; DotBot/1.2; +https://opensiteexplorer.org/dotbot)",
+            UserAgent("Other", "Other", "bot", True),
+        ),
+        ("a bot", UserAgent("Other", "Other", "bot", True)),
+        (
+            "Mozilla/5.0 (Linux; Android 10; CUBOT X19) AppleWebKit/537.36 (KHTML, "
+            "like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36",
+            UserAgent("Chrome", "Android", "mobile", False),
+        ),
+        ("something else", UserAgent("Other", "Other", "desktop", False)),
+    ],
+)
+def test_classify(user_agent, expected):
+    assert classify(user_agent) == expected
+
+
+def test_enrich_user_agent():
+    entry = {"ClientRequestUserAgent": "curl/8.4.0"}
+
+    enrich_entry(entry, [], None)
+
+    assert entry["UserAgentFamily"] == "curl"
+    assert entry["UserAgentOS"] == "Other"
+    assert entry["UserAgentDevice"] == "bot"
+    assert entry["UserAgentBot"] is True
+
+    entry = {"ClientRequestUserAgent": ""}
+    enrich_entry(entry, [], None)
+    assert "UserAgentFamily" not in entry
@@ -0,0 +1,102 @@
+#!./venv/bin/python
+
+"""
+Benchmark the compression of OTLP export requests in `honeyflare.compress`, for
+each algorithm and a range of levels, on batches of synthetic Logpush-like spans
+encoded the way the direct export engine does.
+"""
+
+import argparse
+import random
+import time
+
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import (
+    ExportTraceServiceRequest,
+)
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans, ScopeSpans, Span
+
+from honeyflare import compress, otlp
+
+
+LEVELS = {"gzip": (1, 6, 9), "zstd": (1, 3, 9, 19)}
+
+
+def main():
+    args = get_args()
+    data = create_request(args.batch_size)
+    print("%d spans per request, %.1f KiB" % (args.batch_size, len(data) / 1024))
+    for algorithm in ("gzip", "zstd"):
+        if algorithm not in compress.ALGORITHMS:
+            print("%-10s not installed" % algorithm)
+            continue
+        for level in LEVELS[algorithm]:
+            compressor = compress.Compressor(algorithm, level)
+            compressed = compressor.compress(data)
+            duration = best_of(args.repeat, lambda: compressor.compress(data))
+            print(
+                "%-10s %6.2fms %6.1f KiB %6.2fx"
+                % (
+                    "%s %d" % (algorithm, level),
+                    duration * 1000,
+                    len(compressed) / 1024,
+                    len(data) / len(compressed),
+                )
+            )
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--batch-size", default=otlp.BATCH_SIZE, type=int)
+    parser.add_argument("-r", "--repeat", default=20, type=int)
+    return parser.parse_args()
+
+
+def create_request(batch_size):
+    rand = random.Random(0)
+    spans = []
+    for _ in range(batch_size):
+        ray_id = rand.getrandbits(64)
+        spans.append(
+            Span(
+                trace_id=ray_id.to_bytes(16, "big"),
+                span_id=ray_id.to_bytes(8, "big"),
+                name="HTTP GET",
+                start_time_unix_nano=1582850070117000000,
+                end_time_unix_nano=1582850070117000000,
+                attributes=otlp.encode_attributes(
+                    {
+                        "ClientRequestURI": "/users/%d/pictures?page=%d"
+                        % (rand.randint(1, 10**6), rand.randint(1, 10)),
+                        "ClientRequestMethod": "GET",
+                        "ClientIP": "203.0.113.%d" % rand.randint(1, 254),
+                        "EdgeResponseStatus": rand.choice((200, 200, 304, 404)),
+                        "EdgeStartTimestamp": 1582850070112000000,
+                        "EdgeEndTimestamp": 1582850070117000000,
+                        "OriginResponseTime": rand.randint(10**6, 10**9),
+                        "PathShape": "/users/?/pictures",
+                        "QueryShape": "page=?",
+                        "RayID": "%016x" % ray_id,
+                        "RequestHeaders": '{"x-request-id":"%032x"}'
+                        % rand.getrandbits(128),
+                        "SampleRate": 1,
+                    }
+                ),
+            )
+        )
+    request = ExportTraceServiceRequest(
+        resource_spans=[ResourceSpans(scope_spans=[ScopeSpans(spans=spans)])]
+    )
+    return request.SerializeToString()
+
+
+def best_of(repeat, func):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!./venv/bin/python
+
+"""
+Benchmark the decompression backends in `honeyflare.decompress`, with and without
+the background thread, against the original stdlib `gzip.open(..., "rt")` path.
+
+Each run reads a synthetic Logpush-like file and parses every line with orjson to
+stand in for the work done per line, which the threaded mode overlaps with
+inflate.
+"""
+
+import argparse
+import gzip
+import os
+import random
+import tempfile
+import time
+
+import orjson
+
+from honeyflare import decompress
+
+
+def main():
+    args = get_args()
+    path = create_file(args.lines)
+    try:
+        print(
+            "%d lines, %.1f MiB compressed"
+            % (args.lines, os.path.getsize(path) / 1024 / 1024)
+        )
+        baseline = best_of(args.repeat, lambda: stdlib_text(path))
+        print("%-24s %8.3fs" % ("gzip text (baseline)", baseline))
+        for backend in decompress.PREFERRED_BACKENDS:
+            if backend not in decompress.BACKENDS:
+                print("%-24s not installed" % backend)
+                continue
+            for threaded in (False, True):
+                duration = best_of(
+                    args.repeat,
+                    lambda backend=backend, threaded=threaded: honeyflare_bytes(
+                        path, backend, threaded
+                    ),
+                )
+                print(
+                    "%-24s %8.3fs %6.2fx"
+                    % (
+                        "%s%s" % (backend, " threaded" if threaded else ""),
+                        duration,
+                        baseline / duration,
+                    )
+                )
+    finally:
+        os.remove(path)
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--lines", default=200000, type=int)
+    parser.add_argument("-r", "--repeat", default=3, type=int)
+    return parser.parse_args()
+
+
+def create_file(lines):
+    rand = random.Random(0)
+    with tempfile.NamedTemporaryFile(suffix=".gz", delete=False) as tmp_fh:
+        with gzip.GzipFile(fileobj=tmp_fh, mode="w") as gzip_fh:
+            for _ in range(lines):
+                gzip_fh.write(
+                    orjson.dumps(
+                        {
+                            "ClientRequestURI": "/users/%d/pictures?page=%d"
+                            % (rand.randint(1, 10**6), rand.randint(1, 10)),
+                            "EdgeResponseStatus": rand.choice((200, 200, 304, 404)),
+                            "EdgeStartTimestamp": 1582850070112000000,
+                            "EdgeEndTimestamp": 1582850070117000000,
+                            "RayID": "%016x" % rand.getrandbits(64),
+                            "RequestHeaders": {
+                                "accept": "text/html",
+                                "x-request-id": "%032x" % rand.getrandbits(128),
+                            },
+                        }
+                    )
+                )
+                gzip_fh.write(b"\n")
+        return tmp_fh.name
+
+
+def stdlib_text(path):
+    with gzip.open(path, "rt") as fh:
+        for line in fh:
+            orjson.loads(line)
+
+
+def honeyflare_bytes(path, backend, threaded):
+    with decompress.open_gzip(path, backend) as fh:
+        for line in decompress.iter_lines(fh, threaded=threaded):
+            orjson.loads(line)
+
+
+def best_of(repeat, func):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+if __name__ == "__main__":
+    main()
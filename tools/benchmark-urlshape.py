@@ -0,0 +1,128 @@
+#!./venv/bin/python
+
+"""
+Benchmark `honeyflare.urlshape.urlshape` against the original implementation
+based on `urllib.parse.urlparse` and `parse_qsl`, on a mix of URIs like those in
+Cloudflare's ClientRequestURI. Both run uncached, as on a `UrlShaper` cache miss.
+"""
+
+import argparse
+import random
+import time
+import urllib.parse
+
+from honeyflare.urlshape import UrlShape, compile_pattern, match_path, urlshape
+
+PATTERNS = [
+    "/users/:userId",
+    "/users/:userId/pictures/*",
+    "/books/:bookId/chapters/:chapter",
+    "/static/*",
+]
+
+
+def main():
+    args = get_args()
+    uris = create_uris(args.uris)
+    patterns = [compile_pattern(pattern) for pattern in PATTERNS]
+    for query_param_filter in (None, set(["page"])):
+        for uri in uris:
+            assert urlshape(uri, patterns, query_param_filter) == original_urlshape(
+                uri, patterns, query_param_filter
+            )
+
+        baseline = best_of(
+            args.repeat,
+            lambda: [
+                original_urlshape(uri, patterns, query_param_filter) for uri in uris
+            ],
+        )
+        duration = best_of(
+            args.repeat,
+            lambda: [urlshape(uri, patterns, query_param_filter) for uri in uris],
+        )
+        print("query_param_filter=%r" % (query_param_filter,))
+        print("%-24s %8.3fs" % ("urlparse (baseline)", baseline))
+        print("%-24s %8.3fs %6.2fx" % ("urlshape", duration, baseline / duration))
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--uris", default=100000, type=int)
+    parser.add_argument("-r", "--repeat", default=3, type=int)
+    return parser.parse_args()
+
+
+def create_uris(count):
+    rand = random.Random(0)
+    uris = []
+    for _ in range(count):
+        uri = rand.choice(
+            (
+                "/users/%d" % rand.randint(1, 10**6),
+                "/users/%d/pictures/%d.jpg"
+                % (rand.randint(1, 10**6), rand.randint(1, 100)),
+                "/books/%d/chapters/%d" % (rand.randint(1, 1000), rand.randint(1, 30)),
+                "/static/app.%08x.js" % rand.getrandbits(32),
+                "/search",
+            )
+        )
+        query = rand.choice(
+            (
+                "",
+                "page=%d" % rand.randint(1, 10),
+                "page=%d&sort=desc&utm_source=news" % rand.randint(1, 10),
+                "q=hello+world%%21&page=%d" % rand.randint(1, 10),
+            )
+        )
+        uris.append(uri + "?" + query if query else uri)
+    return uris
+
+
+def original_urlshape(uri, patterns, query_param_filter=None):
+    parsed_uri = urllib.parse.urlparse("s://" + uri)
+    path_params = {}
+    query_params = {}
+    pattern, match = match_path(parsed_uri.path, patterns)
+    if pattern is not None:
+        path_shape = pattern.shape
+        path_shape_strict = pattern.shape
+        path_params = match.groupdict()
+    else:
+        path_shape = parsed_uri.path
+        path_shape_strict = None
+
+    params = []
+    for param, value in sorted(
+        urllib.parse.parse_qsl(parsed_uri.query, keep_blank_values=True)
+    ):
+        if query_param_filter is None or param in query_param_filter:
+            query_params[param] = value
+        params.append(param)
+
+    query_shape = "&".join("%s=?" % param for param in params)
+    uri_shape = path_shape + "?" + query_shape if query_shape else path_shape
+
+    return UrlShape(
+        uri_shape,
+        parsed_uri.path,
+        parsed_uri.query,
+        path_shape,
+        path_shape_strict,
+        query_shape,
+        path_params,
+        query_params,
+    )
+
+
+def best_of(repeat, func):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+if __name__ == "__main__":
+    main()